@@ -2,13 +2,114 @@
 RESTful API Routes - Tuân thủ nguyên tắc Stateless
 Sử dụng JWT cho authentication thay vì session
 """
-from flask import Blueprint, request, jsonify
-from models import db, Book, BorrowRecord
+import hashlib
+from operator import attrgetter
+from flask import Blueprint, request, jsonify, make_response, current_app
+from sqlalchemy.orm import joinedload
+from models import db, Book, BorrowRecord, utcnow
 from auth import token_required, generate_token
 from datetime import datetime
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+# Client được lưu response nhưng mỗi lần đọc đều hỏi lại server bằng ETag (304 nếu không đổi)
+CACHE_CONTROL = 'private, no-cache'
+
+# Các cột trả về cho endpoint đọc (select trực tiếp bằng Core thay vì load ORM object)
+BOOK_KEYS = ('id', 'title', 'author', 'isbn', 'quantity', 'available', 'created_at')
+BOOK_COLUMNS = tuple(getattr(Book, key) for key in BOOK_KEYS)
+_book_values = attrgetter(*BOOK_KEYS)
+BORROW_RECORD_COLUMNS = (
+    BorrowRecord.id, BorrowRecord.book_id, Book.title.label('book_title'),
+    BorrowRecord.borrower_name, BorrowRecord.borrower_email,
+    BorrowRecord.borrow_date, BorrowRecord.return_date, BorrowRecord.status
+)
+
+
+# ============== Query Helpers ==============
+
+def book_to_dict(book):
+    """Serialize Book thành dict response (cùng các trường với BOOK_COLUMNS)"""
+    return dict(zip(BOOK_KEYS, _book_values(book)))
+
+
+
+def _fetch_dicts(stmt):
+    """Execute select statement và trả về list dict (RowMapping, không ORM instrumentation)"""
+    return [dict(row) for row in db.session.execute(stmt).mappings()]
+
+
+def _pagination_params():
+    """
+    Đọc page/per_page từ query string, giới hạn per_page trong 1..MAX_PAGE_SIZE
+    (dùng chung cho cả nhánh cursor lẫn nhánh page)
+    
+    Returns:
+        (page, per_page)
+    """
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', current_app.config['DEFAULT_PAGE_SIZE'], type=int)
+    
+    page = max(1, page)
+    per_page = min(max(1, per_page), current_app.config['MAX_PAGE_SIZE'])
+    
+    return page, per_page
+
+
+def _paginate_dicts(stmt, page, per_page):
+    """
+    Phân trang OFFSET/LIMIT cho select statement dạng cột
+    Giữ cùng quy ước với paginate(error_out=False) của Flask-SQLAlchemy
+    
+    Returns:
+        (items, total, page, pages)
+    """
+    page = page if page and page > 0 else 1
+    per_page = per_page if per_page and per_page > 0 else 20
+    
+    total = db.session.execute(
+        db.select(db.func.count()).select_from(stmt.order_by(None).subquery())
+    ).scalar()
+    items = _fetch_dicts(stmt.limit(per_page).offset((page - 1) * per_page))
+    pages = -(-total // per_page) if total else 0
+    
+    return items, total, page, pages
+
+
+# ============== HTTP Caching Helpers ==============
+
+def _books_version():
+    """
+    Phiên bản hiện tại của bảng books: (max(updated_at), count)
+    Thay đổi khi có sách được thêm, sửa, xóa hoặc mượn/trả
+    """
+    return db.session.execute(db.select(
+        db.func.max(Book.updated_at),
+        db.func.count(Book.id)
+    )).one()
+
+
+def _make_etag(*parts):
+    """Tạo ETag từ các thành phần phiên bản dữ liệu"""
+    return hashlib.md5('|'.join(str(p) for p in parts).encode()).hexdigest()
+
+
+def _not_modified(etag):
+    """Trả về 304 nếu client đã có bản mới nhất (If-None-Match khớp ETag)"""
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        return response
+    return None
+
+
+def _cacheable(response, etag):
+    """Gắn ETag và Cache-Control vào response"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
+
 
 # ============== Authentication Endpoints ==============
 
@@ -46,42 +147,54 @@ def get_books():
     Stateless: Mỗi request độc lập, không phụ thuộc session
     """
     # Query parameters cho filtering và pagination
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    page, per_page = _pagination_params()
     author = request.args.get('author', type=str)
     available_only = request.args.get('available_only', 'false').lower() == 'true'
     
-    # Build query
-    query = Book.query
+    # Conditional GET: ETag phụ thuộc phiên bản dữ liệu và query string
+    etag = _make_etag(*_books_version(), request.query_string.decode())
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    
+    # Build query - chỉ select các cột cần trả về (Core, không tạo ORM object)
+    stmt = db.select(*BOOK_COLUMNS)
     
     if author:
-        query = query.filter(Book.author.ilike(f'%{author}%'))
+        stmt = stmt.where(Book.author.ilike(f'%{author}%'))
     
     if available_only:
-        query = query.filter(Book.available > 0)
+        stmt = stmt.where(Book.available > 0)
+    
+    # Cursor pagination (?after=<id>): seek theo primary key, không OFFSET, không COUNT(*)
+    # Truyền after rỗng (?after=) để lấy trang đầu tiên ở chế độ cursor
+    if 'after' in request.args:
+        after = request.args.get('after', '')
+        if after:
+            if not after.isdigit():
+                return jsonify({'error': 'Invalid cursor'}), 400
+            stmt = stmt.where(Book.id < int(after))
+        
+        books = _fetch_dicts(stmt.order_by(Book.id.desc()).limit(per_page + 1))
+        has_more = len(books) > per_page
+        books = books[:per_page]
+        
+        return _cacheable(jsonify({
+            'books': books,
+            'next_cursor': str(books[-1]['id']) if has_more else None,
+            'per_page': per_page
+        }), etag), 200
     
     # Pagination
-    pagination = query.order_by(Book.id.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    
-    books = [{
-        'id': book.id,
-        'title': book.title,
-        'author': book.author,
-        'isbn': book.isbn,
-        'quantity': book.quantity,
-        'available': book.available,
-        'created_at': book.created_at.isoformat()
-    } for book in pagination.items]
+    books, total, page, pages = _paginate_dicts(stmt.order_by(Book.id.desc()), page, per_page)
     
-    return jsonify({
+    return _cacheable(jsonify({
         'books': books,
-        'total': pagination.total,
-        'page': pagination.page,
-        'pages': pagination.pages,
+        'total': total,
+        'page': page,
+        'pages': pages,
         'per_page': per_page
-    }), 200
+    }), etag), 200
 
 
 @api_bp.route('/books/<int:book_id>', methods=['GET'])
@@ -90,20 +203,14 @@ def get_book(book_id):
     Lấy thông tin chi tiết một cuốn sách
     Stateless: Response chứa đầy đủ thông tin, không cần state từ request trước
     """
-    book = Book.query.get(book_id)
+    book = db.session.execute(
+        db.select(*BOOK_COLUMNS).where(Book.id == book_id)
+    ).mappings().first()
     
     if not book:
         return jsonify({'error': 'Book not found'}), 404
     
-    return jsonify({
-        'id': book.id,
-        'title': book.title,
-        'author': book.author,
-        'isbn': book.isbn,
-        'quantity': book.quantity,
-        'available': book.available,
-        'created_at': book.created_at.isoformat()
-    }), 200
+    return jsonify(dict(book)), 200
 
 
 @api_bp.route('/books', methods=['POST'])
@@ -115,6 +222,10 @@ def create_book(current_user):
     """
     data = request.get_json()
     
+    # Batch insert: body là JSON array các sách
+    if isinstance(data, list):
+        return _create_books_batch(data)
+    
     # Validation
     if not data or not all(k in data for k in ['title', 'author', 'isbn', 'quantity']):
         return jsonify({'error': 'Missing required fields: title, author, isbn, quantity'}), 400
@@ -144,21 +255,60 @@ def create_book(current_user):
         
         return jsonify({
             'message': 'Book created successfully',
-            'book': {
-                'id': new_book.id,
-                'title': new_book.title,
-                'author': new_book.author,
-                'isbn': new_book.isbn,
-                'quantity': new_book.quantity,
-                'available': new_book.available,
-                'created_at': new_book.created_at.isoformat()
-            }
+            'book': book_to_dict(new_book)
         }), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Failed to create book: {str(e)}'}), 500
 
 
+def _create_books_batch(items):
+    """
+    Thêm nhiều sách trong một request và một transaction
+    Validate toàn bộ trước, kiểm tra ISBN trùng bằng một query IN, insert bằng bulk_insert_mappings
+    """
+    if not items:
+        return jsonify({'error': 'No books provided'}), 400
+    
+    rows = []
+    isbns = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not all(k in item for k in ['title', 'author', 'isbn', 'quantity']):
+            return jsonify({
+                'error': f'Book #{index}: Missing required fields: title, author, isbn, quantity'
+            }), 400
+        if item['quantity'] < 1:
+            return jsonify({'error': f'Book #{index}: Quantity must be at least 1'}), 400
+        if item['isbn'] in isbns:
+            return jsonify({'error': f'Book #{index}: Duplicate ISBN {item["isbn"]} in request'}), 400
+        isbns.add(item['isbn'])
+        rows.append({
+            'title': item['title'],
+            'author': item['author'],
+            'isbn': item['isbn'],
+            'quantity': item['quantity'],
+            'available': item['quantity']
+        })
+    
+    existing = db.session.execute(
+        db.select(Book.isbn).where(Book.isbn.in_(isbns))
+    ).scalars().all()
+    if existing:
+        return jsonify({'error': f'ISBN already exists: {", ".join(existing)}'}), 409
+    
+    try:
+        db.session.bulk_insert_mappings(Book, rows)
+        db.session.commit()
+        
+        return jsonify({
+            'message': f'{len(rows)} books created successfully',
+            'count': len(rows)
+        }), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': f'Failed to create books: {str(e)}'}), 500
+
+
 @api_bp.route('/books/<int:book_id>', methods=['PUT'])
 @token_required
 def update_book(current_user, book_id):
@@ -166,7 +316,7 @@ def update_book(current_user, book_id):
     Cập nhật thông tin sách (yêu cầu authentication)
     Stateless: Request chứa đầy đủ thông tin cần update
     """
-    book = Book.query.get(book_id)
+    book = db.session.get(Book, book_id)
     
     if not book:
         return jsonify({'error': 'Book not found'}), 404
@@ -209,15 +359,7 @@ def update_book(current_user, book_id):
         
         return jsonify({
             'message': 'Book updated successfully',
-            'book': {
-                'id': book.id,
-                'title': book.title,
-                'author': book.author,
-                'isbn': book.isbn,
-                'quantity': book.quantity,
-                'available': book.available,
-                'created_at': book.created_at.isoformat()
-            }
+            'book': book_to_dict(book)
         }), 200
     except Exception as e:
         db.session.rollback()
@@ -231,14 +373,17 @@ def delete_book(current_user, book_id):
     Xóa sách (yêu cầu authentication)
     Stateless: Mỗi request độc lập
     """
-    book = Book.query.get(book_id)
+    book = db.session.get(Book, book_id)
     
     if not book:
         return jsonify({'error': 'Book not found'}), 404
     
-    # Kiểm tra sách đang được mượn
-    borrowed_count = BorrowRecord.query.filter_by(book_id=book_id, status='borrowed').count()
-    if borrowed_count > 0:
+    # Kiểm tra sách đang được mượn - EXISTS dừng ngay ở bản ghi đầu tiên, không COUNT(*)
+    has_borrowed = db.session.query(
+        BorrowRecord.query.filter_by(book_id=book_id, status='borrowed').exists()
+    ).scalar()
+    if has_borrowed:
+        borrowed_count = book.quantity - book.available
         return jsonify({
             'error': f'Cannot delete book. {borrowed_count} copies are currently borrowed'
         }), 409
@@ -264,36 +409,52 @@ def get_borrow_records(current_user):
     """
     # Query parameters
     status = request.args.get('status', type=str)  # 'borrowed' or 'returned'
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    page, per_page = _pagination_params()
     
-    # Build query
-    query = BorrowRecord.query
+    # Build query - JOIN lấy book_title trong cùng một SELECT (không N+1, không ORM object)
+    stmt = db.select(*BORROW_RECORD_COLUMNS).join(Book, BorrowRecord.book_id == Book.id)
     
     if status in ['borrowed', 'returned']:
-        query = query.filter_by(status=status)
+        stmt = stmt.where(BorrowRecord.status == status)
+    
+    # Cursor pagination (?after=<borrow_date>|<id>): seek theo (borrow_date, id)
+    # Truyền after rỗng (?after=) để lấy trang đầu tiên ở chế độ cursor
+    if 'after' in request.args:
+        after = request.args.get('after', '')
+        if after:
+            try:
+                after_date, after_id = after.rsplit('|', 1)
+                after_date, after_id = datetime.fromisoformat(after_date), int(after_id)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            stmt = stmt.where(db.or_(
+                BorrowRecord.borrow_date < after_date,
+                db.and_(BorrowRecord.borrow_date == after_date, BorrowRecord.id < after_id)
+            ))
+        
+        records = _fetch_dicts(stmt.order_by(
+            BorrowRecord.borrow_date.desc(), BorrowRecord.id.desc()
+        ).limit(per_page + 1))
+        has_more = len(records) > per_page
+        records = records[:per_page]
+        last = records[-1] if has_more else None
+        
+        return jsonify({
+            'records': records,
+            'next_cursor': f"{last['borrow_date'].isoformat()}|{last['id']}" if last else None,
+            'per_page': per_page
+        }), 200
     
     # Pagination
-    pagination = query.order_by(BorrowRecord.borrow_date.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
+    records, total, page, pages = _paginate_dicts(
+        stmt.order_by(BorrowRecord.borrow_date.desc()), page, per_page
     )
     
-    records = [{
-        'id': record.id,
-        'book_id': record.book_id,
-        'book_title': record.book.title,
-        'borrower_name': record.borrower_name,
-        'borrower_email': record.borrower_email,
-        'borrow_date': record.borrow_date.isoformat(),
-        'return_date': record.return_date.isoformat() if record.return_date else None,
-        'status': record.status
-    } for record in pagination.items]
-    
     return jsonify({
         'records': records,
-        'total': pagination.total,
-        'page': pagination.page,
-        'pages': pagination.pages,
+        'total': total,
+        'page': page,
+        'pages': pages,
         'per_page': per_page
     }), 200
 
@@ -305,7 +466,7 @@ def get_borrow_record(current_user, record_id):
     Lấy thông tin chi tiết một bản ghi mượn sách
     Stateless: Response đầy đủ thông tin
     """
-    record = BorrowRecord.query.get(record_id)
+    record = db.session.get(BorrowRecord, record_id, options=[joinedload(BorrowRecord.book)])
     
     if not record:
         return jsonify({'error': 'Borrow record not found'}), 404
@@ -316,8 +477,8 @@ def get_borrow_record(current_user, record_id):
         'book_title': record.book.title,
         'borrower_name': record.borrower_name,
         'borrower_email': record.borrower_email,
-        'borrow_date': record.borrow_date.isoformat(),
-        'return_date': record.return_date.isoformat() if record.return_date else None,
+        'borrow_date': record.borrow_date,
+        'return_date': record.return_date,
         'status': record.status
     }), 200
 
@@ -338,14 +499,23 @@ def create_borrow_record(current_user):
         }), 400
     
     book_id = data['book_id']
-    book = Book.query.get(book_id)
     
-    if not book:
-        return jsonify({'error': 'Book not found'}), 404
+    # Giảm số lượng sách available bằng một UPDATE có điều kiện
+    # Kiểm tra và trừ trong cùng một câu lệnh nên không bị lost-update khi mượn đồng thời
+    rows = db.session.execute(
+        db.update(Book)
+        .where(Book.id == book_id, Book.available > 0)
+        .values(available=Book.available - 1)
+    ).rowcount
     
-    if book.available <= 0:
+    if not rows:
+        db.session.rollback()
+        if not db.session.get(Book, book_id):
+            return jsonify({'error': 'Book not found'}), 404
         return jsonify({'error': 'Book is not available'}), 409
     
+    book = db.session.get(Book, book_id)
+    
     # Tạo bản ghi mượn sách
     borrow_record = BorrowRecord(
         book_id=book_id,
@@ -354,9 +524,6 @@ def create_borrow_record(current_user):
         status='borrowed'
     )
     
-    # Giảm số lượng sách available
-    book.available -= 1
-    
     try:
         db.session.add(borrow_record)
         db.session.commit()
@@ -369,7 +536,7 @@ def create_borrow_record(current_user):
                 'book_title': book.title,
                 'borrower_name': borrow_record.borrower_name,
                 'borrower_email': borrow_record.borrower_email,
-                'borrow_date': borrow_record.borrow_date.isoformat(),
+                'borrow_date': borrow_record.borrow_date,
                 'status': borrow_record.status
             }
         }), 201
@@ -385,7 +552,7 @@ def return_book(current_user, record_id):
     Trả sách (cập nhật bản ghi mượn sách)
     Stateless: Chỉ cần record_id, không cần thông tin từ request trước
     """
-    record = BorrowRecord.query.get(record_id)
+    record = db.session.get(BorrowRecord, record_id, options=[joinedload(BorrowRecord.book)])
     
     if not record:
         return jsonify({'error': 'Borrow record not found'}), 404
@@ -395,11 +562,15 @@ def return_book(current_user, record_id):
     
     # Cập nhật trạng thái
     record.status = 'returned'
-    record.return_date = datetime.utcnow()
-    
-    # Tăng số lượng sách available
-    book = Book.query.get(record.book_id)
-    book.available += 1
+    record.return_date = utcnow()
+    
+    # Tăng số lượng sách available (Book đã được load cùng record)
+    book = record.book
+    db.session.execute(
+        db.update(Book)
+        .where(Book.id == record.book_id)
+        .values(available=Book.available + 1)
+    )
     
     try:
         db.session.commit()
@@ -412,8 +583,8 @@ def return_book(current_user, record_id):
                 'book_title': book.title,
                 'borrower_name': record.borrower_name,
                 'borrower_email': record.borrower_email,
-                'borrow_date': record.borrow_date.isoformat(),
-                'return_date': record.return_date.isoformat(),
+                'borrow_date': record.borrow_date,
+                'return_date': record.return_date,
                 'status': record.status
             }
         }), 200
@@ -428,16 +599,32 @@ def return_book(current_user, record_id):
 def get_statistics():
     """
     Lấy thống kê hệ thống
-    Stateless: Tính toán dựa trên database hiện tại, không lưu cache
+    Stateless: Tính toán dựa trên database hiện tại, không lưu cache phía server
     """
-    total_books = Book.query.count()
-    available_books = db.session.query(db.func.sum(Book.available)).scalar() or 0
-    borrowed_books = BorrowRecord.query.filter_by(status='borrowed').count()
-    total_borrows = BorrowRecord.query.count()
-    
-    return jsonify({
-        'total_books': total_books,
-        'available_books': int(available_books),
-        'borrowed_books': borrowed_books,
-        'total_borrows': total_borrows
-    }), 200
+    # Gộp các phép đếm bằng conditional aggregate: 2 query thay vì 4
+    books_row = db.session.execute(db.select(
+        db.func.count(Book.id).label('total_books'),
+        db.func.coalesce(db.func.sum(Book.available), 0).label('available_books')
+    )).one()
+    
+    borrows_row = db.session.execute(db.select(
+        db.func.count(BorrowRecord.id).label('total_borrows'),
+        db.func.coalesce(db.func.sum(
+            db.case((BorrowRecord.status == 'borrowed', 1), else_=0)
+        ), 0).label('borrowed_books')
+    )).one()
+    
+    stats = {
+        'total_books': books_row.total_books,
+        'available_books': int(books_row.available_books),
+        'borrowed_books': int(borrows_row.borrowed_books),
+        'total_borrows': borrows_row.total_borrows
+    }
+    
+    # ETag từ chính các số liệu vừa tính - không tốn thêm query kiểm tra phiên bản
+    etag = _make_etag(*stats.values())
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    
+    return _cacheable(jsonify(stats), etag), 200
@@ -1,13 +1,17 @@
 from flask import Flask, render_template, request, redirect, url_for, flash
-from models import db, Book, BorrowRecord
+from models import db, Book, BorrowRecord, utcnow, upgrade_schema
 from config import Config
 from api_routes import api_bp
-from datetime import datetime
+from json_provider import OrjsonProvider
+from auth import init_jwt_keys
 import os
 
 # Tạo ứng dụng Flask
 app = Flask(__name__)
 
+# Dùng orjson cho jsonify (nhanh hơn, serialize datetime trực tiếp)
+app.json = OrjsonProvider(app)
+
 # Load configuration
 app.config.from_object(Config)
 
@@ -17,9 +21,31 @@ db.init_app(app)
 # Đăng ký API Blueprint (RESTful API - Stateless)
 app.register_blueprint(api_bp)
 
-# Tạo database và tables
-with app.app_context():
-    db.create_all()
+# Khóa JWT dùng chung mọi worker phải cấu hình qua JWT_PRIVATE_KEY;
+# chỉ dev server (python app.py, debug=True) hoặc DEBUG/TESTING được sinh khóa tạm
+init_jwt_keys(app, allow_ephemeral=__name__ == '__main__')
+
+
+def init_db():
+    """
+    Tạo database và tables (chạy một lần trước khi khởi động các worker)
+    Database đã có sẵn (vd. instance/library.db) được nâng cấp cột/index còn thiếu
+    """
+    with app.app_context():
+        db.create_all()
+        upgrade_schema(db.engine)
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Tạo database và tables: flask --app app init-db"""
+    init_db()
+    print('Database initialized')
+
+
+# Không chạy DDL mỗi lần import (mỗi worker); chỉ tạo tables khi INIT_DB=1
+if os.environ.get('INIT_DB') == '1':
+    init_db()
 
 
 # ============================================================
@@ -209,7 +235,7 @@ def return_book(record_id):
     
     # Cập nhật trạng thái
     record.status = 'returned'
-    record.return_date = datetime.utcnow()
+    record.return_date = utcnow()
     
     # Tăng số lượng sách available
     book = Book.query.get(record.book_id)
@@ -241,4 +267,5 @@ def borrow_records():
 
 
 if __name__ == '__main__':
+    init_db()
     app.run(debug=True)
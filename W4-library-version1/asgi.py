@@ -0,0 +1,15 @@
+"""
+ASGI entrypoint
+Chạy ứng dụng Flask dưới ASGI server (uvicorn) qua adapter của asgiref
+
+Sử dụng:
+    flask --app app init-db
+    uvicorn asgi:asgi_app --workers 4
+
+Nhiều worker cần chung một khóa ký JWT: đặt JWT_PRIVATE_KEY (xem .env.example),
+nếu không server dừng ngay khi khởi động
+"""
+from asgiref.wsgi import WsgiToAsgi
+from app import app
+
+asgi_app = WsgiToAsgi(app)
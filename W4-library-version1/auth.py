@@ -3,12 +3,77 @@ JWT Authentication Module
 Thực hiện Stateless Authentication theo nguyên tắc REST
 """
 import jwt
+import time
+import hashlib
+import threading
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import request, jsonify
+from cachetools import TTLCache
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519
+from flask import request, jsonify, g
 from config import Config
 
 
+def _load_jwt_keys(allow_ephemeral):
+    """
+    Load cặp khóa Ed25519 để ký (private) và verify (public) JWT
+    
+    Public key luôn suy ra từ JWT_PRIVATE_KEY; nếu cấu hình thêm JWT_PUBLIC_KEY thì phải khớp.
+    Không cấu hình khóa thì chỉ được sinh khóa tạm khi allow_ephemeral (DEBUG/TESTING):
+    mỗi process một khóa khác nhau, token ký ở worker này không verify được ở worker khác
+    và mất hiệu lực sau khi restart
+    """
+    if Config.JWT_PRIVATE_KEY:
+        private_key = serialization.load_pem_private_key(
+            Config.JWT_PRIVATE_KEY.encode(), password=None
+        )
+    elif Config.JWT_PUBLIC_KEY:
+        raise RuntimeError('JWT_PUBLIC_KEY is set without JWT_PRIVATE_KEY')
+    elif allow_ephemeral:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+    else:
+        raise RuntimeError('JWT_PRIVATE_KEY must be set (temporary keys are only allowed in DEBUG/TESTING)')
+    
+    public_key = private_key.public_key()
+    
+    if Config.JWT_PUBLIC_KEY:
+        configured = serialization.load_pem_public_key(Config.JWT_PUBLIC_KEY.encode())
+        raw = (serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        if configured.public_bytes(*raw) != public_key.public_bytes(*raw):
+            raise RuntimeError('JWT_PUBLIC_KEY does not match JWT_PRIVATE_KEY')
+    
+    return private_key, public_key
+
+
+# Cặp khóa được load một lần khi khởi động app (init_jwt_keys), không load lại mỗi request
+_PRIVATE_KEY = _PUBLIC_KEY = None
+
+
+def init_jwt_keys(app, allow_ephemeral=False):
+    """
+    Load khóa JWT khi khởi động - thiếu/sai khóa thì lỗi ngay thay vì ở request đầu tiên
+    
+    Args:
+        app: Flask app (DEBUG/TESTING cho phép sinh khóa tạm)
+        allow_ephemeral: Cho phép sinh khóa tạm kể cả khi app chưa bật debug (dev server)
+    """
+    global _PRIVATE_KEY, _PUBLIC_KEY
+    _PRIVATE_KEY, _PUBLIC_KEY = _load_jwt_keys(allow_ephemeral or app.debug or app.testing)
+
+
+# Bind thuật toán một lần khi import, tránh tạo lại list mỗi request
+_ISSUED_ALG = Config.JWT_ALGORITHM
+_ALGS = (_ISSUED_ALG,)
+
+# Cache payload đã verify, key là hash của token
+# TTL ngắn (30s) nên không ảnh hưởng tính Stateless: server không lưu session,
+# chỉ tránh verify lại cùng một token nhiều lần (verify chữ ký + JSON parse)
+_PAYLOAD_CACHE_TTL = 30
+_payload_cache = TTLCache(maxsize=10_000, ttl=_PAYLOAD_CACHE_TTL)
+_payload_cache_lock = threading.Lock()
+
+
 def generate_token(username, expires_in=3600):
     """
     Tạo JWT token cho user
@@ -33,8 +98,8 @@ def generate_token(username, expires_in=3600):
     
     token = jwt.encode(
         payload,
-        Config.SECRET_KEY,
-        algorithm='HS256'
+        _PRIVATE_KEY,
+        algorithm=_ISSUED_ALG
     )
     
     return token
@@ -53,18 +118,53 @@ def verify_token(token):
     Nguyên tắc Stateless:
     - Không cần tra cứu database hoặc session store
     - Chỉ verify signature và expiration từ token
+    - Kết quả verify thành công được cache ngắn hạn theo hash của token
     """
+    key = hashlib.sha256(token.encode()).digest()[:16]
+    
+    with _payload_cache_lock:
+        payload = _payload_cache.get(key)
+    
+    if payload is not None:
+        # Vẫn kiểm tra expiration vì token có thể hết hạn trước khi cache hết TTL
+        if payload['exp'] > time.time():
+            return payload
+        with _payload_cache_lock:
+            _payload_cache.pop(key, None)
+        return None
+    
     try:
         payload = jwt.decode(
             token,
-            Config.SECRET_KEY,
-            algorithms=['HS256']
+            _PUBLIC_KEY,
+            algorithms=_ALGS
         )
-        return payload
     except jwt.ExpiredSignatureError:
         return None  # Token đã hết hạn
     except jwt.InvalidTokenError:
         return None  # Token không hợp lệ
+    
+    # Chỉ cache token hợp lệ, không cache lỗi
+    with _payload_cache_lock:
+        _payload_cache[key] = payload
+    
+    return payload
+
+
+def _verify_request_token(token):
+    """
+    Verify token một lần cho mỗi request, lưu payload vào flask.g
+    
+    Các decorator/middleware xếp chồng trong cùng request dùng lại payload đã decode.
+    flask.g chỉ tồn tại trong phạm vi request nên không vi phạm tính Stateless
+    """
+    if g.get('jwt_token') == token and 'jwt_payload' in g:
+        return g.jwt_payload
+    
+    payload = verify_token(token)
+    g.jwt_token = token
+    g.jwt_payload = payload
+    return payload
 
 
 def token_required(f):
@@ -91,17 +191,16 @@ def token_required(f):
         auth_header = request.headers.get('Authorization')
         
         if auth_header:
-            try:
-                # Tách "Bearer" và token
-                token = auth_header.split(" ")[1]
-            except IndexError:
+            # Cắt prefix "Bearer " bằng slice, không tạo list như split()
+            if auth_header[:7].lower() != 'bearer ':
                 return jsonify({'error': 'Invalid token format. Use: Bearer <token>'}), 401
+            token = auth_header[7:].strip()
         
         if not token:
             return jsonify({'error': 'Token is missing'}), 401
         
         # Verify token
-        payload = verify_token(token)
+        payload = _verify_request_token(token)
         
         if not payload:
             return jsonify({'error': 'Token is invalid or expired'}), 401
@@ -127,19 +226,16 @@ def optional_token(f):
     """
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
         current_user = None
         
         auth_header = request.headers.get('Authorization')
         
-        if auth_header:
-            try:
-                token = auth_header.split(" ")[1]
-                payload = verify_token(token)
-                if payload:
-                    current_user = payload.get('username')
-            except (IndexError, Exception):
-                pass  # Ignore errors, continue as unauthenticated
+        # Request không có token: bỏ qua verify, xử lý như unauthenticated
+        # verify_token trả về None khi token không hợp lệ nên không cần try/except
+        if auth_header and auth_header[:7].lower() == 'bearer ':
+            payload = _verify_request_token(auth_header[7:].strip())
+            if payload:
+                current_user = payload.get('username')
         
         return f(current_user, *args, **kwargs)
     
@@ -6,16 +6,31 @@ import os
 from datetime import timedelta
 
 
+def _engine_options(database_uri):
+    """
+    Cấu hình connection pool cho SQLAlchemy engine
+    SQLite in-memory dùng StaticPool (một kết nối duy nhất) nên không nhận pool_size
+    """
+    if database_uri in ('sqlite://', 'sqlite:///:memory:'):
+        return {}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 20)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 40)),
+        'pool_pre_ping': True,
+        'pool_recycle': 1800
+    }
+
+
 class Config:
     """
     Cấu hình cơ bản cho ứng dụng
     
     Nguyên tắc Stateless:
-    - SECRET_KEY chỉ dùng để ký JWT token, không lưu session
+    - JWT được ký bằng khóa Ed25519 (JWT_PRIVATE_KEY), không lưu session
     - Không sử dụng Flask session storage
     """
     
-    # Secret key cho JWT token signing
+    # Secret key của Flask
     # QUAN TRỌNG: Thay đổi giá trị này trong production!
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     
@@ -23,9 +38,16 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///library.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Connection pool giữ kết nối lâu dài, kích thước theo số request đồng thời của worker
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(SQLALCHEMY_DATABASE_URI)
+    
     # JWT Configuration
     JWT_EXPIRATION_HOURS = 24  # Token expires after 24 hours
-    JWT_ALGORITHM = 'HS256'
+    # EdDSA (Ed25519): ký bằng private key, verify bằng public key, nhanh hơn RS256
+    JWT_ALGORITHM = 'EdDSA'
+    # PEM của cặp khóa Ed25519 (cho phép viết "\n" thay cho xuống dòng trong .env)
+    JWT_PRIVATE_KEY = (os.environ.get('JWT_PRIVATE_KEY') or '').replace('\\n', '\n') or None
+    JWT_PUBLIC_KEY = (os.environ.get('JWT_PUBLIC_KEY') or '').replace('\\n', '\n') or None
     
     # API Configuration
     API_TITLE = 'Library Management API'
@@ -47,13 +69,9 @@ class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
     
-    # Trong production, SECRET_KEY phải được set qua environment variable
-    @property
-    def SECRET_KEY(self):
-        secret_key = os.environ.get('SECRET_KEY')
-        if not secret_key:
-            raise ValueError("SECRET_KEY environment variable must be set in production")
-        return secret_key
+    # Đọc một lần khi định nghĩa class - from_object lấy trực tiếp giá trị (property trên
+    # class chỉ trả về chính object property). Không fallback về dev key: thiếu thì là None
+    SECRET_KEY = os.environ.get('SECRET_KEY')
 
 
 class TestingConfig(Config):
@@ -1,11 +1,59 @@
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy import DDL, event, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.types import DateTime
 
 db = SQLAlchemy()
 
+
+class utcnow(FunctionElement):
+    """
+    Thời điểm hiện tại (UTC) do database tính
+    Dùng cho server_default / UPDATE thay cho datetime.utcnow() phía Python
+    """
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    return 'CURRENT_TIMESTAMP'
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+@compiles(utcnow, 'sqlite')
+def _utcnow_sqlite(element, compiler, **kw):
+    # Cùng định dạng text SQLAlchemy dùng khi bind datetime (6 chữ số microsecond)
+    # để so sánh chuỗi (cursor pagination, ETag) vẫn đúng thứ tự
+    return "(STRFTIME('%Y-%m-%d %H:%M:%f000', 'now'))"
+
+
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    """Bật WAL cho SQLite để các request đọc không bị chặn bởi request ghi"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+
 class Book(db.Model):
     """Model cho sách"""
     __tablename__ = 'books'
+    # Lấy giá trị utcnow() ngay khi INSERT (RETURNING) thay vì SELECT lại
+    __mapper_args__ = {'eager_defaults': True}
+    __table_args__ = (
+        # Phục vụ filter available_only; isbn đã unique nên có index sẵn
+        db.Index('ix_books_available', 'available'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -13,7 +61,10 @@ class Book(db.Model):
     isbn = db.Column(db.String(13), unique=True, nullable=False)
     quantity = db.Column(db.Integer, default=1)  # Số lượng sách có sẵn
     available = db.Column(db.Integer, default=1)  # Số lượng sách còn lại để mượn
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # default: utcnow() viết vào câu INSERT - bảng tạo trước khi có server_default (cột không có DEFAULT)
+    # vẫn nhận giá trị do database tính
+    created_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow())
+    updated_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow())  # Dùng để tính ETag
     
     # Relationship với BorrowRecord
     borrow_records = db.relationship('BorrowRecord', backref='book', lazy=True, cascade='all, delete-orphan')
@@ -22,17 +73,60 @@ class Book(db.Model):
         return f'<Book {self.title}>'
 
 
+# Trigram GIN index cho filter author ILIKE '%...%' (chỉ áp dụng trên PostgreSQL)
+# Planner tự dùng index cho ILIKE, không cần đổi query; SQLite bỏ qua index này
+db.Index(
+    'ix_books_author_trgm', Book.author,
+    postgresql_using='gin',
+    postgresql_ops={'author': 'gin_trgm_ops'}
+).ddl_if(dialect='postgresql')
+
+event.listen(
+    Book.__table__, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
+
 class BorrowRecord(db.Model):
     """Model cho bản ghi mượn sách"""
     __tablename__ = 'borrow_records'
+    __mapper_args__ = {'eager_defaults': True}
+    __table_args__ = (
+        # Kiểm tra sách đang mượn khi xóa sách (book_id + status)
+        db.Index('ix_br_book_status', 'book_id', 'status'),
+        # Filter theo status + sắp xếp theo borrow_date khi list bản ghi
+        db.Index('ix_br_status_borrow_date', 'status', 'borrow_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
     borrower_name = db.Column(db.String(100), nullable=False)
     borrower_email = db.Column(db.String(100), nullable=False)
-    borrow_date = db.Column(db.DateTime, default=datetime.utcnow)
+    borrow_date = db.Column(db.DateTime, default=utcnow(), server_default=utcnow())
     return_date = db.Column(db.DateTime, nullable=True)  # Null nếu chưa trả
     status = db.Column(db.String(20), default='borrowed')  # 'borrowed' hoặc 'returned'
     
     def __repr__(self):
         return f'<BorrowRecord {self.borrower_name} - {self.book.title}>'
+
+
+def upgrade_schema(engine):
+    """
+    Bổ sung phần schema mà create_all() không làm trên bảng đã tồn tại:
+    cột books.updated_at (điền từ created_at) và các index khai báo sau khi bảng được tạo
+    """
+    columns = {column['name'] for column in inspect(engine).get_columns('books')}
+    
+    with engine.begin() as conn:
+        if 'updated_at' not in columns:
+            column_type = Book.__table__.c.updated_at.type.compile(dialect=engine.dialect)
+            conn.execute(text(f'ALTER TABLE books ADD COLUMN updated_at {column_type}'))
+            books = Book.__table__
+            conn.execute(books.update().values(updated_at=db.func.coalesce(books.c.created_at, utcnow())))
+        
+        if engine.dialect.name == 'postgresql':
+            conn.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        
+        for table in (Book.__table__, BorrowRecord.__table__):
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
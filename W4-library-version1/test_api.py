@@ -0,0 +1,57 @@
+"""
+Unit Tests cho Library Management REST API
+
+Test Coverage:
+- Pagination của GET /api/books (page và cursor)
+"""
+import os
+import unittest
+
+# app.py dựng app khi import: dùng SQLite in-memory và cho phép sinh khóa JWT tạm
+os.environ['DATABASE_URL'] = 'sqlite://'
+os.environ.setdefault('FLASK_DEBUG', '1')
+
+from app import app  # noqa: E402
+from models import db, Book  # noqa: E402
+
+
+class BooksPaginationTestCase(unittest.TestCase):
+    """Test pagination của GET /api/books"""
+
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+        db.session.add_all([
+            Book(title=f'Book {i}', author='Author', isbn=f'ISBN{i:03d}', quantity=1, available=1)
+            for i in range(3)
+        ])
+        db.session.commit()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_per_page_zero_is_clamped(self):
+        """per_page=0 được đưa về 1 ở cả nhánh page lẫn cursor (không 500)"""
+        for query in ('per_page=0', 'per_page=0&after='):
+            response = self.client.get(f'/api/books?{query}')
+            self.assertEqual(response.status_code, 200, query)
+            data = response.get_json()
+            self.assertEqual(data['per_page'], 1)
+            self.assertEqual(len(data['books']), 1)
+
+    def test_negative_per_page_is_clamped(self):
+        """per_page âm không thành LIMIT không giới hạn"""
+        response = self.client.get('/api/books?per_page=-1&after=')
+        data = response.get_json()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['books']), 1)
+        self.assertIsNotNone(data['next_cursor'])
+
+
+if __name__ == '__main__':
+    unittest.main()
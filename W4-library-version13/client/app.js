@@ -135,25 +135,45 @@ document.addEventListener('DOMContentLoaded', () => {
 // ============================================================
 
 /**
- * Get JWT token from HTTP Cookie
- * REST Principle: Stateless - Token stored in HTTP-only cookie
- * 
- * Note: Không thể đọc HTTP-only cookie từ JavaScript (security feature)
- * Cookie tự động được gửi kèm mỗi request
+ * Get JWT token from localStorage
+ * REST Principle: Stateless - Client giữ token, gửi qua Authorization header
  */
 function getToken() {
-    // Không thể đọc HTTP-only cookie từ JavaScript
-    // Cookie sẽ tự động được gửi kèm với mọi request
-    return null;
+    return localStorage.getItem('token');
+}
+
+/**
+ * Save JWT token to localStorage
+ */
+function setToken(token) {
+    localStorage.setItem('token', token);
+}
+
+/**
+ * Remove JWT token from localStorage
+ */
+function removeToken() {
+    localStorage.removeItem('token');
+}
+
+/**
+ * Build Authorization header from stored token
+ */
+function authHeaders() {
+    const token = getToken();
+    return token ? { 'Authorization': `Bearer ${token}` } : {};
 }
 
 /**
  * Check if user is authenticated by calling verify endpoint
  */
 async function isAuthenticated() {
+    if (!getToken()) {
+        return false;
+    }
     try {
         const response = await fetch(`${API_BASE_URL}/auth/verify`, {
-            credentials: 'include' // Gửi cookies kèm request
+            headers: authHeaders()
         });
         return response.ok;
     } catch (error) {
@@ -197,21 +217,21 @@ document.getElementById('loginForm').addEventListener('submit', async (e) => {
             headers: {
                 'Content-Type': 'application/json'
             },
-            credentials: 'include', // Cho phép nhận cookies từ server
             body: JSON.stringify({ username, password })
         });
         
         const result = await response.json();
         
         if (response.ok && result.success) {
-            // Lưu username để hiển thị (chỉ mục đích UI)
+            // Lưu token (gửi lại qua Authorization header) và username để hiển thị
+            setToken(result.data.token);
             setUsername(result.data.username);
             
             // Hiển thị thông báo thành công
-            document.getElementById('tokenValue').textContent = 'Token stored in HTTP-only cookie (secure)';
+            document.getElementById('tokenValue').textContent = result.data.token;
             document.getElementById('tokenDisplay').style.display = 'block';
             
-            showAlert('Login successful! Token saved in secure HTTP-only cookie.', 'success');
+            showAlert('Login successful! Token saved.', 'success');
             
             // Switch to dashboard after 1.5 seconds
             setTimeout(() => {
@@ -231,13 +251,12 @@ document.getElementById('loginForm').addEventListener('submit', async (e) => {
  */
 document.getElementById('logoutBtn').addEventListener('click', async () => {
     try {
-        // Call logout endpoint để xóa cookie
         await fetch(`${API_BASE_URL}/auth/logout`, {
-            method: 'POST',
-            credentials: 'include'
+            method: 'POST'
         });
         
-        // Remove username from client
+        // Stateless: xóa token và username phía client
+        removeToken();
         removeUsername();
         
         // Clear all cached data
@@ -251,6 +270,7 @@ document.getElementById('logoutBtn').addEventListener('click', async () => {
     } catch (error) {
         showAlert('Logout error: ' + error.message, 'error');
         // Force logout even if API call fails
+        removeToken();
         removeUsername();
         clearCache();
         switchView('login');
@@ -271,17 +291,16 @@ document.getElementById('logoutBtn').addEventListener('click', async () => {
  * - Cache fresh responses
  * 
  * Security:
- * - Cookie tự động được gửi kèm với credentials: 'include'
- * - Không cần thêm Authorization header thủ công
+ * - Token gửi kèm qua header Authorization: Bearer <token>
  */
 async function apiRequest(endpoint, options = {}) {
     const fullUrl = `${API_BASE_URL}${endpoint}`;
     
     const config = {
         ...options,
-        credentials: 'include', // QUAN TRỌNG: Gửi cookies kèm mọi request
         headers: {
             'Content-Type': 'application/json',
+            ...authHeaders(),
             ...options.headers
         }
     };
@@ -316,6 +335,7 @@ async function apiRequest(endpoint, options = {}) {
         // Handle authentication errors
         if (response.status === 401) {
             showAlert('Session expired. Please login again.', 'error');
+            removeToken();
             removeUsername();
             clearCache(); // Clear cache on logout
             switchView('login');
@@ -2,16 +2,100 @@
 REST API Routes với MongoDB
 Triển khai đầy đủ REST API theo nguyên tắc Stateless và Cacheable
 """
-from flask import Blueprint, request, jsonify, make_response
-from models import mongo, Book, BorrowRecord, get_pagination_params, format_pagination_response
+from flask import Blueprint, request, jsonify, make_response, Response
+from models import (
+    mongo, Book, BorrowRecord, get_pagination_params, format_pagination_response,
+    normalize_isbn, ISBN_COLLATION, encode_cursor, decode_cursor, keyset_condition, to_object_id
+)
 from auth import token_required, optional_token, generate_token
-from cache_utils import cacheable, vary_on, invalidate_cache_headers
+from cache_utils import (
+    cacheable, vary_on, invalidate_cache_headers, redis_cached, invalidate_redis_cache, cached_count,
+    get_cache_version, reserve_counter, release_counter, drop_counter
+)
 from datetime import datetime
-from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+import hashlib
+import orjson
 import re
+import threading
+import time
 
 api = Blueprint('api', __name__)
 
+# Headers no-store cho mutation responses - dựng một lần khi import
+INVALIDATE_HEADERS = invalidate_cache_headers()
+
+# ObjectId dạng chuỗi: đúng 24 ký tự hex
+OBJECT_ID_RE = re.compile(r'^[0-9a-fA-F]{24}$')
+
+# Body lỗi dùng lại nhiều lần - dựng sẵn để không phải jsonify mỗi request
+BAD_BOOK_ID = b'{"error":"Bad Request","message":"Invalid book ID format"}'
+BAD_RECORD_ID = b'{"error":"Bad Request","message":"Invalid record ID format"}'
+BAD_CURSOR = b'{"error":"Bad Request","message":"Invalid pagination cursor"}'
+
+
+def is_object_id(value):
+    """Kiểm tra chuỗi có phải ObjectId hợp lệ không (không cần try/except)"""
+    return isinstance(value, str) and OBJECT_ID_RE.match(value) is not None
+
+
+def json_blob(blob, status):
+    """Trả response JSON từ bytes đã dựng sẵn"""
+    return Response(blob, status=status, mimetype='application/json')
+
+
+def book_etag(book_id):
+    """ETag của một cuốn sách lấy từ _id + updated_at (chỉ đọc 1 field)"""
+    if not is_object_id(book_id):
+        return None
+    
+    book = mongo.db.books.find_one({'_id': to_object_id(book_id)}, {'updated_at': 1})
+    if not book or not book.get('updated_at'):
+        return None
+    
+    return f"{book_id}-{int(book['updated_at'].timestamp() * 1000)}"
+
+
+def available_key(book_oid):
+    """Redis key của counter số bản còn lại của sách"""
+    return f'book:{book_oid}:avail'
+
+
+def load_available(book_oid):
+    """Giá trị khởi tạo counter available từ MongoDB"""
+    book = mongo.db.books.find_one({'_id': book_oid}, {'available': 1})
+    return book['available'] if book else None
+
+
+def books_collection_stamp():
+    """
+    Version của collection books khi không có Redis: số document + updated_at mới nhất
+    
+    Mọi thao tác ghi lên books đều đổi một trong hai (thêm/xóa đổi số lượng,
+    sửa/mượn/trả set updated_at); updated_at mới nhất đọc qua index updated_at
+    """
+    latest = mongo.db.books.find_one({}, {'_id': 0, 'updated_at': 1}, sort=[('updated_at', -1)])
+    if latest is None:
+        return 'empty'
+    if not latest.get('updated_at'):
+        return None
+    
+    count = mongo.db.books.estimated_document_count()
+    return f"{count}.{int(latest['updated_at'].timestamp() * 1000)}"
+
+
+def books_list_etag():
+    """ETag danh sách sách: version của collection (Redis, hoặc tính từ MongoDB) + query string"""
+    version = get_cache_version('books')
+    if version is None:
+        version = books_collection_stamp()
+        if version is None:
+            return None
+    
+    path_hash = hashlib.sha1(request.full_path.encode('utf-8')).hexdigest()[:16]
+    return f'books-{version}-{path_hash}'
+
 
 # ============================================================
 # AUTHENTICATION ENDPOINTS
@@ -21,11 +105,13 @@ api = Blueprint('api', __name__)
 def login():
     """
     POST /api/auth/login
-    Đăng nhập và nhận JWT token qua HTTP Cookie
+    Đăng nhập và nhận JWT token trong JSON body
+    
+    Client gửi lại token qua header Authorization: Bearer <token>
     """
-    data = request.get_json()
+    data = request.get_json(silent=True, cache=False)
     
-    if not data or not data.get('username') or not data.get('password'):
+    if not isinstance(data, dict) or not data.get('username') or not data.get('password'):
         return jsonify({
             'error': 'Bad Request',
             'message': 'Username and password are required'
@@ -41,46 +127,30 @@ def login():
         'success': True,
         'message': 'Login successful',
         'data': {
+            'token': token,
             'username': username,
-            'token_stored': 'cookie'
+            'token_type': 'Bearer'
         }
     }), 200)
     
-    from config import Config
-    response.set_cookie(
-        'jwt_token',
-        token,
-        httponly=True,
-        secure=False,
-        samesite='Lax',
-        max_age=Config.JWT_EXPIRATION_HOURS * 3600
-    )
-    
-    for key, value in invalidate_cache_headers().items():
-        response.headers[key] = value
+    response.headers.update(INVALIDATE_HEADERS)
     
     return response
 
 
 @api.route('/auth/logout', methods=['POST'])
 def logout():
-    """POST /api/auth/logout - Đăng xuất"""
+    """
+    POST /api/auth/logout - Đăng xuất
+    
+    Stateless: server không giữ session, client tự xóa token của mình
+    """
     response = make_response(jsonify({
         'success': True,
         'message': 'Logout successful'
     }), 200)
     
-    response.set_cookie(
-        'jwt_token',
-        '',
-        httponly=True,
-        secure=False,
-        samesite='Lax',
-        max_age=0
-    )
-    
-    for key, value in invalidate_cache_headers().items():
-        response.headers[key] = value
+    response.headers.update(INVALIDATE_HEADERS)
     
     return response
 
@@ -105,20 +175,24 @@ def verify_token_endpoint(current_user):
 # ============================================================
 
 @api.route('/books', methods=['GET'])
-@cacheable(cache_type='public', max_age=60, etag_enabled=True)
+@cacheable(cache_type='public', max_age=60, etag_enabled=True, etag_func=books_list_etag)
+@redis_cached('books', ttl=60)
 def get_books():
     """
     GET /api/books
     Lấy danh sách sách với pagination và filtering
     """
     # Pagination parameters
-    page, per_page = get_pagination_params(request, default_per_page=10, max_per_page=100)
+    page, per_page, after = get_pagination_params(request, default_per_page=10, max_per_page=100)
     
     # Filtering parameters
     author = request.args.get('author', type=str)
     title = request.args.get('title', type=str)
     isbn = request.args.get('isbn', type=str)
     available_only = request.args.get('available_only', 'false').lower() == 'true'
+    # match=contains (mặc định): chuỗi con; prefix: tiền tố (autocomplete);
+    # text: thêm text index làm bộ lọc sơ bộ, xếp theo độ liên quan
+    match = request.args.get('match', 'contains', type=str)
     
     # Sorting parameters
     sort_by = request.args.get('sort_by', 'created_at', type=str)
@@ -126,12 +200,24 @@ def get_books():
     
     # Build query
     query = {}
-    
-    if author:
-        query['author'] = {'$regex': author, '$options': 'i'}
-    
-    if title:
-        query['title'] = {'$regex': title, '$options': 'i'}
+    projection = dict(Book.PROJECTION)
+    text_search = False
+    
+    # title/author luôn lọc theo từng field (không phân biệt hoa thường, giá trị được escape)
+    # match=text chỉ thêm $text làm bộ lọc sơ bộ qua index 'books_text', không thay field filter
+    text_phrases = []
+    for field, value in (('title', title), ('author', author)):
+        if not value:
+            continue
+        pattern = re.escape(value)
+        query[field] = {'$regex': f'^{pattern}' if match == 'prefix' else pattern, '$options': 'i'}
+        if match == 'text' and '"' not in value:
+            text_phrases.append(f'"{value}"')
+    
+    if text_phrases:
+        query['$text'] = {'$search': ' '.join(text_phrases)}
+        projection['score'] = {'$meta': 'textScore'}
+        text_search = True
     
     if isbn:
         query['isbn'] = isbn
@@ -147,18 +233,42 @@ def get_books():
     else:
         sort_spec = [('created_at', -1)]
     
-    # Count total
-    total = mongo.db.books.count_documents(query)
+    # Full-text search không chỉ định sort_by thì xếp theo độ liên quan (không dùng keyset được)
+    keyset = True
+    if text_search and 'sort_by' not in request.args:
+        sort_spec = [('score', {'$meta': 'textScore'})]
+        keyset = False
+    else:
+        # _id làm tiebreak để thứ tự ổn định giữa các trang
+        sort_spec.append(('_id', sort_spec[0][1]))
+    
+    # Count total (ước lượng khi không có filter, cache ngắn hạn khi có filter)
+    total, total_is_estimate, total_capped = cached_count(mongo.db.books, query)
     
-    # Execute with pagination
+    # Execute with pagination: ?after=<cursor> đọc theo range, page/skip giữ để tương thích
     skip = (page - 1) * per_page
-    books_cursor = mongo.db.books.find(query).sort(sort_spec).skip(skip).limit(per_page)
+    if after and keyset:
+        try:
+            sort_value, last_id = decode_cursor(after)
+        except (ValueError, TypeError):
+            return json_blob(BAD_CURSOR, 400)
+        query.update(keyset_condition(sort_spec[0][0], sort_spec[0][1], sort_value, last_id))
+        skip = 0
+    
+    # Lấy dư 1 document để biết còn trang sau mà không cần query thêm
+    book_docs = list(mongo.db.books.find(query, projection).sort(sort_spec).skip(skip).limit(per_page + 1))
+    has_more = len(book_docs) > per_page
+    book_docs = book_docs[:per_page]
+    next_cursor = encode_cursor(book_docs[-1], sort_spec[0][0]) if keyset and has_more else None
     
     # Convert to list of dicts
-    books = [Book.to_dict(book) for book in books_cursor]
+    books = Book.to_dict_batch(book_docs)
     
     # Format response
-    response_data = format_pagination_response(books, total, page, per_page, items_key='books')
+    response_data = format_pagination_response(
+        books, total, page, per_page, items_key='books', total_is_estimate=total_is_estimate,
+        next_cursor=next_cursor, has_more=has_more, total_capped=total_capped
+    )
     
     return jsonify({
         'success': True,
@@ -167,16 +277,13 @@ def get_books():
 
 
 @api.route('/books/<book_id>', methods=['GET'])
-@cacheable(cache_type='public', max_age=120, etag_enabled=True)
+@cacheable(cache_type='public', max_age=120, etag_enabled=True, etag_func=book_etag)
 def get_book(book_id):
     """GET /api/books/{id} - Lấy thông tin chi tiết một cuốn sách"""
-    try:
-        book = mongo.db.books.find_one({'_id': ObjectId(book_id)})
-    except:
-        return jsonify({
-            'error': 'Bad Request',
-            'message': 'Invalid book ID format'
-        }), 400
+    if not is_object_id(book_id):
+        return json_blob(BAD_BOOK_ID, 400)
+    
+    book = mongo.db.books.find_one({'_id': to_object_id(book_id)}, Book.PROJECTION)
     
     if not book:
         return jsonify({
@@ -194,11 +301,11 @@ def get_book(book_id):
 @token_required
 def create_book(current_user):
     """POST /api/books - Tạo sách mới"""
-    data = request.get_json()
+    data = request.get_json(silent=True, cache=False)
     
     # Validation
     required_fields = ['title', 'author', 'isbn', 'quantity']
-    if not data or not all(field in data for field in required_fields):
+    if not isinstance(data, dict) or not all(field in data for field in required_fields):
         return jsonify({
             'error': 'Bad Request',
             'message': f'Missing required fields: {", ".join(required_fields)}'
@@ -212,8 +319,12 @@ def create_book(current_user):
             'message': 'Quantity must be a positive integer'
         }), 400
     
-    # Check if ISBN already exists
-    existing_book = mongo.db.books.find_one({'isbn': data['isbn']})
+    # Check if ISBN already exists (point lookup trên unique index isbn_norm)
+    existing_book = mongo.db.books.find_one(
+        {'isbn_norm': normalize_isbn(data['isbn'])},
+        {'_id': 1},
+        collation=ISBN_COLLATION
+    )
     if existing_book:
         return jsonify({
             'error': 'Conflict',
@@ -231,6 +342,7 @@ def create_book(current_user):
     try:
         result = mongo.db.books.insert_one(new_book)
         new_book['_id'] = result.inserted_id
+        invalidate_redis_cache('books', 'statistics')
         
         response = make_response(jsonify({
             'success': True,
@@ -238,11 +350,16 @@ def create_book(current_user):
             'data': Book.to_dict(new_book)
         }), 201)
         
-        for key, value in invalidate_cache_headers().items():
-            response.headers[key] = value
+        response.headers.update(INVALIDATE_HEADERS)
         
         return response
         
+    except DuplicateKeyError:
+        # Request song song, hoặc sách cũ chưa có isbn_norm trùng isbn
+        return jsonify({
+            'error': 'Conflict',
+            'message': 'A book with this ISBN already exists'
+        }), 409
     except Exception as e:
         return jsonify({
             'error': 'Internal Server Error',
@@ -254,13 +371,12 @@ def create_book(current_user):
 @token_required
 def update_book(current_user, book_id):
     """PUT /api/books/{id} - Cập nhật thông tin sách"""
-    try:
-        book = mongo.db.books.find_one({'_id': ObjectId(book_id)})
-    except:
-        return jsonify({
-            'error': 'Bad Request',
-            'message': 'Invalid book ID format'
-        }), 400
+    if not is_object_id(book_id):
+        return json_blob(BAD_BOOK_ID, 400)
+    
+    book_oid = to_object_id(book_id)
+    # Chỉ cần các field để kiểm tra ISBN / số lượng đang mượn
+    book = mongo.db.books.find_one({'_id': book_oid}, {'quantity': 1, 'available': 1, 'isbn': 1})
     
     if not book:
         return jsonify({
@@ -268,9 +384,9 @@ def update_book(current_user, book_id):
             'message': f'Book with id {book_id} not found'
         }), 404
     
-    data = request.get_json()
+    data = request.get_json(silent=True, cache=False)
     
-    if not data:
+    if not data or not isinstance(data, dict):
         return jsonify({
             'error': 'Bad Request',
             'message': 'No data provided'
@@ -278,10 +394,14 @@ def update_book(current_user, book_id):
     
     # Check ISBN uniqueness if being changed
     if 'isbn' in data and data['isbn'] != book['isbn']:
-        existing = mongo.db.books.find_one({
-            'isbn': data['isbn'],
-            '_id': {'$ne': ObjectId(book_id)}
-        })
+        existing = mongo.db.books.find_one(
+            {
+                'isbn_norm': normalize_isbn(data['isbn']),
+                '_id': {'$ne': book_oid}
+            },
+            {'_id': 1},
+            collation=ISBN_COLLATION
+        )
         if existing:
             return jsonify({
                 'error': 'Conflict',
@@ -299,6 +419,7 @@ def update_book(current_user, book_id):
     
     if 'isbn' in data:
         update_fields['isbn'] = data['isbn']
+        update_fields['isbn_norm'] = normalize_isbn(data['isbn'])
     
     # Update quantity - phải kiểm tra số sách đang được mượn
     if 'quantity' in data:
@@ -325,13 +446,16 @@ def update_book(current_user, book_id):
     update_fields['updated_at'] = datetime.utcnow()
     
     try:
-        mongo.db.books.update_one(
-            {'_id': ObjectId(book_id)},
-            {'$set': update_fields}
+        # Ghi và lấy bản sau khi update trong cùng một round trip
+        updated_book = mongo.db.books.find_one_and_update(
+            {'_id': book_oid},
+            {'$set': update_fields},
+            projection=Book.PROJECTION,
+            return_document=ReturnDocument.AFTER
         )
-        
-        # Get updated book
-        updated_book = mongo.db.books.find_one({'_id': ObjectId(book_id)})
+        if 'available' in update_fields:
+            drop_counter(available_key(book_oid))
+        invalidate_redis_cache('books', 'statistics')
         
         response = make_response(jsonify({
             'success': True,
@@ -339,11 +463,15 @@ def update_book(current_user, book_id):
             'data': Book.to_dict(updated_book)
         }), 200)
         
-        for key, value in invalidate_cache_headers().items():
-            response.headers[key] = value
+        response.headers.update(INVALIDATE_HEADERS)
         
         return response
         
+    except DuplicateKeyError:
+        return jsonify({
+            'error': 'Conflict',
+            'message': 'ISBN already used by another book'
+        }), 409
     except Exception as e:
         return jsonify({
             'error': 'Internal Server Error',
@@ -355,48 +483,70 @@ def update_book(current_user, book_id):
 @token_required
 def delete_book(current_user, book_id):
     """DELETE /api/books/{id} - Xóa sách"""
+    if not is_object_id(book_id):
+        return json_blob(BAD_BOOK_ID, 400)
+    
+    book_oid = to_object_id(book_id)
+    
     try:
-        book = mongo.db.books.find_one({'_id': ObjectId(book_id)})
-    except:
+        # Kiểm tra + xóa trong một transaction để không có lượt mượn nào chen vào giữa
+        try:
+            with mongo.cx.start_session() as session:
+                borrowed_count, deleted_count = session.with_transaction(
+                    lambda s: _delete_book_cascade(book_oid, s)
+                )
+        except OperationFailure as e:
+            # MongoDB standalone (không phải replica set) không hỗ trợ transaction
+            if e.code != 20:
+                raise
+            borrowed_count, deleted_count = _delete_book_cascade(book_oid)
+        
+    except Exception as e:
         return jsonify({
-            'error': 'Bad Request',
-            'message': 'Invalid book ID format'
-        }), 400
+            'error': 'Internal Server Error',
+            'message': f'Failed to delete book: {str(e)}'
+        }), 500
     
-    if not book:
+    if borrowed_count > 0:
+        return jsonify({
+            'error': 'Conflict',
+            'message': f'Cannot delete book. {borrowed_count} copies are currently borrowed'
+        }), 409
+    
+    if not deleted_count:
         return jsonify({
             'error': 'Not Found',
             'message': f'Book with id {book_id} not found'
         }), 404
     
-    # Check if any copies are borrowed
-    borrowed_count = mongo.db.borrow_records.count_documents({
-        'book_id': ObjectId(book_id),
-        'status': 'borrowed'
-    })
+    drop_counter(available_key(book_oid))
+    invalidate_redis_cache('books', 'statistics')
+    
+    return jsonify({
+        'success': True,
+        'message': 'Book deleted successfully'
+    }), 200
+
+
+def _delete_book_cascade(book_oid, session=None):
+    """
+    Xóa sách cùng các borrow records liên quan nếu không còn bản sao đang được mượn
     
+    Returns:
+        tuple: (borrowed_count, deleted_count) - deleted_count=0 nghĩa là sách không tồn tại
+    """
+    borrowed_count = mongo.db.borrow_records.count_documents(
+        {'book_id': book_oid, 'status': 'borrowed'},
+        session=session
+    )
     if borrowed_count > 0:
-        return jsonify({
-            'error': 'Conflict',
-            'message': f'Cannot delete book. {borrowed_count} copies are currently borrowed'
-        }), 409
+        return borrowed_count, 0
     
-    try:
-        # Delete all related borrow records first
-        mongo.db.borrow_records.delete_many({'book_id': ObjectId(book_id)})
-        # Delete the book
-        mongo.db.books.delete_one({'_id': ObjectId(book_id)})
-        
-        return jsonify({
-            'success': True,
-            'message': 'Book deleted successfully'
-        }), 200
-        
-    except Exception as e:
-        return jsonify({
-            'error': 'Internal Server Error',
-            'message': f'Failed to delete book: {str(e)}'
-        }), 500
+    # Delete all related borrow records first
+    mongo.db.borrow_records.delete_many({'book_id': book_oid}, session=session)
+    # Delete the book
+    result = mongo.db.books.delete_one({'_id': book_oid}, session=session)
+    return 0, result.deleted_count
 
 
 # ============================================================
@@ -410,7 +560,7 @@ def delete_book(current_user, book_id):
 def get_borrow_records(current_user):
     """GET /api/borrow-records - Lấy danh sách bản ghi mượn sách"""
     # Pagination
-    page, per_page = get_pagination_params(request, default_per_page=10, max_per_page=100)
+    page, per_page, after = get_pagination_params(request, default_per_page=10, max_per_page=100)
     
     # Filtering
     status = request.args.get('status', type=str)
@@ -434,11 +584,8 @@ def get_borrow_records(current_user):
     if borrower_email:
         query['borrower_email'] = {'$regex': borrower_email, '$options': 'i'}
     
-    if book_id:
-        try:
-            query['book_id'] = ObjectId(book_id)
-        except:
-            pass
+    if is_object_id(book_id):
+        query['book_id'] = to_object_id(book_id)
     
     # Apply sorting
     valid_sort_fields = ['borrow_date', 'return_date', 'borrower_name', 'borrower_email', 'status']
@@ -447,26 +594,55 @@ def get_borrow_records(current_user):
         sort_spec = [(sort_by, sort_direction)]
     else:
         sort_spec = [('borrow_date', -1)]
+    sort_spec.append(('_id', sort_spec[0][1]))
     
-    # Count total
-    total = mongo.db.borrow_records.count_documents(query)
+    # Count total (ước lượng khi không có filter, cache ngắn hạn khi có filter)
+    total, total_is_estimate, total_capped = cached_count(mongo.db.borrow_records, query)
     
-    # Execute with pagination
+    # ?after=<cursor>: keyset pagination thay cho skip
     skip = (page - 1) * per_page
-    records_cursor = mongo.db.borrow_records.find(query).sort(sort_spec).skip(skip).limit(per_page)
+    if after:
+        try:
+            sort_value, last_id = decode_cursor(after)
+        except (ValueError, TypeError):
+            return json_blob(BAD_CURSOR, 400)
+        query.update(keyset_condition(sort_spec[0][0], sort_spec[0][1], sort_value, last_id))
+        skip = 0
+    
+    # Execute with pagination, join thông tin sách phía server ($lookup qua _id index)
+    # thay vì find_one cho từng record
+    pipeline = [
+        {'$match': query},
+        {'$sort': dict(sort_spec)},
+        {'$skip': skip},
+        {'$limit': per_page + 1},
+        {'$lookup': {
+            'from': 'books',
+            'localField': 'book_id',
+            'foreignField': '_id',
+            'as': 'book'
+        }},
+        {'$unwind': {'path': '$book', 'preserveNullAndEmptyArrays': True}},
+        # Chỉ giữ field to_dict dùng, bỏ phần còn lại của document sách đã join
+        {'$project': {
+            **BorrowRecord.PROJECTION,
+            'book_title': '$book.title',
+            'book_author': '$book.author'
+        }}
+    ]
     
-    # Convert to list of dicts with book info
-    records = []
-    for record in records_cursor:
-        # Get book info
-        book = mongo.db.books.find_one({'_id': record['book_id']})
-        if book:
-            record['book_title'] = book['title']
-            record['book_author'] = book['author']
-        records.append(BorrowRecord.to_dict(record))
+    record_docs = list(mongo.db.borrow_records.aggregate(pipeline))
+    has_more = len(record_docs) > per_page
+    record_docs = record_docs[:per_page]
+    next_cursor = encode_cursor(record_docs[-1], sort_spec[0][0]) if has_more else None
+    
+    records = BorrowRecord.to_dict_batch(record_docs)
     
     # Format response
-    response_data = format_pagination_response(records, total, page, per_page, items_key='records')
+    response_data = format_pagination_response(
+        records, total, page, per_page, items_key='records', total_is_estimate=total_is_estimate,
+        next_cursor=next_cursor, has_more=has_more, total_capped=total_capped
+    )
     
     return jsonify({
         'success': True,
@@ -480,13 +656,10 @@ def get_borrow_records(current_user):
 @vary_on('Authorization')
 def get_borrow_record(current_user, record_id):
     """GET /api/borrow-records/{id} - Lấy thông tin chi tiết một bản ghi mượn sách"""
-    try:
-        record = mongo.db.borrow_records.find_one({'_id': ObjectId(record_id)})
-    except:
-        return jsonify({
-            'error': 'Bad Request',
-            'message': 'Invalid record ID format'
-        }), 400
+    if not is_object_id(record_id):
+        return json_blob(BAD_RECORD_ID, 400)
+    
+    record = mongo.db.borrow_records.find_one({'_id': to_object_id(record_id)}, BorrowRecord.PROJECTION)
     
     if not record:
         return jsonify({
@@ -495,7 +668,7 @@ def get_borrow_record(current_user, record_id):
         }), 404
     
     # Get book info
-    book = mongo.db.books.find_one({'_id': record['book_id']})
+    book = mongo.db.books.find_one({'_id': record['book_id']}, {'title': 1, 'author': 1})
     if book:
         record['book_title'] = book['title']
         record['book_author'] = book['author']
@@ -510,11 +683,11 @@ def get_borrow_record(current_user, record_id):
 @token_required
 def create_borrow_record(current_user):
     """POST /api/borrow-records - Tạo bản ghi mượn sách mới"""
-    data = request.get_json()
+    data = request.get_json(silent=True, cache=False)
     
     # Validation
     required_fields = ['book_id', 'borrower_name', 'borrower_email']
-    if not data or not all(field in data for field in required_fields):
+    if not isinstance(data, dict) or not all(field in data for field in required_fields):
         return jsonify({
             'error': 'Bad Request',
             'message': f'Missing required fields: {", ".join(required_fields)}'
@@ -522,26 +695,46 @@ def create_borrow_record(current_user):
     
     book_id = data['book_id']
     
-    try:
-        book = mongo.db.books.find_one({'_id': ObjectId(book_id)})
-    except:
-        return jsonify({
-            'error': 'Bad Request',
-            'message': 'Invalid book ID format'
-        }), 400
+    if not is_object_id(book_id):
+        return json_blob(BAD_BOOK_ID, 400)
     
-    if not book:
+    book_oid = to_object_id(book_id)
+    
+    # Giữ chỗ trên counter Redis trước: sách đã hết thì từ chối mà không ghi MongoDB
+    reserved = reserve_counter(available_key(book_oid), lambda: load_available(book_oid))
+    if reserved is False:
         return jsonify({
-            'error': 'Not Found',
-            'message': f'Book with id {book_id} not found'
-        }), 404
+            'error': 'Conflict',
+            'message': 'Book is not available for borrowing'
+        }), 409
+    
+    # Kiểm tra và giảm available trong một lệnh atomic (không bị mượn vượt số lượng khi song song)
+    book = mongo.db.books.find_one_and_update(
+        {'_id': book_oid, 'available': {'$gt': 0}},
+        {'$inc': {'available': -1}, '$currentDate': {'updated_at': True}},
+        projection={'title': 1, 'author': 1},
+        return_document=ReturnDocument.BEFORE
+    )
     
-    if book['available'] <= 0:
+    if not book:
+        # Counter Redis lệch so với MongoDB - trả lại chỗ đã giữ và khởi tạo lại lần sau
+        if reserved:
+            drop_counter(available_key(book_oid))
+        
+        # Phân biệt sách không tồn tại với sách đã hết
+        if not mongo.db.books.find_one({'_id': book_oid}, {'_id': 1}):
+            return jsonify({
+                'error': 'Not Found',
+                'message': f'Book with id {book_id} not found'
+            }), 404
+        
         return jsonify({
             'error': 'Conflict',
             'message': 'Book is not available for borrowing'
         }), 409
     
+    invalidate_redis_cache('books', 'statistics')
+    
     # Create borrow record
     borrow_record = BorrowRecord.create(
         book_id=book_id,
@@ -554,12 +747,6 @@ def create_borrow_record(current_user):
         result = mongo.db.borrow_records.insert_one(borrow_record)
         borrow_record['_id'] = result.inserted_id
         
-        # Decrease available count
-        mongo.db.books.update_one(
-            {'_id': ObjectId(book_id)},
-            {'$inc': {'available': -1}}
-        )
-        
         # Add book info to record
         borrow_record['book_title'] = book['title']
         borrow_record['book_author'] = book['author']
@@ -571,6 +758,12 @@ def create_borrow_record(current_user):
         }), 201
         
     except Exception as e:
+        # Hoàn lại số lượng đã giảm vì record không được tạo
+        mongo.db.books.update_one(
+            {'_id': book_oid},
+            {'$inc': {'available': 1}, '$currentDate': {'updated_at': True}}
+        )
+        release_counter(available_key(book_oid))
         return jsonify({
             'error': 'Internal Server Error',
             'message': f'Failed to create borrow record: {str(e)}'
@@ -581,13 +774,11 @@ def create_borrow_record(current_user):
 @token_required
 def return_book(current_user, record_id):
     """PUT /api/borrow-records/{id}/return - Trả sách"""
-    try:
-        record = mongo.db.borrow_records.find_one({'_id': ObjectId(record_id)})
-    except:
-        return jsonify({
-            'error': 'Bad Request',
-            'message': 'Invalid record ID format'
-        }), 400
+    if not is_object_id(record_id):
+        return json_blob(BAD_RECORD_ID, 400)
+    
+    record_oid = to_object_id(record_id)
+    record = mongo.db.borrow_records.find_one({'_id': record_oid}, {'status': 1, 'book_id': 1})
     
     if not record:
         return jsonify({
@@ -602,26 +793,34 @@ def return_book(current_user, record_id):
         }), 409
     
     try:
-        # Update status
-        mongo.db.borrow_records.update_one(
-            {'_id': ObjectId(record_id)},
+        # Update status, nhận lại record sau khi update (điều kiện status tránh trả 2 lần)
+        updated_record = mongo.db.borrow_records.find_one_and_update(
+            {'_id': record_oid, 'status': 'borrowed'},
             {
                 '$set': {
                     'status': 'returned',
                     'return_date': datetime.utcnow()
                 }
-            }
+            },
+            projection=BorrowRecord.PROJECTION,
+            return_document=ReturnDocument.AFTER
         )
         
-        # Increase available count
-        mongo.db.books.update_one(
+        if not updated_record:
+            return jsonify({
+                'error': 'Conflict',
+                'message': 'Book has already been returned'
+            }), 409
+        
+        # Increase available count, đồng thời lấy title/author để trả về
+        book = mongo.db.books.find_one_and_update(
             {'_id': record['book_id']},
-            {'$inc': {'available': 1}}
+            {'$inc': {'available': 1}, '$currentDate': {'updated_at': True}},
+            projection={'title': 1, 'author': 1}
         )
+        release_counter(available_key(record['book_id']))
+        invalidate_redis_cache('books', 'statistics')
         
-        # Get updated record
-        updated_record = mongo.db.borrow_records.find_one({'_id': ObjectId(record_id)})
-        book = mongo.db.books.find_one({'_id': updated_record['book_id']})
         if book:
             updated_record['book_title'] = book['title']
             updated_record['book_author'] = book['author']
@@ -643,35 +842,52 @@ def return_book(current_user, record_id):
 # STATISTICS ENDPOINT
 # ============================================================
 
+# Pipeline thống kê dựng sẵn một lần ở module thay vì mỗi request
+# Mỗi collection một aggregate: 2 round trip thay vì 6 lệnh riêng lẻ
+BOOKS_STATS_PIPELINE = [
+    {
+        '$facet': {
+            'titles': [{'$count': 'n'}],
+            'sums': [{
+                '$group': {
+                    '_id': None,
+                    'total_copies': {'$sum': '$quantity'},
+                    'available_copies': {'$sum': '$available'}
+                }
+            }]
+        }
+    }
+]
+RECORDS_BY_STATUS_PIPELINE = [
+    {'$group': {'_id': '$status', 'n': {'$sum': 1}}}
+]
+
+
+def facet_count(facet):
+    # $count không trả document nào khi không có kết quả
+    return facet[0]['n'] if facet else 0
+
+
 @api.route('/statistics', methods=['GET'])
 @cacheable(cache_type='public', max_age=30, etag_enabled=True)
+@redis_cached('statistics', ttl=30)
 def get_statistics():
     """GET /api/statistics - Lấy thống kê hệ thống"""
-    total_books = mongo.db.books.count_documents({})
-    
-    # Calculate total copies and available copies using aggregation
-    pipeline = [
-        {
-            '$group': {
-                '_id': None,
-                'total_copies': {'$sum': '$quantity'},
-                'available_copies': {'$sum': '$available'}
-            }
-        }
-    ]
-    
-    result = list(mongo.db.books.aggregate(pipeline))
-    
-    if result:
-        total_copies = result[0]['total_copies']
-        available_copies = result[0]['available_copies']
-    else:
-        total_copies = 0
-        available_copies = 0
-    
-    borrowed_copies = mongo.db.borrow_records.count_documents({'status': 'borrowed'})
-    total_borrow_records = mongo.db.borrow_records.count_documents({})
-    returned_records = mongo.db.borrow_records.count_documents({'status': 'returned'})
+    books_stats = next(mongo.db.books.aggregate(BOOKS_STATS_PIPELINE))
+    
+    total_books = facet_count(books_stats['titles'])
+    sums = books_stats['sums'][0] if books_stats['sums'] else {}
+    total_copies = sums.get('total_copies', 0)
+    available_copies = sums.get('available_copies', 0)
+    
+    # Một $group theo status thay cho ba $count riêng; tổng = cộng các nhóm
+    by_status = {
+        group['_id']: group['n']
+        for group in mongo.db.borrow_records.aggregate(RECORDS_BY_STATUS_PIPELINE)
+    }
+    borrowed_copies = by_status.get('borrowed', 0)
+    returned_records = by_status.get('returned', 0)
+    total_borrow_records = sum(by_status.values())
     
     return jsonify({
         'success': True,
@@ -695,18 +911,14 @@ def get_statistics():
 # HEALTH CHECK ENDPOINT
 # ============================================================
 
-@api.route('/health', methods=['GET'])
-@cacheable(cache_type='public', max_age=300, etag_enabled=False)
-def health_check():
-    """GET /api/health - Kiểm tra health của API"""
-    try:
-        # Test MongoDB connection
-        mongo.db.command('ping')
-        db_status = 'connected'
-    except:
-        db_status = 'disconnected'
-    
-    return jsonify({
+# Trạng thái MongoDB do thread nền cập nhật - health check không ping mỗi request
+DB_STATUS = {'status': 'disconnected', 'checked_at': None}
+_pinger_lock = threading.Lock()
+_pinger_started = False
+
+
+def _health_body(db_status):
+    return orjson.dumps({
         'success': True,
         'status': 'healthy',
         'service': 'Library Management REST API',
@@ -715,4 +927,43 @@ def health_check():
             'type': 'MongoDB',
             'status': db_status
         }
-    }), 200
+    })
+
+
+# Body dựng sẵn cho từng trạng thái
+HEALTH_BODIES = {status: _health_body(status) for status in ('connected', 'disconnected')}
+
+
+def _ping_db():
+    try:
+        mongo.db.command('ping')
+        status = 'connected'
+    except Exception:
+        status = 'disconnected'
+    DB_STATUS.update(status=status, checked_at=time.time())
+
+
+def start_db_pinger(interval=5):
+    """
+    Khởi động thread nền ping MongoDB mỗi `interval` giây
+    Chỉ chạy một thread cho mỗi process dù create_app được gọi nhiều lần
+    """
+    global _pinger_started
+    with _pinger_lock:
+        if _pinger_started:
+            return
+        _pinger_started = True
+    
+    def loop():
+        while True:
+            _ping_db()
+            time.sleep(interval)
+    
+    threading.Thread(target=loop, name='mongo-pinger', daemon=True).start()
+
+
+@api.route('/health', methods=['GET'])
+@cacheable(cache_type='public', max_age=300, etag_enabled=False)
+def health_check():
+    """GET /api/health - Kiểm tra health của API"""
+    return json_blob(HEALTH_BODIES[DB_STATUS['status']], 200)
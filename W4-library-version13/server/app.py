@@ -9,14 +9,70 @@ Triển khai kiến trúc Client-Server theo nguyên tắc REST
 - CORS enabled để client từ origin khác có thể gọi
 - Sử dụng MongoDB để lưu trữ dữ liệu
 """
-from flask import Flask, jsonify
-from flask_cors import CORS
-from models import mongo
-from api_routes import api
+from flask import Flask, request
+from models import mongo, ensure_indexes, warm_up_pool, DuplicateIsbnError
+from api_routes import api, start_db_pinger, json_blob
 from config import Config
+from json_provider import OrjsonProvider
+import orjson
 import os
 
 
+# Body lỗi cố định, serialize sẵn một lần (mỗi request chỉ tạo Response từ bytes)
+NOT_FOUND_BODY = orjson.dumps({
+    'error': 'Not Found',
+    'message': 'The requested resource was not found'
+})
+METHOD_NOT_ALLOWED_BODY = orjson.dumps({
+    'error': 'Method Not Allowed',
+    'message': 'The method is not allowed for the requested URL'
+})
+PAYLOAD_TOO_LARGE_BODY = orjson.dumps({
+    'error': 'Payload Too Large',
+    'message': 'Request body exceeds the allowed size'
+})
+INTERNAL_ERROR_BODY = orjson.dumps({
+    'error': 'Internal Server Error',
+    'message': 'An unexpected error occurred'
+})
+
+# Header CORS cố định, dựng một lần
+CORS_ALLOW_METHODS = 'GET, POST, PUT, DELETE, OPTIONS'
+CORS_ALLOW_HEADERS = 'Content-Type, Authorization'
+
+
+def init_cors(app, prefix):
+    """
+    CORS cho các route dưới prefix của API
+    
+    Origins được cấu hình đưa vào frozenset một lần: mỗi request chỉ kiểm tra
+    membership O(1) thay vì so khớp từng pattern như flask_cors
+    
+    - Origin hợp lệ được trả lại trong Access-Control-Allow-Origin (kèm Vary: Origin)
+    - Không bật credentials: token đi qua header Authorization, không dùng cookie
+    - Preflight (OPTIONS + Access-Control-Request-Method) nhận thêm Allow-Methods/Allow-Headers
+    """
+    allowed_origins = frozenset(app.config['CORS_ORIGINS'])
+    prefix = prefix.rstrip('/') + '/'
+    
+    @app.after_request
+    def add_cors_headers(response):
+        if not request.path.startswith(prefix):
+            return response
+        
+        response.vary.add('Origin')
+        origin = request.headers.get('Origin')
+        if origin not in allowed_origins:
+            return response
+        
+        headers = response.headers
+        headers['Access-Control-Allow-Origin'] = origin
+        if request.method == 'OPTIONS' and 'Access-Control-Request-Method' in request.headers:
+            headers['Access-Control-Allow-Methods'] = CORS_ALLOW_METHODS
+            headers['Access-Control-Allow-Headers'] = CORS_ALLOW_HEADERS
+        return response
+
+
 def create_app(config_class=Config):
     """
     Application Factory Pattern
@@ -27,47 +83,61 @@ def create_app(config_class=Config):
     # Load configuration
     app.config.from_object(config_class)
     
+    # Dùng orjson cho jsonify (nhanh hơn, serialize datetime trực tiếp)
+    app.json = OrjsonProvider(app)
+    
     # Enable CORS - Quan trọng cho kiến trúc Client-Server
     # Cho phép client từ domain khác gọi API
-    # supports_credentials=True: Cho phép gửi cookies qua CORS
-    CORS(app, resources={
-        r"/api/v1/*": {
-            "origins": app.config['CORS_ORIGINS'],  # Cho phép các origins được cấu hình
-            "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
-            "supports_credentials": True,  # QUAN TRỌNG: Cho phép gửi cookies
-            "expose_headers": ["Set-Cookie"]
-        }
-    })
+    init_cors(app, config_class.API_PREFIX)
+    
+    # Initialize MongoDB (tham số pool truyền thẳng cho MongoClient)
+    mongo.init_app(
+        app,
+        maxPoolSize=app.config['MONGO_MAX_POOL_SIZE'],
+        minPoolSize=app.config['MONGO_MIN_POOL_SIZE'],
+        waitQueueTimeoutMS=app.config['MONGO_WAIT_QUEUE_TIMEOUT_MS']
+    )
+    warm_up_pool(mongo.cx, app.config['MONGO_WARMUP_CONNECTIONS'])
     
-    # Initialize MongoDB
-    mongo.init_app(app)
+    # Thread nền theo dõi kết nối MongoDB cho /health
+    start_db_pinger(app.config['DB_PING_INTERVAL'])
     
     # Register API blueprint
     app.register_blueprint(api, url_prefix=config_class.API_PREFIX)
     
-    # Create indexes for MongoDB collections
-    with app.app_context():
-        try:
-            # Test connection first
-            mongo.db.command('ping')
-            
-            # Books collection indexes
-            mongo.db.books.create_index('isbn', unique=True)
-            mongo.db.books.create_index('title')
-            mongo.db.books.create_index('author')
-            
-            # Borrow records collection indexes
-            mongo.db.borrow_records.create_index('book_id')
-            mongo.db.borrow_records.create_index('borrower_name')
-            mongo.db.borrow_records.create_index('borrower_email')
-            mongo.db.borrow_records.create_index('status')
-            mongo.db.borrow_records.create_index('borrow_date')
-            
-            print("✅ MongoDB connection successful and indexes created")
-        except Exception as e:
-            print(f"⚠️  Warning: Could not connect to MongoDB or create indexes: {e}")
-            print("   Please make sure MongoDB is running at the configured URI")
+    # Create indexes for MongoDB collections (một lần mỗi process, tắt được bằng INIT_INDEXES)
+    if app.config.get('INIT_INDEXES', True):
+        with app.app_context():
+            try:
+                if ensure_indexes(mongo.db):
+                    print("✅ MongoDB connection successful and indexes created")
+            except DuplicateIsbnError as e:
+                # Các index khác đã tạo xong; ISBN trùng phải được xử lý thủ công
+                app.logger.error('Unique ISBN indexes not created, fix duplicate books first: %s', e.conflicts)
+            except Exception as e:
+                print(f"⚠️  Warning: Could not connect to MongoDB or create indexes: {e}")
+                print("   Please make sure MongoDB is running at the configured URI")
+    
+    # Body của root endpoint không đổi theo request - serialize một lần khi tạo app
+    index_body = orjson.dumps({
+        'success': True,
+        'service': config_class.API_TITLE,
+        'version': config_class.API_VERSION,
+        'description': 'REST API Server cho hệ thống quản lý thư viện',
+        'architecture': 'Stateless Client-Server REST API',
+        'database': 'MongoDB',
+        'endpoints': {
+            'auth': f'{config_class.API_PREFIX}/auth/login',
+            'books': f'{config_class.API_PREFIX}/books',
+            'borrow_records': f'{config_class.API_PREFIX}/borrow-records',
+            'statistics': f'{config_class.API_PREFIX}/statistics',
+            'health': f'{config_class.API_PREFIX}/health'
+        },
+        'documentation': {
+            'openapi': '/openapi.yaml',
+            'note': 'Mọi request cần authentication phải gửi kèm: Authorization: Bearer <token>'
+        }
+    })
     
     # Root endpoint
     @app.route('/')
@@ -77,50 +147,28 @@ def create_app(config_class=Config):
         
         REST Principle: Self-descriptive messages
         """
-        return jsonify({
-            'success': True,
-            'service': config_class.API_TITLE,
-            'version': config_class.API_VERSION,
-            'description': 'REST API Server cho hệ thống quản lý thư viện',
-            'architecture': 'Stateless Client-Server REST API',
-            'database': 'MongoDB',
-            'endpoints': {
-                'auth': f'{config_class.API_PREFIX}/auth/login',
-                'books': f'{config_class.API_PREFIX}/books',
-                'borrow_records': f'{config_class.API_PREFIX}/borrow-records',
-                'statistics': f'{config_class.API_PREFIX}/statistics',
-                'health': f'{config_class.API_PREFIX}/health'
-            },
-            'documentation': {
-                'openapi': '/openapi.yaml',
-                'note': 'Mọi request cần authentication phải gửi kèm: Authorization: Bearer <token>'
-            }
-        }), 200
+        return json_blob(index_body, 200)
     
     # Error handlers
     @app.errorhandler(404)
     def not_found(error):
         """Handle 404 errors"""
-        return jsonify({
-            'error': 'Not Found',
-            'message': 'The requested resource was not found'
-        }), 404
+        return json_blob(NOT_FOUND_BODY, 404)
     
     @app.errorhandler(405)
     def method_not_allowed(error):
         """Handle 405 errors"""
-        return jsonify({
-            'error': 'Method Not Allowed',
-            'message': 'The method is not allowed for the requested URL'
-        }), 405
+        return json_blob(METHOD_NOT_ALLOWED_BODY, 405)
+    
+    @app.errorhandler(413)
+    def request_too_large(error):
+        """Handle 413 errors (body vượt MAX_CONTENT_LENGTH)"""
+        return json_blob(PAYLOAD_TOO_LARGE_BODY, 413)
     
     @app.errorhandler(500)
     def internal_error(error):
         """Handle 500 errors"""
-        return jsonify({
-            'error': 'Internal Server Error',
-            'message': 'An unexpected error occurred'
-        }), 500
+        return json_blob(INTERNAL_ERROR_BODY, 500)
     
     return app
 
@@ -2,13 +2,33 @@
 JWT Authentication Module
 Triển khai Stateless Authentication theo nguyên tắc REST
 """
+import base64
+import hashlib
+import hmac
 import jwt
-from datetime import datetime, timedelta
-from functools import wraps
+import orjson
+import time
+from functools import wraps, lru_cache
 from flask import request, jsonify
 from config import Config
 
 
+def _b64encode(data):
+    """base64url không padding (theo chuẩn JWT)"""
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def _b64decode(data):
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+# HS256 tự ký bằng hmac/hashlib (OpenSSL) - header và key chỉ chuẩn bị một lần
+# Thuật toán khác thì dùng PyJWT như cũ
+_USE_HS256 = Config.JWT_ALGORITHM == 'HS256'
+_HS256_HEADER = _b64encode(b'{"alg":"HS256","typ":"JWT"}')
+_SECRET = Config.SECRET_KEY.encode('utf-8')
+
+
 def generate_token(username, expires_in=None):
     """
     Tạo JWT token cho user
@@ -28,19 +48,24 @@ def generate_token(username, expires_in=None):
     if expires_in is None:
         expires_in = Config.JWT_EXPIRATION_HOURS * 3600
     
+    now = int(time.time())
     payload = {
         'username': username,
-        'exp': datetime.utcnow() + timedelta(seconds=expires_in),
-        'iat': datetime.utcnow()
+        'exp': now + expires_in,
+        'iat': now
     }
     
-    token = jwt.encode(
-        payload,
-        Config.SECRET_KEY,
-        algorithm=Config.JWT_ALGORITHM
-    )
+    if not _USE_HS256:
+        return jwt.encode(
+            payload,
+            Config.SECRET_KEY,
+            algorithm=Config.JWT_ALGORITHM
+        )
+    
+    signing_input = _HS256_HEADER + b'.' + _b64encode(orjson.dumps(payload))
+    signature = hmac.new(_SECRET, signing_input, hashlib.sha256).digest()
     
-    return token
+    return (signing_input + b'.' + _b64encode(signature)).decode('ascii')
 
 
 def verify_token(token):
@@ -58,17 +83,55 @@ def verify_token(token):
     - Chỉ verify signature và expiration từ chính token
     - Mỗi request verify token độc lập
     """
+    payload = _decode_token(token)
+    
+    # Entry trong cache đã bỏ qua bước verify chữ ký nhưng vẫn phải kiểm tra hạn
+    if payload is None:
+        return None
+    exp = payload.get('exp')
+    if not isinstance(exp, (int, float)) or exp <= time.time():
+        return None
+    
+    return payload
+
+
+@lru_cache(maxsize=8192)
+def _decode_token(token):
+    """
+    Verify chữ ký + decode token, kết quả được cache theo token string
+    
+    Cùng một token được gửi lại nhiều lần trong thời gian hiệu lực,
+    nên chỉ lần đầu phải tính HMAC và parse JSON
+    """
+    if not _USE_HS256:
+        try:
+            return jwt.decode(
+                token,
+                Config.SECRET_KEY,
+                algorithms=[Config.JWT_ALGORITHM]
+            )
+        except jwt.ExpiredSignatureError:
+            return None  # Token đã hết hạn
+        except jwt.InvalidTokenError:
+            return None  # Token không hợp lệ
+    
     try:
-        payload = jwt.decode(
-            token,
-            Config.SECRET_KEY,
-            algorithms=[Config.JWT_ALGORITHM]
-        )
-        return payload
-    except jwt.ExpiredSignatureError:
-        return None  # Token đã hết hạn
-    except jwt.InvalidTokenError:
-        return None  # Token không hợp lệ
+        signing_input, _, signature = token.encode('ascii').rpartition(b'.')
+        header_b64, _, payload_b64 = signing_input.partition(b'.')
+        
+        header = orjson.loads(_b64decode(header_b64))
+        if not isinstance(header, dict) or header.get('alg') != 'HS256':
+            return None  # Không chấp nhận thuật toán khác (vd: alg=none)
+        
+        expected = hmac.new(_SECRET, signing_input, hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None  # Sai chữ ký
+        
+        payload = orjson.loads(_b64decode(payload_b64))
+    except ValueError:
+        return None  # Token không đúng định dạng (base64 / JSON / ký tự lạ)
+    
+    return payload if isinstance(payload, dict) else None
 
 
 def token_required(f):
@@ -82,45 +145,37 @@ def token_required(f):
             return jsonify({'message': f'Hello {current_user}'})
     
     Nguyên tắc REST - Stateless:
-    - Token được gửi tự động qua HTTP Cookie
+    - Token được gửi trong header Authorization: Bearer <token>
     - Server KHÔNG lưu trạng thái đăng nhập
     - Token được verify cho MỖI request độc lập
-    
-    Security:
-    - Đọc token từ HTTP-only cookie (phòng chống XSS)
-    - Fallback sang Authorization header để hỗ trợ API clients
     """
     @wraps(f)
     def decorated(*args, **kwargs):
         token = None
         
-        # Ưu tiên lấy token từ Cookie (HttpOnly - an toàn hơn)
-        token = request.cookies.get('jwt_token')
+        # Lấy token từ Authorization header
+        auth_header = request.headers.get('Authorization')
         
-        # Fallback: Lấy token từ Authorization header (để hỗ trợ API clients)
-        if not token:
-            auth_header = request.headers.get('Authorization')
-            
-            if auth_header:
-                try:
-                    # Tách "Bearer" và token
-                    parts = auth_header.split()
-                    if len(parts) == 2 and parts[0].lower() == 'bearer':
-                        token = parts[1]
-                    else:
-                        return jsonify({
-                            'error': 'Invalid Authorization header format',
-                            'message': 'Use: Authorization: Bearer <token>'
-                        }), 401
-                except Exception:
+        if auth_header:
+            try:
+                # Tách "Bearer" và token
+                parts = auth_header.split()
+                if len(parts) == 2 and parts[0].lower() == 'bearer':
+                    token = parts[1]
+                else:
                     return jsonify({
-                        'error': 'Invalid Authorization header'
+                        'error': 'Invalid Authorization header format',
+                        'message': 'Use: Authorization: Bearer <token>'
                     }), 401
+            except Exception:
+                return jsonify({
+                    'error': 'Invalid Authorization header'
+                }), 401
         
         if not token:
             return jsonify({
                 'error': 'Authentication required',
-                'message': 'Token is missing in cookie or Authorization header'
+                'message': 'Token is missing in Authorization header'
             }), 401
         
         # Verify token
@@ -158,29 +213,22 @@ def optional_token(f):
     Nguyên tắc REST - Stateless:
     - Endpoint linh hoạt xử lý cả authenticated và unauthenticated requests
     - Không lưu state về authentication status
-    
-    Security:
-    - Ưu tiên đọc token từ HTTP-only cookie
-    - Fallback sang Authorization header
     """
     @wraps(f)
     def decorated(*args, **kwargs):
         current_user = None
+        token = None
         
-        # Ưu tiên lấy token từ Cookie
-        token = request.cookies.get('jwt_token')
+        # Lấy token từ Authorization header
+        auth_header = request.headers.get('Authorization')
         
-        # Fallback: Lấy token từ Authorization header
-        if not token:
-            auth_header = request.headers.get('Authorization')
-            
-            if auth_header:
-                try:
-                    parts = auth_header.split()
-                    if len(parts) == 2 and parts[0].lower() == 'bearer':
-                        token = parts[1]
-                except Exception:
-                    pass  # Ignore errors, continue as unauthenticated
+        if auth_header:
+            try:
+                parts = auth_header.split()
+                if len(parts) == 2 and parts[0].lower() == 'bearer':
+                    token = parts[1]
+            except Exception:
+                pass  # Ignore errors, continue as unauthenticated
         
         # Verify token nếu có
         if token:
@@ -9,10 +9,16 @@ Nguyên tắc Cacheable:
 """
 import hashlib
 import json
-from flask import request, make_response
+import time
+from flask import request, make_response, current_app, Response
 from functools import wraps
 from datetime import datetime, timedelta
 
+try:
+    import redis
+except ImportError:  # Redis là tùy chọn - không có thì bỏ qua L2 cache
+    redis = None
+
 
 def generate_etag(data):
     """
@@ -23,11 +29,13 @@ def generate_etag(data):
     resource có thay đổi không.
     
     Args:
-        data: Dict hoặc list để tạo ETag
+        data: Bytes của response body, hoặc dict/list để tạo ETag
     
     Returns:
         str: ETag value (MD5 hash của data)
     """
+    if isinstance(data, bytes):
+        return hashlib.md5(data).hexdigest()
     if isinstance(data, (dict, list)):
         content = json.dumps(data, sort_keys=True)
     else:
@@ -72,7 +80,7 @@ def add_cache_headers(response, cache_type='public', max_age=300):
     return response
 
 
-def cacheable(cache_type='public', max_age=300, etag_enabled=True):
+def cacheable(cache_type='public', max_age=300, etag_enabled=True, etag_func=None):
     """
     Decorator để thêm cache support cho endpoint
     
@@ -86,6 +94,9 @@ def cacheable(cache_type='public', max_age=300, etag_enabled=True):
         cache_type: Loại cache ('public', 'private', 'no-cache', 'no-store')
         max_age: Thời gian cache (giây)
         etag_enabled: Có sử dụng ETag không
+        etag_func: (Tùy chọn) Hàm nhận cùng tham số với view, trả về ETag (weak)
+                   tính rẻ TRƯỚC khi chạy view. Khớp If-None-Match thì trả 304 luôn,
+                   không query dữ liệu. Trả None thì dùng ETag theo nội dung như cũ
     
     Usage:
         @api.route('/resource')
@@ -101,6 +112,13 @@ def cacheable(cache_type='public', max_age=300, etag_enabled=True):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
+            # ETag tính trước (vd: từ updated_at) - khớp thì bỏ qua hẳn view
+            etag = etag_func(*args, **kwargs) if etag_enabled and etag_func else None
+            if etag and request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+                response.headers['ETag'] = f'W/"{etag}"'
+                return add_cache_headers(response, cache_type, max_age)
+            
             # Gọi function gốc
             result = f(*args, **kwargs)
             
@@ -120,27 +138,26 @@ def cacheable(cache_type='public', max_age=300, etag_enabled=True):
             response.headers['Last-Modified'] = datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
             
             # ETag support
-            if etag_enabled:
-                try:
-                    # Lấy response data để tạo ETag
-                    response_json = response.get_json()
-                    if response_json:
-                        etag = generate_etag(response_json)
-                        response.headers['ETag'] = f'"{etag}"'
-                        
-                        # Kiểm tra If-None-Match header (conditional request)
-                        if_none_match = request.headers.get('If-None-Match')
-                        if if_none_match:
-                            # Remove quotes nếu có
-                            client_etag = if_none_match.strip('"')
-                            if client_etag == etag:
-                                # Resource không thay đổi - trả 304 Not Modified
-                                response = make_response('', 304)
-                                response.headers['ETag'] = f'"{etag}"'
-                                return add_cache_headers(response, cache_type, max_age)
-                except:
-                    # Nếu không parse được JSON, bỏ qua ETag
-                    pass
+            if etag:
+                response.headers['ETag'] = f'W/"{etag}"'
+            elif etag_enabled and response.is_json and not response.is_streamed:
+                # Hash thẳng bytes đã serialize thay vì parse lại JSON rồi json.dumps lần nữa
+                # (orjson cho cùng bytes với cùng dữ liệu)
+                body = response.get_data()
+                if body:
+                    etag = generate_etag(body)
+                    response.headers['ETag'] = f'"{etag}"'
+                    
+                    # Kiểm tra If-None-Match header (conditional request)
+                    if_none_match = request.headers.get('If-None-Match')
+                    if if_none_match:
+                        # Remove quotes nếu có
+                        client_etag = if_none_match.strip('"')
+                        if client_etag == etag:
+                            # Resource không thay đổi - trả 304 Not Modified
+                            response = make_response('', 304)
+                            response.headers['ETag'] = f'"{etag}"'
+                            return add_cache_headers(response, cache_type, max_age)
             
             # Thêm cache headers
             return add_cache_headers(response, cache_type, max_age)
@@ -189,6 +206,240 @@ def vary_on(headers):
     return decorator
 
 
+def get_redis():
+    """
+    Lấy Redis client dùng chung cho app (L2 cache giữa các worker)
+    
+    Returns:
+        Redis client, hoặc None nếu không cấu hình REDIS_URL / chưa cài redis
+    """
+    url = current_app.config.get('REDIS_URL')
+    if not url or redis is None:
+        return None
+    
+    client = current_app.extensions.get('redis_cache')
+    if client is None:
+        client = redis.Redis.from_url(url, socket_timeout=0.5)
+        current_app.extensions['redis_cache'] = client
+    return client
+
+
+def redis_cached(prefix, ttl=60):
+    """
+    Decorator cache response JSON trong Redis (server-side, dùng chung mọi worker)
+    
+    Khác với @cacheable (chỉ thêm HTTP headers), decorator này tránh hẳn
+    việc query MongoDB khi cache còn hạn. Đặt bên dưới @cacheable để
+    ETag / 304 vẫn được tính trên response lấy từ Redis.
+    
+    Args:
+        prefix: Nhóm cache, dùng để invalidate (vd: 'books', 'statistics')
+        ttl: Thời gian sống của key (giây), nên bằng max_age của @cacheable
+    
+    Usage:
+        @api.route('/statistics')
+        @cacheable(cache_type='public', max_age=30)
+        @redis_cached('statistics', ttl=30)
+        def get_statistics():
+            ...
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            client = get_redis()
+            if client is None:
+                return f(*args, **kwargs)
+            
+            path_hash = hashlib.sha1(request.full_path.encode('utf-8')).hexdigest()
+            key = f'l2:{prefix}:{path_hash}'
+            
+            try:
+                cached = client.get(key)
+            except redis.RedisError:
+                # Redis lỗi thì phục vụ trực tiếp từ MongoDB
+                return f(*args, **kwargs)
+            
+            if cached is not None:
+                return Response(cached, status=200, mimetype='application/json')
+            
+            response = make_response(f(*args, **kwargs))
+            
+            # Chỉ cache response thành công
+            if response.status_code == 200:
+                try:
+                    pipe = client.pipeline()
+                    pipe.setex(key, ttl, response.get_data())
+                    # Ghi lại key theo nhóm để invalidate khi có thay đổi
+                    pipe.sadd(f'l2:keys:{prefix}', key)
+                    pipe.expire(f'l2:keys:{prefix}', ttl)
+                    pipe.execute()
+                except redis.RedisError:
+                    pass
+            
+            return response
+        
+        return decorated_function
+    return decorator
+
+
+def get_cache_version(prefix):
+    """
+    Lấy version hiện tại của một nhóm cache (tăng mỗi lần invalidate_redis_cache)
+    
+    Dùng để tạo ETag cho cả collection mà không cần query MongoDB
+    
+    Returns:
+        str: version, hoặc None nếu không có Redis
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    
+    key = f'l2:version:{prefix}'
+    try:
+        # Khởi tạo theo thời gian để version không lặp lại sau khi Redis bị xóa dữ liệu
+        client.set(key, int(time.time() * 1000), nx=True)
+        version = client.get(key)
+    except redis.RedisError:
+        return None
+    return version.decode('ascii') if isinstance(version, bytes) else str(version)
+
+
+def invalidate_redis_cache(*prefixes):
+    """
+    Xóa các response đã cache trong Redis của những nhóm được chỉ định
+    Gọi từ các mutation operations (POST, PUT, DELETE)
+    
+    Args:
+        prefixes: Tên nhóm cache (vd: 'books', 'statistics')
+    """
+    client = get_redis()
+    if client is None:
+        return
+    
+    try:
+        for prefix in prefixes:
+            index_key = f'l2:keys:{prefix}'
+            keys = client.smembers(index_key)
+            client.delete(index_key, *keys)
+            version_key = f'l2:version:{prefix}'
+            client.set(version_key, int(time.time() * 1000), nx=True)
+            client.incr(version_key)
+    except redis.RedisError:
+        pass
+
+
+# Giới hạn số document count_documents được phép đếm cho một filter
+MAX_COUNT_CAP = 10_000
+
+
+def cached_count(collection, query, ttl=30, cap=MAX_COUNT_CAP):
+    """
+    Đếm số document cho pagination mà không scan lại mỗi request
+    
+    - Không có filter: estimated_document_count() đọc metadata của collection
+    - Có filter: count_documents dừng lại ở `cap` (không duyệt hết index),
+      kết quả được cache trong Redis (nếu có) trong ttl giây
+    
+    Args:
+        collection: PyMongo collection
+        query: Filter đã build cho find/aggregate
+        ttl: Thời gian cache count có filter (giây)
+        cap: Số document tối đa được đếm
+    
+    Returns:
+        tuple: (total, is_estimate, capped)
+            - is_estimate=True nếu có thể lệch so với thực tế
+            - capped=True nếu số thực tế >= cap (total chỉ là cận dưới)
+    """
+    if not query:
+        return collection.estimated_document_count(), True, False
+    
+    client = get_redis()
+    if client is None:
+        total = collection.count_documents(query, limit=cap)
+        return total, False, total >= cap
+    
+    signature = json.dumps(query, sort_keys=True, default=str)
+    key = f'cnt:{collection.name}:{hashlib.sha1(signature.encode("utf-8")).hexdigest()}'
+    
+    try:
+        cached = client.get(key)
+        if cached is not None:
+            total = int(cached)
+            return total, True, total >= cap
+    except redis.RedisError:
+        total = collection.count_documents(query, limit=cap)
+        return total, False, total >= cap
+    
+    total = collection.count_documents(query, limit=cap)
+    try:
+        client.setex(key, ttl, total)
+    except redis.RedisError:
+        pass
+    return total, False, total >= cap
+
+
+def reserve_counter(key, load):
+    """
+    Giữ chỗ 1 đơn vị trên counter trong Redis (DECR atomic)
+    
+    Dùng làm cổng chặn trước khi ghi MongoDB: counter về âm thì trả lại và từ chối,
+    request đó không cần chạm tới database.
+    
+    Args:
+        key: Redis key của counter
+        load: Hàm trả giá trị khởi tạo (đọc từ MongoDB), None nếu không tồn tại
+    
+    Returns:
+        True nếu giữ được chỗ, False nếu counter đã hết,
+        None nếu không có Redis / không khởi tạo được (caller tự xử lý)
+    """
+    client = get_redis()
+    if client is None:
+        return None
+    
+    try:
+        if not client.exists(key):
+            initial = load()
+            if initial is None:
+                return None
+            client.set(key, initial, nx=True)
+        
+        if client.decr(key) < 0:
+            client.incr(key)
+            return False
+        return True
+    except redis.RedisError:
+        return None
+
+
+def release_counter(key):
+    """Trả lại 1 đơn vị cho counter (INCR) nếu counter đang tồn tại"""
+    client = get_redis()
+    if client is None:
+        return
+    
+    try:
+        # Không tạo key mới: counter chưa có thì lần giữ chỗ sau sẽ đọc lại từ MongoDB
+        if client.exists(key):
+            client.incr(key)
+    except redis.RedisError:
+        pass
+
+
+def drop_counter(key):
+    """Xóa counter để lần sau khởi tạo lại từ MongoDB (khi số lượng bị sửa trực tiếp)"""
+    client = get_redis()
+    if client is None:
+        return
+    
+    try:
+        client.delete(key)
+    except redis.RedisError:
+        pass
+
+
 def invalidate_cache_headers():
     """
     Tạo headers để invalidate cache
@@ -0,0 +1,44 @@
+"""
+JSON Provider dùng orjson
+Thay thế json của stdlib để serialize response nhanh hơn
+"""
+import orjson
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider cho Flask sử dụng orjson
+
+    - orjson viết bằng Rust, serialize nhanh hơn json stdlib nhiều lần
+    - Hỗ trợ datetime trực tiếp (ISO 8601), không cần gọi .isoformat()
+    - datetime naive (datetime.utcnow() lưu trong MongoDB) được ghi kèm +00:00
+    - ObjectId serialize thành chuỗi hex
+    - Kiểu dữ liệu khác orjson không hỗ trợ sẽ fallback về DefaultJSONProvider.default
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        return self._dumps_bytes(obj, indent=kwargs.get('indent')).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            self._dumps_bytes(obj, indent=indent) + b'\n', mimetype=self.mimetype
+        )
+
+    def _dumps_bytes(self, obj, indent=None):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
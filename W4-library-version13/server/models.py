@@ -3,11 +3,20 @@ Database Models
 Định nghĩa cấu trúc dữ liệu cho REST API với MongoDB
 """
 from flask_pymongo import PyMongo
+from pymongo import IndexModel, UpdateOne
+from pymongo.errors import OperationFailure
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from bson import ObjectId
+from functools import lru_cache
+import threading
+from bson import ObjectId, json_util
+import base64
 
 mongo = PyMongo()
 
+# Database đã tạo indexes trong process này (ensure_indexes chỉ chạy một lần)
+_indexed_dbs = set()
+
 
 def get_pagination_params(request, default_per_page=10, max_per_page=100):
     """
@@ -19,19 +28,69 @@ def get_pagination_params(request, default_per_page=10, max_per_page=100):
         max_per_page: Số items tối đa mỗi trang
     
     Returns:
-        tuple: (page, per_page)
+        tuple: (page, per_page, after) - after là cursor keyset (?after=), None nếu dùng page
     """
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', default_per_page, type=int)
+    after = request.args.get('after', type=str) or None
     
     # Validate
     page = max(1, page)  # Trang phải >= 1
     per_page = min(max(1, per_page), max_per_page)  # Giới hạn per_page
     
-    return page, per_page
+    return page, per_page, after
+
+
+def encode_cursor(doc, sort_field):
+    """
+    Tạo cursor (opaque string) từ document cuối trang cho keyset pagination
+    
+    Args:
+        doc: MongoDB document cuối cùng của trang hiện tại
+        sort_field: Field đang dùng để sort
+    
+    Returns:
+        str: base64url của (giá trị sort_field, _id)
+    """
+    raw = json_util.dumps([doc.get(sort_field), doc['_id']])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
 
 
-def format_pagination_response(items, total, page, per_page, items_key='items'):
+def decode_cursor(cursor):
+    """
+    Giải mã cursor do encode_cursor tạo ra
+    
+    Returns:
+        tuple: (sort_value, last_id)
+    
+    Raises:
+        ValueError / TypeError nếu cursor không hợp lệ
+    """
+    padded = cursor + '=' * (-len(cursor) % 4)
+    sort_value, last_id = json_util.loads(base64.urlsafe_b64decode(padded))
+    if not isinstance(last_id, ObjectId):
+        raise ValueError('Invalid cursor')
+    return sort_value, last_id
+
+
+def keyset_condition(sort_field, direction, sort_value, last_id):
+    """
+    Điều kiện lấy các document đứng sau cursor theo thứ tự (sort_field, _id)
+    
+    Thay cho skip(): MongoDB đọc thẳng từ vị trí cursor trên index
+    thay vì duyệt rồi bỏ qua (page - 1) * per_page documents
+    """
+    op = '$gt' if direction == 1 else '$lt'
+    return {
+        '$or': [
+            {sort_field: {op: sort_value}},
+            {sort_field: sort_value, '_id': {op: last_id}}
+        ]
+    }
+
+
+def format_pagination_response(items, total, page, per_page, items_key='items', total_is_estimate=False,
+                               next_cursor=None, has_more=None, total_capped=False):
     """
     Helper function để format pagination response
     
@@ -41,29 +100,184 @@ def format_pagination_response(items, total, page, per_page, items_key='items'):
         page: Current page
         per_page: Items per page
         items_key: Key name cho items trong response
+        total_is_estimate: total là số ước lượng / lấy từ cache (có thể lệch)
+        next_cursor: Cursor cho trang tiếp theo (?after=), None nếu hết
+        has_more: Còn dữ liệu sau trang này không (biết từ limit(per_page + 1)),
+                  None thì suy ra từ total như trước
+        total_capped: total bị chặn ở MAX_COUNT_CAP, số thực tế có thể lớn hơn
     
     Returns:
         dict: Formatted response with pagination metadata
     """
     pages = (total + per_page - 1) // per_page  # Ceiling division
-    has_next = page < pages
+    has_next = page < pages if has_more is None else has_more
     has_prev = page > 1
     
     return {
         items_key: items,
         'pagination': {
             'total': total,
+            'total_is_estimate': total_is_estimate,
+            'total_capped': total_capped,
             'page': page,
             'per_page': per_page,
             'pages': pages,
             'has_next': has_next,
             'has_prev': has_prev,
             'next_page': page + 1 if has_next else None,
-            'prev_page': page - 1 if has_prev else None
+            'prev_page': page - 1 if has_prev else None,
+            'next_cursor': next_cursor
         }
     }
 
 
+# Collation của unique index isbn_norm - query phải truyền cùng collation để dùng index
+ISBN_COLLATION = {'locale': 'en', 'strength': 2}
+
+# Mã lỗi MongoDB khi dữ liệu trùng khóa (kể cả lúc build unique index)
+DUPLICATE_KEY_CODE = 11000
+
+
+class DuplicateIsbnError(RuntimeError):
+    """Không tạo được unique index vì dữ liệu cũ có ISBN trùng"""
+
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        details = '; '.join(f'{field}: {", ".join(values)}' for field, values in conflicts.items())
+        super().__init__(f'Duplicate ISBNs block unique indexes ({details})')
+
+
+def find_duplicate_values(collection, field, collation=None, limit=20):
+    """Các giá trị bị trùng của field (tối đa limit giá trị) để báo lỗi unique index"""
+    pipeline = [
+        {'$match': {field: {'$type': 'string'}}},
+        {'$group': {'_id': f'${field}', 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+        {'$limit': limit},
+    ]
+    kwargs = {'collation': collation} if collation else {}
+    return [doc['_id'] for doc in collection.aggregate(pipeline, **kwargs)]
+
+
+def normalize_isbn(isbn):
+    """Chuẩn hóa ISBN để so sánh (bỏ dấu '-', viết hoa)"""
+    return str(isbn).upper().replace('-', '')
+
+
+def warm_up_pool(client, connections):
+    """
+    Mở sẵn `connections` kết nối trong pool của MongoClient (chạy ở thread nền)
+    
+    Ping đồng thời từ nhiều thread để mỗi ping giữ một socket riêng;
+    không kết nối được thì bỏ qua, pool sẽ mở kết nối khi có request như bình thường
+    """
+    def ping(_):
+        client.admin.command('ping')
+    
+    def run():
+        try:
+            with ThreadPoolExecutor(max_workers=connections) as executor:
+                list(executor.map(ping, range(connections)))
+        except Exception:
+            pass
+    
+    if connections > 0:
+        threading.Thread(target=run, name='mongo-warmup', daemon=True).start()
+
+
+@lru_cache(maxsize=4096)
+def to_object_id(value):
+    """
+    Parse chuỗi hex 24 ký tự thành ObjectId, cache theo chuỗi
+    
+    Cùng một book_id/record_id thường lặp lại giữa các request (ETag rồi GET, mượn liên tiếp);
+    ObjectId không đổi sau khi tạo nên dùng chung instance được. Chuỗi sai không được cache
+    """
+    return ObjectId(value)
+
+
+def ensure_indexes(db):
+    """
+    Tạo indexes cho các collection (idempotent, một lần cho mỗi database trong process)
+    
+    Mỗi collection một lệnh create_indexes cho các index thường; unique index tạo riêng
+    
+    Returns:
+        bool: True nếu vừa tạo, False nếu đã tạo trước đó
+    
+    Raises:
+        DuplicateIsbnError: Dữ liệu có ISBN trùng nên unique index không tạo được
+            (các index còn lại vẫn được tạo)
+    """
+    if db.name in _indexed_dbs:
+        return False
+    
+    # Backfill isbn_norm cho sách tạo trước khi có field này (phải chạy trước unique index)
+    backfill = [
+        UpdateOne({'_id': doc['_id']}, {'$set': {'isbn_norm': normalize_isbn(doc['isbn'])}})
+        for doc in db.books.find({'isbn_norm': {'$exists': False}}, {'isbn': 1})
+    ]
+    if backfill:
+        db.books.bulk_write(backfill, ordered=False)
+    
+    db.books.create_indexes([
+        IndexModel('title'),
+        IndexModel('author'),
+        # Full-text index cho filter title/author trong GET /books
+        IndexModel(
+            [('title', 'text'), ('author', 'text')],
+            weights={'title': 10, 'author': 5},
+            name='books_text'
+        ),
+        # Sort mặc định created_at desc (list không filter)
+        IndexModel([('created_at', -1)]),
+        # available_only + sort mặc định: theo ESR, field sort đứng trước field range
+        IndexModel([('created_at', -1), ('available', 1)]),
+        # updated_at mới nhất cho ETag của danh sách sách khi không có Redis
+        IndexModel([('updated_at', -1)]),
+    ])
+    
+    db.borrow_records.create_indexes([
+        IndexModel('borrower_name'),
+        IndexModel('borrower_email'),
+        # Sort mặc định borrow_date desc + _id (tie-breaker của list) - thay index borrow_date đơn
+        IndexModel([('borrow_date', -1), ('_id', -1)]),
+        # Filter status + sort borrow_date (Equality trước Sort)
+        IndexModel([('status', 1), ('borrow_date', -1), ('_id', -1)]),
+        # Partial index cho "đang mượn": nhỏ hơn vì bỏ qua các record đã trả
+        IndexModel(
+            [('borrow_date', -1), ('_id', -1)],
+            partialFilterExpression={'status': 'borrowed'},
+            name='borrow_date_active'
+        ),
+        # Kiểm tra sách đang mượn khi xóa / lọc theo sách (thay cho index book_id đơn)
+        IndexModel([('book_id', 1), ('status', 1)]),
+    ])
+    
+    # Unique index build riêng từng cái: ISBN trùng trong dữ liệu cũ chỉ làm hỏng index đó,
+    # không chặn các index ở trên; giá trị trùng được báo lại qua DuplicateIsbnError
+    conflicts = {}
+    unique_indexes = (
+        ('isbn', {}),
+        ('isbn_norm', {
+            'collation': ISBN_COLLATION,
+            'partialFilterExpression': {'isbn_norm': {'$type': 'string'}}
+        }),
+    )
+    for field, options in unique_indexes:
+        try:
+            db.books.create_index(field, unique=True, **options)
+        except OperationFailure as e:
+            if e.code != DUPLICATE_KEY_CODE:
+                raise
+            conflicts[field] = find_duplicate_values(db.books, field, options.get('collation'))
+    if conflicts:
+        raise DuplicateIsbnError(conflicts)
+    
+    _indexed_dbs.add(db.name)
+    return True
+
+
 class Book:
     """
     Model cho sách
@@ -71,15 +285,32 @@ class Book:
     Resource representation theo REST principles
     """
     
+    # Các field to_dict cần - dùng làm projection để không đọc field nội bộ (isbn_norm, ...)
+    # Server chỉ gửi về các field này nên driver chỉ decode đúng phần cần dùng
+    # (RawBSONDocument không giúp gì thêm: truy cập field đầu tiên đã inflate cả document)
+    PROJECTION = {
+        'title': 1, 'author': 1, 'isbn': 1, 'quantity': 1,
+        'available': 1, 'created_at': 1, 'updated_at': 1
+    }
+    
     @staticmethod
     def to_dict(book_doc):
         """
         Chuyển đổi MongoDB document thành dictionary (JSON-serializable)
+        Datetime giữ nguyên, orjson serialize trực tiếp sang ISO 8601
         
         REST principle: Resource representation
         """
         if not book_doc:
             return None
+        
+        # Chỉ lấy thời gian hiện tại khi document thiếu field (dùng chung cho cả hai)
+        created_at = book_doc.get('created_at')
+        updated_at = book_doc.get('updated_at')
+        if created_at is None or updated_at is None:
+            now = datetime.utcnow()
+            created_at = created_at or now
+            updated_at = updated_at or now
             
         return {
             'id': str(book_doc['_id']),
@@ -88,21 +319,52 @@ class Book:
             'isbn': book_doc.get('isbn', ''),
             'quantity': book_doc.get('quantity', 0),
             'available': book_doc.get('available', 0),
-            'created_at': book_doc.get('created_at', datetime.utcnow()).isoformat(),
-            'updated_at': book_doc.get('updated_at', datetime.utcnow()).isoformat()
+            'created_at': created_at,
+            'updated_at': updated_at
         }
     
     @staticmethod
-    def create(title, author, isbn, quantity):
-        """Tạo document mới cho sách"""
+    def to_dict_batch(book_docs):
+        """
+        Chuyển danh sách document thành list dictionary (dùng cho list endpoint)
+        
+        Cùng kết quả với to_dict cho từng document, nhưng bind str và lấy thời gian
+        mặc định một lần cho cả trang
+        """
+        _str = str
+        now = datetime.utcnow()
+        return [
+            {
+                'id': _str(d['_id']),
+                'title': d.get('title', ''),
+                'author': d.get('author', ''),
+                'isbn': d.get('isbn', ''),
+                'quantity': d.get('quantity', 0),
+                'available': d.get('available', 0),
+                'created_at': d.get('created_at') or now,
+                'updated_at': d.get('updated_at') or now
+            }
+            for d in book_docs
+        ]
+    
+    @staticmethod
+    def create(title, author, isbn, quantity, *, now=None):
+        """
+        Tạo document mới cho sách
+        
+        Args:
+            now: Timestamp dùng chung khi tạo nhiều document một lượt (mặc định utcnow())
+        """
+        now = now or datetime.utcnow()
         return {
             'title': title,
             'author': author,
             'isbn': isbn,
+            'isbn_norm': normalize_isbn(isbn),
             'quantity': quantity,
             'available': quantity,
-            'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow()
+            'created_at': now,
+            'updated_at': now
         }
 
 
@@ -113,6 +375,12 @@ class BorrowRecord:
     Resource representation theo REST principles
     """
     
+    # Các field to_dict cần (book_title/book_author được join riêng)
+    PROJECTION = {
+        'book_id': 1, 'borrower_name': 1, 'borrower_email': 1,
+        'borrow_date': 1, 'return_date': 1, 'status': 1
+    }
+    
     @staticmethod
     def to_dict(record_doc, include_book=True):
         """
@@ -132,8 +400,8 @@ class BorrowRecord:
             'book_id': str(record_doc.get('book_id', '')),
             'borrower_name': record_doc.get('borrower_name', ''),
             'borrower_email': record_doc.get('borrower_email', ''),
-            'borrow_date': record_doc.get('borrow_date', datetime.utcnow()).isoformat(),
-            'return_date': record_doc.get('return_date').isoformat() if record_doc.get('return_date') else None,
+            'borrow_date': record_doc.get('borrow_date') or datetime.utcnow(),
+            'return_date': record_doc.get('return_date'),
             'status': record_doc.get('status', 'borrowed')
         }
         
@@ -144,13 +412,37 @@ class BorrowRecord:
         return result
     
     @staticmethod
-    def create(book_id, borrower_name, borrower_email):
-        """Tạo document mới cho borrow record"""
+    def to_dict_batch(record_docs):
+        """Chuyển danh sách document thành list dictionary (giống Book.to_dict_batch)"""
+        _str = str
+        now = datetime.utcnow()
+        records = []
+        append = records.append
+        for d in record_docs:
+            result = {
+                'id': _str(d['_id']),
+                'book_id': _str(d.get('book_id', '')),
+                'borrower_name': d.get('borrower_name', ''),
+                'borrower_email': d.get('borrower_email', ''),
+                'borrow_date': d.get('borrow_date') or now,
+                'return_date': d.get('return_date'),
+                'status': d.get('status', 'borrowed')
+            }
+            book_title = d.get('book_title')
+            if book_title:
+                result['book_title'] = book_title
+                result['book_author'] = d.get('book_author')
+            append(result)
+        return records
+    
+    @staticmethod
+    def create(book_id, borrower_name, borrower_email, *, now=None):
+        """Tạo document mới cho borrow record (now: giống Book.create)"""
         return {
-            'book_id': ObjectId(book_id),
+            'book_id': to_object_id(book_id),
             'borrower_name': borrower_name,
             'borrower_email': borrower_email,
-            'borrow_date': datetime.utcnow(),
+            'borrow_date': now or datetime.utcnow(),
             'return_date': None,
             'status': 'borrowed'
         }
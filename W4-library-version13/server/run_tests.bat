@@ -1,7 +1,7 @@
 @echo off
 REM Script để chạy tests trên Windows
 REM Sử dụng: run_tests.bat [mode]
-REM   mode: all, coverage, verbose, fast
+REM   mode: all, coverage, verbose, fast, parallel
 
 setlocal
 
@@ -39,9 +39,12 @@ if "%MODE%"=="all" (
 ) else if "%MODE%"=="fast" (
     echo Running tests with pytest...
     pytest test_api.py -v --tb=short
+) else if "%MODE%"=="parallel" (
+    echo Running tests in parallel with pytest-xdist...
+    pytest test_api.py -n auto --maxprocesses=8 --dist=loadscope
 ) else (
     echo Unknown mode: %MODE%
-    echo Valid modes: all, coverage, verbose, fast
+    echo Valid modes: all, coverage, verbose, fast, parallel
     exit /b 1
 )
 
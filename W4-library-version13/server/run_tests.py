@@ -3,24 +3,36 @@
 Script helper để chạy tests với các options khác nhau
 """
 import sys
-import subprocess
+import unittest
 import argparse
 
 
-def run_command(cmd, description):
-    """Chạy command và hiển thị kết quả"""
+def run_unittest(names, verbosity=1):
+    """Chạy tests bằng unittest ngay trong process hiện tại"""
+    suite = unittest.defaultTestLoader.loadTestsFromNames(names)
+    result = unittest.TextTestRunner(verbosity=verbosity).run(suite)
+    return result.wasSuccessful()
+
+
+def run_pytest(args):
+    """Chạy tests bằng pytest ngay trong process hiện tại"""
+    import pytest
+    return pytest.main(args) == 0
+
+
+def run_command(runner, description):
+    """Chạy runner (không spawn subprocess / shell) và hiển thị kết quả"""
     print(f"\n{'='*60}")
     print(f"  {description}")
     print(f"{'='*60}\n")
     
-    result = subprocess.run(cmd, shell=True)
-    return result.returncode == 0
+    return runner()
 
 
 def main():
     parser = argparse.ArgumentParser(description='Run Library API Tests')
     parser.add_argument('--mode', '-m', 
-                       choices=['all', 'unit', 'coverage', 'verbose', 'fast'],
+                       choices=['all', 'unit', 'coverage', 'verbose', 'fast', 'parallel'],
                        default='all',
                        help='Test mode to run')
     parser.add_argument('--class', '-c', 
@@ -32,38 +44,43 @@ def main():
     
     args = parser.parse_args()
     
-    # Determine command based on mode
+    # Determine runner based on mode
     if args.test_class and args.test_method:
         # Run specific test method
-        cmd = f'python -m unittest test_api.{args.test_class}.{args.test_method}'
+        runner = lambda: run_unittest([f'test_api.{args.test_class}.{args.test_method}'])
         description = f'Running {args.test_class}.{args.test_method}'
     elif args.test_class:
         # Run specific test class
-        cmd = f'python -m unittest test_api.{args.test_class}'
+        runner = lambda: run_unittest([f'test_api.{args.test_class}'])
         description = f'Running {args.test_class}'
     elif args.mode == 'all':
         # Run all tests with unittest
-        cmd = 'python -m unittest test_api.py'
+        runner = lambda: run_unittest(['test_api'])
         description = 'Running all tests'
     elif args.mode == 'unit':
         # Run with pytest
-        cmd = 'pytest test_api.py'
+        runner = lambda: run_pytest(['test_api.py'])
         description = 'Running tests with pytest'
     elif args.mode == 'coverage':
         # Run with coverage
-        cmd = 'pytest test_api.py --cov=. --cov-report=html --cov-report=term'
+        runner = lambda: run_pytest(['test_api.py', '--cov=.', '--cov-report=html', '--cov-report=term'])
         description = 'Running tests with coverage report'
     elif args.mode == 'verbose':
         # Run with verbose output
-        cmd = 'python -m unittest test_api.py -v'
+        runner = lambda: run_unittest(['test_api'], verbosity=2)
         description = 'Running tests (verbose mode)'
     elif args.mode == 'fast':
         # Run only fast tests (exclude slow tests if any)
-        cmd = 'pytest test_api.py -v --tb=short'
+        runner = lambda: run_pytest(['test_api.py', '-v', '--tb=short'])
         description = 'Running tests (fast mode)'
+    elif args.mode == 'parallel':
+        # Chạy song song theo test class với pytest-xdist (mỗi worker một database)
+        # Tối đa 8 worker để không vượt quá số kết nối MongoDB cho phép
+        runner = lambda: run_pytest(['test_api.py', '-n', 'auto', '--maxprocesses=8', '--dist=loadscope'])
+        description = 'Running tests in parallel (pytest-xdist)'
     
     # Run the tests
-    success = run_command(cmd, description)
+    success = run_command(runner, description)
     
     # Print summary
     print(f"\n{'='*60}")
@@ -51,12 +51,9 @@ class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
     
-    @property
-    def SECRET_KEY(self):
-        secret_key = os.environ.get('SECRET_KEY')
-        if not secret_key:
-            raise ValueError("SECRET_KEY must be set in production")
-        return secret_key
+    # Đọc một lần khi định nghĩa class - from_object lấy trực tiếp giá trị (property trên
+    # class chỉ trả về chính object property). Không fallback về dev key: thiếu thì là None
+    SECRET_KEY = os.environ.get('SECRET_KEY')
 
 
 class TestingConfig(Config):
@@ -135,15 +135,15 @@ def get_books():
     if available_only:
         query = query.filter(Book.available > 0)
     
-    # Execute with pagination
-    pagination = query.order_by(Book.created_at.desc()).paginate(
+    # Execute with pagination - chỉ SELECT các cột cần, không load ORM object
+    pagination = Book.with_dict_columns(query).order_by(Book.created_at.desc()).paginate(
         page=page, per_page=per_page, error_out=False
     )
     
     return jsonify({
         'success': True,
         'data': {
-            'books': [book.to_dict() for book in pagination.items],
+            'books': [dict(row._mapping) for row in pagination.items],
             'pagination': {
                 'total': pagination.total,
                 'page': pagination.page,
@@ -8,14 +8,40 @@ Triển khai kiến trúc Client-Server theo nguyên tắc REST
 - Tách biệt hoàn toàn Server và Client
 - CORS enabled để client từ origin khác có thể gọi
 """
-from flask import Flask, jsonify
+from flask import Flask, Response
 from flask_cors import CORS
 from models import db
 from api_routes import api
 from config import Config
+from json_provider import OrjsonProvider
+import orjson
 import os
 
 
+# Body lỗi cố định, serialize sẵn một lần (mỗi request chỉ tạo Response từ bytes)
+NOT_FOUND_BODY = orjson.dumps({
+    'error': 'Not Found',
+    'message': 'The requested resource was not found'
+})
+METHOD_NOT_ALLOWED_BODY = orjson.dumps({
+    'error': 'Method Not Allowed',
+    'message': 'The method is not allowed for the requested URL'
+})
+INTERNAL_ERROR_BODY = orjson.dumps({
+    'error': 'Internal Server Error',
+    'message': 'An unexpected error occurred'
+})
+
+
+def json_blob(blob, status):
+    """
+    Trả response JSON từ bytes đã dựng sẵn
+    
+    Tạo Response mới mỗi lần vì after_request (CORS) còn thêm header vào response
+    """
+    return Response(blob, status=status, mimetype='application/json')
+
+
 def create_app(config_class=Config):
     """
     Application Factory Pattern
@@ -26,11 +52,14 @@ def create_app(config_class=Config):
     # Load configuration
     app.config.from_object(config_class)
     
+    # Dùng orjson cho jsonify (nhanh hơn, serialize datetime trực tiếp)
+    app.json = OrjsonProvider(app)
+    
     # Enable CORS - Quan trọng cho kiến trúc Client-Server
     # Cho phép client từ domain khác gọi API
     CORS(app, resources={
         r"/api/*": {
-            "origins": config_class.CORS_ORIGINS,
+            "origins": config_class.CORS_ORIGINS_RE,
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
             "allow_headers": ["Content-Type", "Authorization"]
         }
@@ -42,9 +71,30 @@ def create_app(config_class=Config):
     # Register API blueprint
     app.register_blueprint(api, url_prefix=config_class.API_PREFIX)
     
-    # Create tables
-    with app.app_context():
-        db.create_all()
+    # Create tables (tắt được bằng INIT_DB, worker không phải kiểm tra schema mỗi lần khởi động)
+    if app.config.get('INIT_DB', True):
+        with app.app_context():
+            db.create_all()
+    
+    # Body của root endpoint không đổi theo request - serialize một lần khi tạo app
+    index_body = orjson.dumps({
+        'success': True,
+        'service': config_class.API_TITLE,
+        'version': config_class.API_VERSION,
+        'description': 'REST API Server cho hệ thống quản lý thư viện',
+        'architecture': 'Stateless Client-Server REST API',
+        'endpoints': {
+            'auth': f'{config_class.API_PREFIX}/auth/login',
+            'books': f'{config_class.API_PREFIX}/books',
+            'borrow_records': f'{config_class.API_PREFIX}/borrow-records',
+            'statistics': f'{config_class.API_PREFIX}/statistics',
+            'health': f'{config_class.API_PREFIX}/health'
+        },
+        'documentation': {
+            'openapi': '/openapi.yaml',
+            'note': 'Mọi request cần authentication phải gửi kèm: Authorization: Bearer <token>'
+        }
+    })
     
     # Root endpoint
     @app.route('/')
@@ -54,50 +104,24 @@ def create_app(config_class=Config):
         
         REST Principle: Self-descriptive messages
         """
-        return jsonify({
-            'success': True,
-            'service': config_class.API_TITLE,
-            'version': config_class.API_VERSION,
-            'description': 'REST API Server cho hệ thống quản lý thư viện',
-            'architecture': 'Stateless Client-Server REST API',
-            'endpoints': {
-                'auth': f'{config_class.API_PREFIX}/auth/login',
-                'books': f'{config_class.API_PREFIX}/books',
-                'borrow_records': f'{config_class.API_PREFIX}/borrow-records',
-                'statistics': f'{config_class.API_PREFIX}/statistics',
-                'health': f'{config_class.API_PREFIX}/health'
-            },
-            'documentation': {
-                'openapi': '/openapi.yaml',
-                'note': 'Mọi request cần authentication phải gửi kèm: Authorization: Bearer <token>'
-            }
-        }), 200
+        return json_blob(index_body, 200)
     
     # Error handlers
     @app.errorhandler(404)
     def not_found(error):
         """Handle 404 errors"""
-        return jsonify({
-            'error': 'Not Found',
-            'message': 'The requested resource was not found'
-        }), 404
+        return json_blob(NOT_FOUND_BODY, 404)
     
     @app.errorhandler(405)
     def method_not_allowed(error):
         """Handle 405 errors"""
-        return jsonify({
-            'error': 'Method Not Allowed',
-            'message': 'The method is not allowed for the requested URL'
-        }), 405
+        return json_blob(METHOD_NOT_ALLOWED_BODY, 405)
     
     @app.errorhandler(500)
     def internal_error(error):
         """Handle 500 errors"""
         db.session.rollback()
-        return jsonify({
-            'error': 'Internal Server Error',
-            'message': 'An unexpected error occurred'
-        }), 500
+        return json_blob(INTERNAL_ERROR_BODY, 500)
     
     return app
 
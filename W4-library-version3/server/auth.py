@@ -2,13 +2,38 @@
 JWT Authentication Module
 Triển khai Stateless Authentication theo nguyên tắc REST
 """
+import base64
+import hashlib
+import hmac
+import json
 import jwt
-from datetime import datetime, timedelta
-from functools import wraps
+import time
+from functools import wraps, lru_cache
 from flask import request, jsonify
 from config import Config
 
 
+def _b64decode(data):
+    """base64url không padding (theo chuẩn JWT)"""
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+# Cấu hình JWT đọc một lần lúc import, hàm sign/verify không phải tra Config mỗi lần gọi
+_ALGORITHM = Config.JWT_ALGORITHM
+_SECRET = Config.SECRET_KEY.encode('utf-8') if isinstance(Config.SECRET_KEY, str) else Config.SECRET_KEY
+_DEFAULT_EXPIRES_IN = Config.JWT_EXPIRATION_HOURS * 3600
+
+# HS256 verify bằng hmac/hashlib - key chỉ chuẩn bị một lần
+# Thuật toán khác thì dùng PyJWT như cũ
+_USE_HS256 = _ALGORITHM == 'HS256'
+
+# Token cấp trong cùng một khoảng 60 giây dùng chung iat nên có thể cache lại
+_TOKEN_BUCKET_SECONDS = 60
+# Chỉ cache token có thời hạn dài hơn nhiều so với khoảng (mất tối đa 59 giây ~ 1.6% của 1 giờ);
+# token ngắn hơn được ký với thời điểm thực để không bị rút ngắn/hết hạn ngay khi cấp
+_TOKEN_CACHE_MIN_EXPIRES_IN = 3600
+
+
 def generate_token(username, expires_in=None):
     """
     Tạo JWT token cho user
@@ -24,23 +49,45 @@ def generate_token(username, expires_in=None):
     - Token chứa tất cả thông tin cần thiết (username, expiration)
     - Server KHÔNG lưu trữ token
     - Mỗi request mang theo token độc lập
+    
+    Token có expires_in >= _TOKEN_CACHE_MIN_EXPIRES_IN được cache theo khoảng 60 giây:
+    iat lùi về đầu khoảng nên hiệu lực thực tế ngắn hơn expires_in tối đa 59 giây
     """
     if expires_in is None:
-        expires_in = Config.JWT_EXPIRATION_HOURS * 3600
+        expires_in = _DEFAULT_EXPIRES_IN
+    
+    if expires_in < _TOKEN_CACHE_MIN_EXPIRES_IN:
+        return _sign_token(username, int(time.time()), expires_in)
     
+    bucket = int(time.time()) // _TOKEN_BUCKET_SECONDS
+    return _encode_token(username, expires_in, bucket)
+
+
+@lru_cache(maxsize=1024)
+def _encode_token(username, expires_in, bucket):
+    """
+    Ký token cho (username, thời hạn, khoảng thời gian), kết quả được cache
+    
+    iat lấy ở đầu khoảng nên token là hàm thuần của tham số: đăng nhập lại
+    nhiều lần trong cùng khoảng nhận cùng token, chỉ lần đầu gọi jwt.encode.
+    Khi sang khoảng mới, key cache đổi và token mới được ký
+    """
+    return _sign_token(username, bucket * _TOKEN_BUCKET_SECONDS, expires_in)
+
+
+def _sign_token(username, issued_at, expires_in):
+    """Ký token với iat cho trước, hết hạn sau expires_in giây kể từ iat"""
     payload = {
         'username': username,
-        'exp': datetime.utcnow() + timedelta(seconds=expires_in),
-        'iat': datetime.utcnow()
+        'exp': issued_at + expires_in,
+        'iat': issued_at
     }
     
-    token = jwt.encode(
+    return jwt.encode(
         payload,
-        Config.SECRET_KEY,
-        algorithm=Config.JWT_ALGORITHM
+        _SECRET,
+        algorithm=_ALGORITHM
     )
-    
-    return token
 
 
 def verify_token(token):
@@ -58,17 +105,55 @@ def verify_token(token):
     - Chỉ verify signature và expiration từ chính token
     - Mỗi request verify token độc lập
     """
+    payload = _decode_token(token)
+    
+    # Entry trong cache đã bỏ qua bước jwt.decode nhưng vẫn phải kiểm tra hạn
+    if payload is None:
+        return None
+    exp = payload.get('exp')
+    if not isinstance(exp, (int, float)) or exp <= time.time():
+        return None
+    
+    return payload
+
+
+@lru_cache(maxsize=8192)
+def _decode_token(token):
+    """
+    Verify chữ ký + decode token, kết quả được cache theo token string
+    
+    Cùng một token được gửi lại nhiều lần trong thời gian hiệu lực,
+    nên chỉ lần đầu phải tính HMAC và parse JSON
+    """
+    if not _USE_HS256:
+        try:
+            return jwt.decode(
+                token,
+                _SECRET,
+                algorithms=[_ALGORITHM]
+            )
+        except jwt.ExpiredSignatureError:
+            return None  # Token đã hết hạn
+        except jwt.InvalidTokenError:
+            return None  # Token không hợp lệ
+    
     try:
-        payload = jwt.decode(
-            token,
-            Config.SECRET_KEY,
-            algorithms=[Config.JWT_ALGORITHM]
-        )
-        return payload
-    except jwt.ExpiredSignatureError:
-        return None  # Token đã hết hạn
-    except jwt.InvalidTokenError:
-        return None  # Token không hợp lệ
+        signing_input, _, signature = token.encode('ascii').rpartition(b'.')
+        header_b64, _, payload_b64 = signing_input.partition(b'.')
+        
+        header = json.loads(_b64decode(header_b64))
+        if not isinstance(header, dict) or header.get('alg') != 'HS256':
+            return None  # Không chấp nhận thuật toán khác (vd: alg=none)
+        
+        expected = hmac.new(_SECRET, signing_input, hashlib.sha256).digest()
+        if not hmac.compare_digest(expected, _b64decode(signature)):
+            return None  # Sai chữ ký
+        
+        payload = json.loads(_b64decode(payload_b64))
+    except ValueError:
+        return None  # Token không đúng định dạng (base64 / JSON / ký tự lạ)
+    
+    return payload if isinstance(payload, dict) else None
 
 
 def token_required(f):
@@ -95,19 +180,13 @@ def token_required(f):
         auth_header = request.headers.get('Authorization')
         
         if auth_header:
-            try:
-                # Tách "Bearer" và token
-                parts = auth_header.split()
-                if len(parts) == 2 and parts[0].lower() == 'bearer':
-                    token = parts[1]
-                else:
-                    return jsonify({
-                        'error': 'Invalid Authorization header format',
-                        'message': 'Use: Authorization: Bearer <token>'
-                    }), 401
-            except Exception:
+            # Kiểm tra prefix "Bearer " rồi cắt chuỗi, không cần split()
+            if auth_header[:7].lower() == 'bearer ':
+                token = auth_header[7:].strip()
+            else:
                 return jsonify({
-                    'error': 'Invalid Authorization header'
+                    'error': 'Invalid Authorization header format',
+                    'message': 'Use: Authorization: Bearer <token>'
                 }), 401
         
         if not token:
@@ -158,16 +237,11 @@ def optional_token(f):
         
         auth_header = request.headers.get('Authorization')
         
-        if auth_header:
-            try:
-                parts = auth_header.split()
-                if len(parts) == 2 and parts[0].lower() == 'bearer':
-                    token = parts[1]
-                    payload = verify_token(token)
-                    if payload:
-                        current_user = payload.get('username')
-            except Exception:
-                pass  # Ignore errors, continue as unauthenticated
+        # Header sai định dạng hoặc token không hợp lệ: coi như unauthenticated
+        if auth_header and auth_header[:7].lower() == 'bearer ':
+            payload = verify_token(auth_header[7:].strip())
+            if payload:
+                current_user = payload.get('username')
         
         return f(current_user, *args, **kwargs)
     
@@ -3,6 +3,7 @@ Configuration Module for REST API Server
 Quản lý cấu hình theo nguyên tắc Stateless
 """
 import os
+import re
 from datetime import timedelta
 
 
@@ -29,6 +30,14 @@ class Config:
     
     # CORS Configuration - Cho phép client từ origin khác
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000').split(',')
+    # Gộp thành một regex compile sẵn: flask-cors match một lần thay vì duyệt từng origin
+    CORS_ORIGINS_RE = re.compile(
+        '(?:%s)\\Z' % '|'.join(re.escape(origin.strip()) for origin in CORS_ORIGINS),
+        re.IGNORECASE
+    )
+    
+    # Tạo bảng (db.create_all) khi tạo app - production đặt INIT_DB=0 và chạy init_db.py một lần
+    INIT_DB = os.environ.get('INIT_DB', '1') == '1'
     
     # API Configuration
     API_TITLE = 'Library Management REST API'
@@ -51,12 +60,9 @@ class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
     
-    @property
-    def SECRET_KEY(self):
-        secret_key = os.environ.get('SECRET_KEY')
-        if not secret_key:
-            raise ValueError("SECRET_KEY must be set in production")
-        return secret_key
+    # Đọc một lần khi định nghĩa class - from_object lấy trực tiếp giá trị (property trên
+    # class chỉ trả về chính object property). Không fallback về dev key: thiếu thì là None
+    SECRET_KEY = os.environ.get('SECRET_KEY')
 
 
 class TestingConfig(Config):
@@ -0,0 +1,21 @@
+"""
+Khởi tạo database một lần (tạo các bảng còn thiếu)
+
+Dùng khi chạy server với INIT_DB=0:
+    python init_db.py
+"""
+from app import create_app
+from config import Config
+from models import db
+
+
+class InitConfig(Config):
+    """Tạo app không tự tạo bảng - script gọi db.create_all() trực tiếp"""
+    INIT_DB = False
+
+
+if __name__ == '__main__':
+    app = create_app(InitConfig)
+    with app.app_context():
+        db.create_all()
+    print(f"Database initialized: {app.config['SQLALCHEMY_DATABASE_URI']}")
@@ -41,10 +41,23 @@ class Book(db.Model):
             'isbn': self.isbn,
             'quantity': self.quantity,
             'available': self.available,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
         }
     
+    @classmethod
+    def with_dict_columns(cls, query):
+        """
+        Đổi query Book thành SELECT đúng các cột của to_dict()
+        
+        Mỗi dòng trả về là Row (dict(row._mapping) cho cùng key với to_dict()),
+        endpoint danh sách không phải dựng ORM object cho từng sách
+        """
+        return query.with_entities(
+            cls.id, cls.title, cls.author, cls.isbn,
+            cls.quantity, cls.available, cls.created_at, cls.updated_at
+        )
+    
     def __repr__(self):
         return f'<Book {self.title}>'
 
@@ -79,8 +92,8 @@ class BorrowRecord(db.Model):
             'book_id': self.book_id,
             'borrower_name': self.borrower_name,
             'borrower_email': self.borrower_email,
-            'borrow_date': self.borrow_date.isoformat(),
-            'return_date': self.return_date.isoformat() if self.return_date else None,
+            'borrow_date': self.borrow_date,
+            'return_date': self.return_date,
             'status': self.status
         }
         
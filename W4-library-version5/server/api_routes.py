@@ -8,6 +8,7 @@ from auth import token_required, optional_token, generate_token
 from cache_utils import cacheable, vary_on, invalidate_cache_headers
 from datetime import datetime
 from sqlalchemy import or_
+from sqlalchemy.orm import joinedload, selectinload
 
 api = Blueprint('api', __name__)
 
@@ -432,8 +433,8 @@ def get_borrow_records(current_user):
     status = request.args.get('status', type=str)
     borrower_name = request.args.get('borrower_name', type=str)
     
-    # Build query
-    query = BorrowRecord.query
+    # Build query (sách của cả trang load bằng một SELECT ... IN thay vì mỗi record một query)
+    query = BorrowRecord.query.options(selectinload(BorrowRecord.book))
     
     if status in ['borrowed', 'returned']:
         query = query.filter_by(status=status)
@@ -474,7 +475,7 @@ def get_borrow_record(current_user, record_id):
     REST Principles:
     - Cacheable: Private cache 60s
     """
-    record = BorrowRecord.query.get(record_id)
+    record = db.session.get(BorrowRecord, record_id, options=[joinedload(BorrowRecord.book)])
     
     if not record:
         return jsonify({
@@ -571,7 +572,7 @@ def return_book(current_user, record_id):
     - Stateless: Chỉ cần record_id
     - Idempotent: Có thể gọi nhiều lần (lần 2 trở đi trả 409)
     """
-    record = BorrowRecord.query.get(record_id)
+    record = db.session.get(BorrowRecord, record_id, options=[joinedload(BorrowRecord.book)])
     
     if not record:
         return jsonify({
@@ -589,8 +590,8 @@ def return_book(current_user, record_id):
     record.status = 'returned'
     record.return_date = datetime.utcnow()
     
-    # Increase available count
-    book = Book.query.get(record.book_id)
+    # Increase available count (sách đã load cùng record)
+    book = record.book
     if book:
         book.available += 1
     
@@ -30,7 +30,7 @@ def create_app(config_class=Config):
     # Cho phép client từ domain khác gọi API
     CORS(app, resources={
         r"/api/*": {
-            "origins": "*",  # Cho phép tất cả origins trong development
+            "origins": config_class.CORS_ORIGINS_RE,  # Danh sách CORS_ORIGINS (env var)
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
             "allow_headers": ["Content-Type", "Authorization"]
         }
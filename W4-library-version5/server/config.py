@@ -3,9 +3,25 @@ Configuration Module for REST API Server
 Quản lý cấu hình theo nguyên tắc Stateless
 """
 import os
+import re
 from datetime import timedelta
 
 
+def _engine_options(database_uri):
+    """
+    Cấu hình connection pool cho SQLAlchemy engine
+    SQLite in-memory dùng StaticPool (một kết nối duy nhất) nên không nhận pool_size
+    """
+    if database_uri in ('sqlite://', 'sqlite:///:memory:'):
+        return {}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 20)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 30)),
+        'pool_pre_ping': True,
+        'pool_recycle': 1800
+    }
+
+
 class Config:
     """
     Cấu hình cơ bản cho REST API Server
@@ -23,13 +39,26 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///library.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Connection pool giữ kết nối lâu dài, kích thước chỉnh qua DB_POOL_SIZE / DB_MAX_OVERFLOW
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(SQLALCHEMY_DATABASE_URI)
+    
     # JWT Configuration
     JWT_EXPIRATION_HOURS = 24  # Token hết hạn sau 24 giờ
     JWT_ALGORITHM = 'HS256'
     
     # CORS Configuration - Cho phép client từ origin khác
     # Bao gồm nhiều port phổ biến và null cho file:// protocol
-    CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000,http://localhost:5500,http://127.0.0.1:5500,http://localhost:8080,http://127.0.0.1:8080,null').split(',')
+    # Parse một lần: bỏ khoảng trắng, bỏ phần tử rỗng (vd. dấu phẩy cuối trong env var)
+    CORS_ORIGINS = tuple(
+        origin.strip()
+        for origin in os.environ.get('CORS_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000,http://localhost:5500,http://127.0.0.1:5500,http://localhost:8080,http://127.0.0.1:8080,null').split(',')
+        if origin.strip()
+    )
+    # Gộp thành một regex compile sẵn: flask-cors match một lần thay vì duyệt từng origin
+    CORS_ORIGINS_RE = re.compile(
+        '(?:%s)\\Z' % '|'.join(re.escape(origin) for origin in CORS_ORIGINS),
+        re.IGNORECASE
+    )
     
     # API Configuration
     API_TITLE = 'Library Management REST API'
@@ -52,12 +81,9 @@ class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
     
-    @property
-    def SECRET_KEY(self):
-        secret_key = os.environ.get('SECRET_KEY')
-        if not secret_key:
-            raise ValueError("SECRET_KEY must be set in production")
-        return secret_key
+    # Đọc một lần khi định nghĩa class - from_object lấy trực tiếp giá trị (property trên
+    # class chỉ trả về chính object property). Không fallback về dev key: thiếu thì là None
+    SECRET_KEY = os.environ.get('SECRET_KEY')
 
 
 class TestingConfig(Config):
@@ -0,0 +1,17 @@
+"""
+Khởi tạo / nâng cấp database một lần
+
+Tạo các bảng còn thiếu và đưa index của bảng đã có về đúng khai báo trong models
+(create_all() không thêm/xóa index trên bảng đã tồn tại):
+    python init_db.py
+"""
+from app import create_app
+from models import db, upgrade_indexes
+
+
+if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        upgrade_indexes(db.engine)
+    print(f"Database initialized: {app.config['SQLALCHEMY_DATABASE_URI']}")
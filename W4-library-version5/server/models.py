@@ -2,12 +2,25 @@
 Database Models
 Định nghĩa cấu trúc dữ liệu cho REST API
 """
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
 from datetime import datetime
 
 db = SQLAlchemy()
 
 
+@event.listens_for(Engine, 'connect')
+def _set_sqlite_pragma(dbapi_connection, connection_record):
+    """Bật WAL cho SQLite để các request đọc không bị chặn bởi request ghi"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+
 class Book(db.Model):
     """
     Model cho sách
@@ -56,14 +69,20 @@ class BorrowRecord(db.Model):
     Resource representation theo REST principles
     """
     __tablename__ = 'borrow_records'
+    __table_args__ = (
+        # Kiểm tra sách đang mượn khi xóa sách (book_id + status)
+        db.Index('ix_br_book_status', 'book_id', 'status'),
+        # Filter theo status + sắp xếp theo borrow_date khi list bản ghi
+        db.Index('ix_br_status_borrow_date', 'status', 'borrow_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False, index=True)
-    borrower_name = db.Column(db.String(100), nullable=False, index=True)
-    borrower_email = db.Column(db.String(100), nullable=False, index=True)
-    borrow_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
+    borrower_name = db.Column(db.String(100), nullable=False)
+    borrower_email = db.Column(db.String(100), nullable=False)
+    borrow_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Sort mặc định khi không filter
     return_date = db.Column(db.DateTime, nullable=True)
-    status = db.Column(db.String(20), default='borrowed', index=True)  # 'borrowed' hoặc 'returned'
+    status = db.Column(db.String(20), default='borrowed')  # 'borrowed' hoặc 'returned'
     
     def to_dict(self, include_book=True):
         """
@@ -92,3 +111,27 @@ class BorrowRecord(db.Model):
     
     def __repr__(self):
         return f'<BorrowRecord {self.borrower_name} - {self.book.title if self.book else "Unknown"}>'
+
+
+# Index một cột (index=True) của bản cũ, đã được thay bằng index ghép trong BorrowRecord.__table_args__
+OBSOLETE_INDEXES = (
+    'ix_borrow_records_book_id',
+    'ix_borrow_records_borrower_name',
+    'ix_borrow_records_borrower_email',
+    'ix_borrow_records_status',
+)
+
+
+def upgrade_indexes(engine):
+    """
+    Đưa index của database đã có về đúng khai báo trong models
+    
+    create_all() chỉ tạo index khi tạo bảng mới: không thêm index mới vào bảng
+    đã tồn tại, cũng không xóa index cũ. Chạy nhiều lần vẫn an toàn
+    """
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        for name in OBSOLETE_INDEXES:
+            conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
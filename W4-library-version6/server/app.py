@@ -10,7 +10,7 @@ Triển khai kiến trúc Client-Server theo nguyên tắc REST
 """
 from flask import Flask, jsonify
 from flask_cors import CORS
-from models import db
+from models import db, init_data_version
 from api_routes import api
 from config import Config
 import os
@@ -45,6 +45,7 @@ def create_app(config_class=Config):
     # Create tables
     with app.app_context():
         db.create_all()
+        init_data_version()
     
     # Root endpoint
     @app.route('/')
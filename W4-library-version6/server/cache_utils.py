@@ -7,11 +7,21 @@ Nguyên tắc Cacheable:
 - Sử dụng HTTP cache headers: Cache-Control, ETag, Last-Modified
 - Hỗ trợ conditional requests để tối ưu bandwidth
 """
-import hashlib
-import json
+import orjson
+import threading
+import xxhash
+from cachetools import TTLCache
 from flask import request, make_response
-from functools import wraps
-from datetime import datetime, timedelta
+from functools import wraps, lru_cache
+from email.utils import formatdate
+from time import time
+from models import get_data_version
+
+
+# ETag đã tính gần nhất của từng GET request (theo endpoint), dùng để trả 304 không cần chạy view.
+# Key gồm version dữ liệu trong database (models.DataVersion) - mutation ở bất kỳ worker nào
+# tăng version nên entry cũ không còn được tra tới, không cần xóa cache ở từng process
+_etag_lock = threading.Lock()
 
 
 def generate_etag(data):
@@ -22,18 +32,34 @@ def generate_etag(data):
     Client có thể gửi If-None-Match header với ETag để kiểm tra xem
     resource có thay đổi không.
     
+    ETag chỉ cần phân biệt các version, không cần chống giả mạo, nên dùng
+    xxh3 (non-crypto, nhanh hơn MD5 nhiều) thay cho hash mật mã
+    
     Args:
-        data: Dict hoặc list để tạo ETag
+        data: Bytes đã serialize, hoặc dict/list để tạo ETag
     
     Returns:
-        str: ETag value (MD5 hash của data)
+        str: ETag value (xxh3 64-bit hash của data)
     """
-    if isinstance(data, (dict, list)):
-        content = json.dumps(data, sort_keys=True)
+    if isinstance(data, bytes):
+        content = data
+    elif isinstance(data, (dict, list)):
+        content = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
     else:
-        content = str(data)
+        content = str(data).encode('utf-8')
+    
+    return xxhash.xxh3_64_hexdigest(content)
+
+
+@lru_cache(maxsize=64)
+def http_date(timestamp):
+    """
+    HTTP-date (vd: 'Tue, 15 Nov 1994 08:12:31 GMT') của một giây (timestamp nguyên)
     
-    return hashlib.md5(content.encode('utf-8')).hexdigest()
+    formatdate không đi qua locale như strftime; các response trong cùng một giây
+    dùng chung kết quả đã cache
+    """
+    return formatdate(timestamp, usegmt=True)
 
 
 def add_cache_headers(response, cache_type='public', max_age=300):
@@ -66,8 +92,7 @@ def add_cache_headers(response, cache_type='public', max_age=300):
         response.headers['Cache-Control'] = f'{cache_type}, max-age={max_age}'
         
         # Thêm Expires header cho backward compatibility
-        expires = datetime.utcnow() + timedelta(seconds=max_age)
-        response.headers['Expires'] = expires.strftime('%a, %d %b %Y %H:%M:%S GMT')
+        response.headers['Expires'] = http_date(int(time()) + max_age)
     
     return response
 
@@ -81,6 +106,8 @@ def cacheable(cache_type='public', max_age=300, etag_enabled=True):
     - Tự động tạo và kiểm tra ETag
     - Xử lý conditional requests (304 Not Modified)
     - Thêm Last-Modified header
+    - Nhớ ETag của mỗi request (version dữ liệu + path + query + Authorization) trong max_age
+      giây, If-None-Match khớp thì trả 304 sau một lần đọc version, trước khi chạy view
     
     Args:
         cache_type: Loại cache ('public', 'private', 'no-cache', 'no-store')
@@ -99,8 +126,29 @@ def cacheable(cache_type='public', max_age=300, etag_enabled=True):
     - Server và client cùng tối ưu hiệu năng
     """
     def decorator(f):
+        etag_cache = None
+        if etag_enabled and max_age > 0:
+            etag_cache = TTLCache(maxsize=2048, ttl=max_age)
+        
         @wraps(f)
         def decorated_function(*args, **kwargs):
+            # ETag đã biết của request này khớp If-None-Match thì trả 304 luôn (không query, không serialize)
+            cache_key = None
+            if etag_cache is not None and request.method == 'GET':
+                # Version đọc trước khi view đọc dữ liệu: ETag lưu dưới version này không thể cũ hơn nó
+                cache_key = (
+                    get_data_version(), request.path, request.query_string,
+                    request.headers.get('Authorization', '')
+                )
+                if_none_match = request.headers.get('If-None-Match')
+                if if_none_match:
+                    with _etag_lock:
+                        known_etag = etag_cache.get(cache_key)
+                    if known_etag and if_none_match.strip('"') == known_etag:
+                        response = make_response('', 304)
+                        response.headers['ETag'] = f'"{known_etag}"'
+                        return add_cache_headers(response, cache_type, max_age)
+            
             # Gọi function gốc
             result = f(*args, **kwargs)
             
@@ -117,30 +165,29 @@ def cacheable(cache_type='public', max_age=300, etag_enabled=True):
                 return add_cache_headers(response, 'no-store', 0)
             
             # Thêm Last-Modified header
-            response.headers['Last-Modified'] = datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
+            response.headers['Last-Modified'] = http_date(int(time()))
             
             # ETag support
-            if etag_enabled:
-                try:
-                    # Lấy response data để tạo ETag
-                    response_json = response.get_json()
-                    if response_json:
-                        etag = generate_etag(response_json)
-                        response.headers['ETag'] = f'"{etag}"'
-                        
-                        # Kiểm tra If-None-Match header (conditional request)
-                        if_none_match = request.headers.get('If-None-Match')
-                        if if_none_match:
-                            # Remove quotes nếu có
-                            client_etag = if_none_match.strip('"')
-                            if client_etag == etag:
-                                # Resource không thay đổi - trả 304 Not Modified
-                                response = make_response('', 304)
-                                response.headers['ETag'] = f'"{etag}"'
-                                return add_cache_headers(response, cache_type, max_age)
-                except:
-                    # Nếu không parse được JSON, bỏ qua ETag
-                    pass
+            if etag_enabled and response.is_json and not response.is_streamed:
+                # Hash thẳng bytes đã serialize thay vì parse lại JSON rồi serialize lần nữa
+                body = response.get_data()
+                if body:
+                    etag = generate_etag(body)
+                    response.headers['ETag'] = f'"{etag}"'
+                    if cache_key is not None:
+                        with _etag_lock:
+                            etag_cache[cache_key] = etag
+                    
+                    # Kiểm tra If-None-Match header (conditional request)
+                    if_none_match = request.headers.get('If-None-Match')
+                    if if_none_match:
+                        # Remove quotes nếu có
+                        client_etag = if_none_match.strip('"')
+                        if client_etag == etag:
+                            # Resource không thay đổi - trả 304 Not Modified
+                            response = make_response('', 304)
+                            response.headers['ETag'] = f'"{etag}"'
+                            return add_cache_headers(response, cache_type, max_age)
             
             # Thêm cache headers
             return add_cache_headers(response, cache_type, max_age)
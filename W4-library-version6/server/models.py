@@ -3,6 +3,9 @@ Database Models
 Định nghĩa cấu trúc dữ liệu cho REST API
 """
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 from datetime import datetime
 
 db = SQLAlchemy()
@@ -140,3 +143,44 @@ class BorrowRecord(db.Model):
     
     def __repr__(self):
         return f'<BorrowRecord {self.borrower_name} - {self.book.title if self.book else "Unknown"}>'
+
+
+class DataVersion(db.Model):
+    """
+    Version dữ liệu dùng chung giữa các worker (một dòng, id = 1)
+    
+    Tăng trong cùng transaction với mọi thay đổi books/borrow_records (xem _bump_data_version),
+    nên version đọc được luôn khớp với dữ liệu đã commit - dùng làm key cho ETag đã nhớ
+    """
+    __tablename__ = 'data_version'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+def init_data_version():
+    """Tạo dòng version nếu chưa có (gọi sau db.create_all())"""
+    if db.session.get(DataVersion, 1) is None:
+        db.session.add(DataVersion(id=1, version=0))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Worker khác khởi động cùng lúc đã tạo dòng này
+            db.session.rollback()
+
+
+def get_data_version():
+    """Version dữ liệu hiện tại (một lần đọc theo primary key)"""
+    return db.session.execute(
+        db.select(DataVersion.version).where(DataVersion.id == 1)
+    ).scalar() or 0
+
+
+@event.listens_for(Session, 'before_flush')
+def _bump_data_version(session, flush_context, instances):
+    """Flush có thêm/sửa/xóa Book hoặc BorrowRecord thì tăng version trong cùng transaction"""
+    changed = (session.new, session.dirty, session.deleted)
+    if any(isinstance(obj, (Book, BorrowRecord)) for objs in changed for obj in objs):
+        session.execute(
+            db.update(DataVersion).where(DataVersion.id == 1).values(version=DataVersion.version + 1)
+        )
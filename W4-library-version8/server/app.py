@@ -8,13 +8,60 @@ Triển khai kiến trúc Client-Server với Session Authentication
 - Tách biệt hoàn toàn Server và Client
 - CORS enabled với credentials support
 """
-from flask import Flask, jsonify, session
+from flask import Flask, Response, session
 from flask_cors import CORS
 from flask_session import Session
 from models import db
 from api_routes import api
 from config import Config
+from json_provider import OrjsonProvider
+import orjson
 import os
+import re
+
+
+# Body lỗi cố định, serialize sẵn một lần (mỗi request chỉ tạo Response từ bytes)
+NOT_FOUND_BODY = orjson.dumps({
+    'error': 'Not Found',
+    'message': 'The requested resource was not found'
+})
+METHOD_NOT_ALLOWED_BODY = orjson.dumps({
+    'error': 'Method Not Allowed',
+    'message': 'The method is not allowed for the requested URL'
+})
+INTERNAL_ERROR_BODY = orjson.dumps({
+    'error': 'Internal Server Error',
+    'message': 'An unexpected error occurred'
+})
+
+
+# Cấu hình CORS dựng một lần cho mọi lần gọi create_app
+# Các origin gộp thành một regex compile sẵn (khớp nguyên chuỗi, không phân biệt hoa thường)
+CORS_ORIGINS = (
+    "http://localhost:3000", "http://127.0.0.1:3000",
+    "http://localhost:5500", "http://127.0.0.1:5500",
+    "http://localhost:8080", "http://127.0.0.1:8080"
+)
+CORS_RESOURCES = {
+    r"/api/*": {
+        "origins": re.compile(
+            '(?:%s)\\Z' % '|'.join(re.escape(origin) for origin in CORS_ORIGINS),
+            re.IGNORECASE
+        ),
+        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+        "allow_headers": ["Content-Type", "Authorization"],
+        "supports_credentials": True  # Quan trọng: Cho phép gửi cookies
+    }
+}
+
+
+def json_blob(blob, status):
+    """
+    Trả response JSON từ bytes đã dựng sẵn
+    
+    Tạo Response mới mỗi lần vì after_request (CORS) còn thêm header vào response
+    """
+    return Response(blob, status=status, mimetype='application/json')
 
 
 def create_app(config_class=Config):
@@ -27,21 +74,17 @@ def create_app(config_class=Config):
     # Load configuration
     app.config.from_object(config_class)
     
+    # Dùng orjson cho jsonify (nhanh hơn, serialize datetime trực tiếp)
+    app.json = OrjsonProvider(app)
+    
     # Enable CORS - Quan trọng cho kiến trúc Client-Server
     # Cho phép client từ domain khác gọi API với credentials (cookies)
-    CORS(app, resources={
-        r"/api/*": {
-            "origins": ["http://localhost:3000", "http://127.0.0.1:3000", 
-                       "http://localhost:5500", "http://127.0.0.1:5500",
-                       "http://localhost:8080", "http://127.0.0.1:8080"],
-            "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
-            "supports_credentials": True  # Quan trọng: Cho phép gửi cookies
-        }
-    })
+    CORS(app, resources=CORS_RESOURCES)
     
     # Initialize server-side session
-    Session(app)
+    # Không có Redis thì giữ SecureCookieSessionInterface mặc định của Flask
+    if app.config.get('SESSION_TYPE'):
+        Session(app)
     
     # Initialize database
     db.init_app(app)
@@ -49,9 +92,30 @@ def create_app(config_class=Config):
     # Register API blueprint
     app.register_blueprint(api, url_prefix=config_class.API_PREFIX)
     
-    # Create tables
-    with app.app_context():
-        db.create_all()
+    # Create tables (tắt được bằng INIT_DB, worker không phải kiểm tra schema mỗi lần khởi động)
+    if app.config.get('INIT_DB', True):
+        with app.app_context():
+            db.create_all()
+    
+    # Body của root endpoint không đổi theo request - serialize một lần khi tạo app
+    index_body = orjson.dumps({
+        'success': True,
+        'service': config_class.API_TITLE,
+        'version': config_class.API_VERSION,
+        'description': 'REST API Server cho hệ thống quản lý thư viện',
+        'architecture': 'Stateless Client-Server REST API',
+        'endpoints': {
+            'auth': f'{config_class.API_PREFIX}/auth/login',
+            'books': f'{config_class.API_PREFIX}/books',
+            'borrow_records': f'{config_class.API_PREFIX}/borrow-records',
+            'statistics': f'{config_class.API_PREFIX}/statistics',
+            'health': f'{config_class.API_PREFIX}/health'
+        },
+        'documentation': {
+            'openapi': '/openapi.yaml',
+            'note': 'Mọi request cần authentication phải gửi kèm: Authorization: Bearer <token>'
+        }
+    })
     
     # Root endpoint
     @app.route('/')
@@ -61,50 +125,24 @@ def create_app(config_class=Config):
         
         REST Principle: Self-descriptive messages
         """
-        return jsonify({
-            'success': True,
-            'service': config_class.API_TITLE,
-            'version': config_class.API_VERSION,
-            'description': 'REST API Server cho hệ thống quản lý thư viện',
-            'architecture': 'Stateless Client-Server REST API',
-            'endpoints': {
-                'auth': f'{config_class.API_PREFIX}/auth/login',
-                'books': f'{config_class.API_PREFIX}/books',
-                'borrow_records': f'{config_class.API_PREFIX}/borrow-records',
-                'statistics': f'{config_class.API_PREFIX}/statistics',
-                'health': f'{config_class.API_PREFIX}/health'
-            },
-            'documentation': {
-                'openapi': '/openapi.yaml',
-                'note': 'Mọi request cần authentication phải gửi kèm: Authorization: Bearer <token>'
-            }
-        }), 200
+        return json_blob(index_body, 200)
     
     # Error handlers
     @app.errorhandler(404)
     def not_found(error):
         """Handle 404 errors"""
-        return jsonify({
-            'error': 'Not Found',
-            'message': 'The requested resource was not found'
-        }), 404
+        return json_blob(NOT_FOUND_BODY, 404)
     
     @app.errorhandler(405)
     def method_not_allowed(error):
         """Handle 405 errors"""
-        return jsonify({
-            'error': 'Method Not Allowed',
-            'message': 'The method is not allowed for the requested URL'
-        }), 405
+        return json_blob(METHOD_NOT_ALLOWED_BODY, 405)
     
     @app.errorhandler(500)
     def internal_error(error):
         """Handle 500 errors"""
         db.session.rollback()
-        return jsonify({
-            'error': 'Internal Server Error',
-            'message': 'An unexpected error occurred'
-        }), 500
+        return json_blob(INTERNAL_ERROR_BODY, 500)
     
     return app
 
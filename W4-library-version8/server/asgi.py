@@ -0,0 +1,12 @@
+"""
+ASGI entrypoint
+Chạy ứng dụng Flask dưới ASGI server (uvicorn) qua adapter của asgiref
+
+Sử dụng:
+    uvicorn asgi:asgi_app --host 0.0.0.0 --port 5000 --workers 4
+"""
+from asgiref.wsgi import WsgiToAsgi
+from app import create_app
+
+app = create_app()
+asgi_app = WsgiToAsgi(app)
@@ -5,8 +5,32 @@ Triển khai Session Authentication với Flask session
 import jwt
 from datetime import datetime, timedelta
 from functools import wraps
-from flask import request, jsonify, session
+from flask import Response, session, g
 from config import Config
+import orjson
+
+
+_NOT_LOADED = object()
+
+# Body 401 cố định - serialize một lần, mỗi request chỉ tạo Response từ bytes
+AUTH_REQUIRED_BODY = orjson.dumps({
+    'error': 'Authentication required',
+    'message': 'Please login to access this resource'
+})
+
+
+def _session_user():
+    """
+    Username trong session của request hiện tại (None nếu chưa đăng nhập)
+    
+    Đọc session một lần rồi giữ trên flask.g: các decorator khác trong cùng request
+    dùng lại, không tra session lần nữa
+    """
+    user = getattr(g, '_session_user', _NOT_LOADED)
+    if user is _NOT_LOADED:
+        user = session.get('username')
+        g._session_user = user
+    return user
 
 
 def generate_token(username, expires_in=None):
@@ -89,13 +113,9 @@ def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
         # Kiểm tra session có username không
-        if 'username' not in session:
-            return jsonify({
-                'error': 'Authentication required',
-                'message': 'Please login to access this resource'
-            }), 401
-        
-        current_user = session.get('username')
+        current_user = _session_user()
+        if current_user is None:
+            return Response(AUTH_REQUIRED_BODY, status=401, mimetype='application/json')
         
         return f(current_user, *args, **kwargs)
     
@@ -122,7 +142,7 @@ def optional_token(f):
     """
     @wraps(f)
     def decorated(*args, **kwargs):
-        current_user = session.get('username', None)
+        current_user = _session_user()
         
         return f(current_user, *args, **kwargs)
     
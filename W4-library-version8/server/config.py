@@ -5,6 +5,28 @@ Quản lý cấu hình theo nguyên tắc Stateless
 import os
 from datetime import timedelta
 
+try:
+    import redis
+except ImportError:  # Redis là tùy chọn - không có thì dùng session cookie có chữ ký của Flask
+    redis = None
+
+
+def _session_redis(redis_url):
+    """
+    Redis client cho Flask-Session, None nếu không cấu hình REDIS_URL
+    
+    Connection pool tạo một lần lúc import, các request (và các worker thread)
+    dùng chung, tối đa 32 kết nối - hết chỗ thì chờ thay vì mở thêm
+    """
+    if not redis_url or redis is None:
+        return None
+    pool = redis.BlockingConnectionPool.from_url(
+        redis_url,
+        max_connections=32,
+        socket_keepalive=True
+    )
+    return redis.Redis(connection_pool=pool)
+
 
 class Config:
     """
@@ -24,9 +46,17 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
     # Session Configuration
-    SESSION_TYPE = 'filesystem'
+    # Có REDIS_URL: session lưu trong Redis qua Flask-Session (các worker dùng chung)
+    # Bỏ trống: session cookie có chữ ký mặc định của Flask - không đọc/ghi file mỗi request
+    REDIS_URL = os.environ.get('REDIS_URL')
+    SESSION_REDIS = _session_redis(REDIS_URL)
+    SESSION_TYPE = 'redis' if SESSION_REDIS is not None else None
+    SESSION_USE_SIGNER = True  # Ký session id trong cookie bằng SECRET_KEY
     SESSION_PERMANENT = True
     PERMANENT_SESSION_LIFETIME = timedelta(hours=24)  # Session hết hạn sau 24 giờ
+    # Không gửi lại Set-Cookie ở mọi request: response public (GET /books...) không kèm
+    # cookie nên cache dùng chung được. Session hết hạn 24 giờ sau khi đăng nhập
+    SESSION_REFRESH_EACH_REQUEST = False
     SESSION_COOKIE_HTTPONLY = True
     SESSION_COOKIE_SAMESITE = 'Lax'
     SESSION_COOKIE_SECURE = False  # Set True in production with HTTPS
@@ -39,6 +69,9 @@ class Config:
     # Bao gồm nhiều port phổ biến và null cho file:// protocol
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000,http://localhost:5500,http://127.0.0.1:5500,http://localhost:8080,http://127.0.0.1:8080,null').split(',')
     
+    # Tạo bảng (db.create_all) khi tạo app - production đặt INIT_DB=0 và chạy init_db.py một lần
+    INIT_DB = os.environ.get('INIT_DB', '1') == '1'
+    
     # API Configuration
     API_TITLE = 'Library Management REST API'
     API_VERSION = '3.0.0'
@@ -60,12 +93,9 @@ class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
     
-    @property
-    def SECRET_KEY(self):
-        secret_key = os.environ.get('SECRET_KEY')
-        if not secret_key:
-            raise ValueError("SECRET_KEY must be set in production")
-        return secret_key
+    # Đọc một lần khi định nghĩa class - from_object lấy trực tiếp giá trị (property trên
+    # class chỉ trả về chính object property). Không fallback về dev key: thiếu thì là None
+    SECRET_KEY = os.environ.get('SECRET_KEY')
 
 
 class TestingConfig(Config):
@@ -89,8 +89,8 @@ class Book(db.Model):
             'isbn': self.isbn,
             'quantity': self.quantity,
             'available': self.available,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
         }
     
     def __repr__(self):
@@ -127,8 +127,8 @@ class BorrowRecord(db.Model):
             'book_id': self.book_id,
             'borrower_name': self.borrower_name,
             'borrower_email': self.borrower_email,
-            'borrow_date': self.borrow_date.isoformat(),
-            'return_date': self.return_date.isoformat() if self.return_date else None,
+            'borrow_date': self.borrow_date,
+            'return_date': self.return_date,
             'status': self.status
         }
         
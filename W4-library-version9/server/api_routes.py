@@ -2,15 +2,141 @@
 REST API Routes
 Triển khai đầy đủ REST API theo nguyên tắc Stateless và Cacheable
 """
-from flask import Blueprint, request, jsonify, make_response
-from models import db, Book, BorrowRecord, get_pagination_params, format_pagination_response
-from auth import token_required, optional_token, generate_token
-from cache_utils import cacheable, vary_on, invalidate_cache_headers
+from flask import Blueprint, Response, current_app, request, jsonify, make_response
+from models import (
+    db, Book, BorrowRecord, get_pagination_params, format_pagination_response,
+    format_page_response, format_cursor_response, encode_cursor, decode_cursor,
+    keyset_condition, book_contains, borrow_book_statement
+)
+from auth import token_required, optional_token, generate_token, forget_token
+from cache_utils import (
+    cacheable, vary_on, invalidate_cache_headers, body_etag, signature_etag, LocalTTLCache
+)
+from json_provider import ORJSON_OPTION
+from health import HEALTH_BODY, HEALTH_MAX_AGE
+from schemas import LoginBody, BookCreate, BookUpdate, BorrowBulk, parse_body
+from collections import Counter
 from datetime import datetime
-from sqlalchemy import or_
+from sqlalchemy import func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+import orjson
+import time
 
 api = Blueprint('api', __name__)
 
+# Headers no-store cho mutation/auth response là hằng số - tạo dict một lần
+NO_CACHE_HEADERS = invalidate_cache_headers()
+
+# Giá trị hợp lệ của query parameter GET /borrow-records - frozenset để kiểm tra O(1)
+BORROW_STATUSES = frozenset(('borrowed', 'returned'))
+BORROW_SORT_FIELDS = frozenset(('borrow_date', 'return_date', 'borrower_name', 'borrower_email', 'status'))
+
+
+def not_modified(etag):
+    """Response 304 với ETag (weak) - @cacheable gắn thêm cache headers"""
+    response = make_response('', 304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+# Cache body JSON của GET /books/<id> trong process: book_id -> (hết hạn lúc, bytes)
+# Xóa khi sách thay đổi (sửa, xóa, mượn, trả). TTL bằng max-age của endpoint vì
+# các worker process khác không nhận được lệnh xóa - lệch tối đa bằng thời gian
+# client/proxy vốn đã được phép cache response
+BOOK_BODY_CACHE_SIZE = 1024
+BOOK_BODY_CACHE_TTL = 120
+_book_bodies = LocalTTLCache(BOOK_BODY_CACHE_SIZE, BOOK_BODY_CACHE_TTL)
+
+
+def get_cached_book_body(book_id):
+    """Body JSON đã serialize của sách, None nếu chưa có hoặc đã hết hạn"""
+    return _book_bodies.get(book_id)
+
+
+def cache_book_body(book_id, body):
+    """Lưu body JSON của sách, bỏ entry ít dùng nhất khi vượt BOOK_BODY_CACHE_SIZE"""
+    _book_bodies.set(book_id, body)
+
+
+def invalidate_book_body(book_id):
+    """Xóa body đã cache của sách (gọi sau khi commit thay đổi)"""
+    _book_bodies.pop(book_id)
+
+
+# L1 cache trong process cho GET /borrow-records/<id>: record_id -> (etag, body JSON đã serialize).
+# Hit thì không chạm tới SQLAlchemy và không serialize lại. TTL ngắn hơn max-age (60s)
+# của endpoint; xóa khi trả sách. Đổi tên/tác giả sách thì body cũ còn tối đa TTL giây
+RECORD_CACHE_SIZE = 2048
+RECORD_CACHE_TTL = 15
+_record_bodies = LocalTTLCache(RECORD_CACHE_SIZE, RECORD_CACHE_TTL)
+
+
+# Cache-aside body JSON của GET /statistics trong Redis (Config.CACHE_REDIS), dùng chung
+# giữa các worker. Mỗi lần sách hoặc lượt mượn thay đổi thì INCR version; body lưu theo
+# key có version (v1:lib:stats:v<n>) và ETag cũng lấy từ version - client gửi ETag khớp
+# nhận 304 chỉ sau một lệnh GET version, không đụng database. Key cũ tự hết hạn theo TTL.
+# Khi miss, chỉ request giữ lock (SET NX) tính lại - các request khác chờ kết quả
+# thay vì cùng lúc chạy aggregate trên database (cache stampede)
+STATS_CACHE_KEY = 'v1:lib:stats'
+STATS_VERSION_KEY = STATS_CACHE_KEY + ':ver'
+STATS_CACHE_TTL = 300
+STATS_LOCK_TTL = 5
+STATS_LOCK_WAIT = 0.05
+STATS_LOCK_RETRIES = 10
+
+# L1 trước Redis/database: (etag, body) statistics giữ trong process ngắn hơn max-age (30s)
+STATS_L1_TTL = 15
+_stats_bodies = LocalTTLCache(1, STATS_L1_TTL)
+
+
+# Danh sách GET /borrow-records trong Redis theo cùng cách: key gồm version của bảng
+# borrow_records và hash của query string (v1:lib:borrow:v<n>:<hash>). Mượn/trả sách,
+# sửa/xóa sách chỉ INCR version một lần - mọi trang, mọi bộ lọc đã cache cùng hết hiệu lực
+# mà không phải quét key; key của version cũ tự hết hạn theo TTL
+BORROW_LIST_CACHE_KEY = 'v1:lib:borrow'
+BORROW_VERSION_KEY = BORROW_LIST_CACHE_KEY + ':ver'
+BORROW_LIST_CACHE_TTL = 60
+
+
+def get_shared_cache():
+    """Redis client dùng chung giữa các worker, None nếu không cấu hình REDIS_URL"""
+    return current_app.config.get('CACHE_REDIS')
+
+
+def invalidate_statistics():
+    """Xóa statistics đã cache (gọi sau khi commit thay đổi)"""
+    _stats_bodies.pop(STATS_CACHE_KEY)
+    bump_cache_version(STATS_VERSION_KEY)
+
+
+def invalidate_borrow_records():
+    """Xóa mọi danh sách borrow records đã cache (gọi sau khi commit thay đổi)"""
+    bump_cache_version(BORROW_VERSION_KEY)
+
+
+def bump_cache_version(version_key):
+    """INCR version trong Redis - các key cache theo version cũ không còn được đọc"""
+    cache = get_shared_cache()
+    if cache is None:
+        return
+    try:
+        cache.incr(version_key)
+    except Exception as e:
+        # Redis lỗi không làm hỏng request ghi đã commit - entry tự hết hạn theo TTL
+        current_app.logger.warning(f'Could not invalidate cache {version_key}: {e}')
+
+
+def get_cache_version(cache, version_key):
+    """Version hiện tại trong Redis, None nếu không có Redis hoặc Redis lỗi"""
+    if cache is None:
+        return None
+    try:
+        return int(cache.get(version_key) or 0)
+    except Exception as e:
+        current_app.logger.warning(f'Cache unavailable ({version_key}): {e}')
+        return None
+
 
 # ============================================================
 # AUTHENTICATION ENDPOINTS
@@ -32,16 +158,16 @@ def login():
     - Secure: Cookie chỉ gửi qua HTTPS (production)
     - SameSite: Phòng chống CSRF attacks
     """
-    data = request.get_json()
+    body, error = parse_body(LoginBody, request.get_data())
     
-    if not data or not data.get('username') or not data.get('password'):
+    if error:
         return jsonify({
             'error': 'Bad Request',
-            'message': 'Username and password are required'
+            'message': error
         }), 400
     
-    username = data.get('username')
-    password = data.get('password')
+    username = body.username
+    password = body.password
     
     # Demo: Chấp nhận bất kỳ username/password nào
     # Trong production, cần verify với database
@@ -71,8 +197,7 @@ def login():
     )
     
     # Explicitly mark as non-cacheable
-    for key, value in invalidate_cache_headers().items():
-        response.headers[key] = value
+    response.headers.update(NO_CACHE_HEADERS)
     
     return response
 
@@ -91,6 +216,11 @@ def logout():
         'message': 'Logout successful'
     }), 200)
     
+    # Bỏ token của client khỏi cache verify
+    token = request.cookies.get('jwt_token')
+    if token:
+        forget_token(token)
+    
     # Xóa cookie bằng cách set max_age=0
     response.set_cookie(
         'jwt_token',
@@ -102,8 +232,7 @@ def logout():
     )
     
     # Explicitly mark as non-cacheable
-    for key, value in invalidate_cache_headers().items():
-        response.headers[key] = value
+    response.headers.update(NO_CACHE_HEADERS)
     
     return response
 
@@ -151,6 +280,8 @@ def get_books():
     - isbn: Filter theo ISBN (exact match)
     - sort_by: Sắp xếp theo trường (title, author, created_at) (default: created_at)
     - sort_order: Thứ tự sắp xếp (asc, desc) (default: desc)
+    - after: Cursor trang tiếp theo (pagination.next_cursor) - nên dùng thay cho page,
+      đọc tiếp theo index và không đếm tổng (response không có total/pages)
     
     REST Principles:
     - Stateless: Tất cả filtering qua query params
@@ -160,6 +291,7 @@ def get_books():
     """
     # Pagination parameters
     page, per_page = get_pagination_params(request, default_per_page=10, max_per_page=100)
+    after = request.args.get('after', type=str)
     
     # Filtering parameters
     author = request.args.get('author', type=str)
@@ -173,12 +305,13 @@ def get_books():
     
     # Build query
     query = Book.query
+    use_fts = current_app.config.get('BOOK_SEARCH_FTS', False)
     
     if author:
-        query = query.filter(Book.author.ilike(f'%{author}%'))
+        query = query.filter(book_contains('author', author, use_fts))
     
     if title:
-        query = query.filter(Book.title.ilike(f'%{title}%'))
+        query = query.filter(book_contains('title', title, use_fts))
     
     if isbn:
         query = query.filter(Book.isbn == isbn)
@@ -186,24 +319,56 @@ def get_books():
     if available_only:
         query = query.filter(Book.available > 0)
     
-    # Apply sorting
+    # Apply sorting (id làm tiebreak để thứ tự ổn định giữa các trang)
     valid_sort_fields = ['title', 'author', 'created_at', 'isbn']
     if sort_by in valid_sort_fields:
-        sort_column = getattr(Book, sort_by)
-        if sort_order.lower() == 'asc':
-            query = query.order_by(sort_column.asc())
-        else:
-            query = query.order_by(sort_column.desc())
+        descending = sort_order.lower() != 'asc'
     else:
-        query = query.order_by(Book.created_at.desc())
-    
-    # Execute with pagination
-    pagination = query.paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    
-    # Format response using helper function
-    response_data = format_pagination_response(pagination, items_key='books')
+        sort_by, descending = 'created_at', True
+    sort_column = getattr(Book, sort_by)
+    if descending:
+        query = query.order_by(sort_column.desc(), Book.id.desc())
+    else:
+        query = query.order_by(sort_column.asc(), Book.id.asc())
+    
+    if after:
+        # Keyset pagination: không OFFSET, không COUNT(*)
+        try:
+            sort_value, last_id = decode_cursor(after)
+            if sort_by == 'created_at':
+                sort_value = datetime.fromisoformat(sort_value)
+        except (ValueError, TypeError):
+            return jsonify({
+                'error': 'Bad Request',
+                'message': 'Invalid pagination cursor'
+            }), 400
+        
+        # Lấy dư 1 dòng để biết còn trang sau mà không cần query thêm
+        books = query.filter(
+            keyset_condition(sort_column, Book.id, descending, sort_value, last_id)
+        ).limit(per_page + 1).all()
+        next_cursor = None
+        if len(books) > per_page:
+            books = books[:per_page]
+            next_cursor = encode_cursor(getattr(books[-1], sort_by), books[-1].id)
+        
+        response_data = format_cursor_response(
+            [book.to_dict() for book in books], per_page, next_cursor, items_key='books'
+        )
+    else:
+        # Execute with pagination
+        pagination = query.paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+        
+        # Cursor của trang sau để client chuyển sang ?after=
+        next_cursor = None
+        if pagination.has_next and pagination.items:
+            last = pagination.items[-1]
+            next_cursor = encode_cursor(getattr(last, sort_by), last.id)
+        
+        # Format response using helper function
+        response_data = format_pagination_response(pagination, items_key='books', next_cursor=next_cursor)
     
     return jsonify({
         'success': True,
@@ -223,18 +388,24 @@ def get_book(book_id):
     - Resource-based: URL định danh resource cụ thể
     - Cacheable: Public cache 120s, ETag enabled
     """
-    book = Book.query.get(book_id)
+    body = get_cached_book_body(book_id)
     
-    if not book:
-        return jsonify({
-            'error': 'Not Found',
-            'message': f'Book with id {book_id} not found'
-        }), 404
+    if body is None:
+        book = db.session.get(Book, book_id)
+        
+        if not book:
+            return jsonify({
+                'error': 'Not Found',
+                'message': f'Book with id {book_id} not found'
+            }), 404
+        
+        body = orjson.dumps({
+            'success': True,
+            'data': book.to_dict()
+        }, option=ORJSON_OPTION)
+        cache_book_body(book_id, body)
     
-    return jsonify({
-        'success': True,
-        'data': book.to_dict()
-    }), 200
+    return Response(body, status=200, mimetype='application/json')
 
 
 @api.route('/books', methods=['POST'])
@@ -258,57 +429,50 @@ def create_book(current_user):
     - Self-descriptive: Response code 201 Created
     - Cacheable: Không cache (mutation operation)
     """
-    data = request.get_json()
-    
-    # Validation
-    required_fields = ['title', 'author', 'isbn', 'quantity']
-    if not data or not all(field in data for field in required_fields):
-        return jsonify({
-            'error': 'Bad Request',
-            'message': f'Missing required fields: {", ".join(required_fields)}'
-        }), 400
-    
-    # Validate quantity
-    quantity = data.get('quantity', 1)
-    if not isinstance(quantity, int) or quantity < 1:
+    # Validation (field bắt buộc, kiểu dữ liệu, quantity >= 1) - xem schemas.BookCreate
+    body, error = parse_body(BookCreate, request.get_data())
+    if error:
         return jsonify({
             'error': 'Bad Request',
-            'message': 'Quantity must be a positive integer'
+            'message': error
         }), 400
     
-    # Check if ISBN already exists
-    existing_book = Book.query.filter_by(isbn=data['isbn']).first()
-    if existing_book:
-        return jsonify({
-            'error': 'Conflict',
-            'message': 'A book with this ISBN already exists'
-        }), 409
-    
-    # Create new book
-    new_book = Book(
-        title=data['title'],
-        author=data['author'],
-        isbn=data['isbn'],
-        quantity=quantity,
-        available=quantity
-    )
+    quantity = body.quantity
     
+    # ISBN trùng do unique constraint của database kiểm tra (IntegrityError -> 409):
+    # không tốn thêm một SELECT, và không có race giữa lúc kiểm tra và lúc insert
     try:
-        db.session.add(new_book)
+        # INSERT ... RETURNING: một round-trip, không qua unit-of-work và không phải
+        # SELECT lại object (bị expire sau commit) chỉ để lấy id / created_at
+        row = db.session.execute(
+            insert(Book).values(
+                title=body.title,
+                author=body.author,
+                isbn=body.isbn,
+                quantity=quantity,
+                available=quantity
+            ).returning(*Book.__table__.c)
+        ).one()
         db.session.commit()
+        invalidate_statistics()
         
         # Non-cacheable response
         response = make_response(jsonify({
             'success': True,
             'message': 'Book created successfully',
-            'data': new_book.to_dict()
+            'data': Book.to_dict(row)
         }), 201)
         
-        for key, value in invalidate_cache_headers().items():
-            response.headers[key] = value
+        response.headers.update(NO_CACHE_HEADERS)
         
         return response
         
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({
+            'error': 'Conflict',
+            'message': 'A book with this ISBN already exists'
+        }), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -329,7 +493,7 @@ def update_book(current_user, book_id):
     - Idempotent: Gọi nhiều lần với cùng data cho kết quả giống nhau
     - Cacheable: Không cache (mutation operation)
     """
-    book = Book.query.get(book_id)
+    book = db.session.get(Book, book_id)
     
     if not book:
         return jsonify({
@@ -337,43 +501,23 @@ def update_book(current_user, book_id):
             'message': f'Book with id {book_id} not found'
         }), 404
     
-    data = request.get_json()
+    # Validation kiểu dữ liệu - xem schemas.BookUpdate; chỉ lấy field client gửi lên
+    body, error = parse_body(BookUpdate, request.get_data())
+    data = body.model_dump(exclude_unset=True, exclude_none=True) if body else None
     
     if not data:
         return jsonify({
             'error': 'Bad Request',
-            'message': 'No data provided'
+            'message': error or BookUpdate.ERROR_MESSAGE
         }), 400
     
-    # Check ISBN uniqueness if being changed
-    if 'isbn' in data and data['isbn'] != book.isbn:
-        existing = Book.query.filter(Book.isbn == data['isbn'], Book.id != book_id).first()
-        if existing:
-            return jsonify({
-                'error': 'Conflict',
-                'message': 'ISBN already used by another book'
-            }), 409
-    
-    # Update fields
-    if 'title' in data:
-        book.title = data['title']
-    
-    if 'author' in data:
-        book.author = data['author']
-    
-    if 'isbn' in data:
-        book.isbn = data['isbn']
+    # Update fields - gom lại để chạy một câu UPDATE
+    # (ISBN trùng sách khác do unique constraint kiểm tra: IntegrityError -> 409)
+    changes = {field: data[field] for field in ('title', 'author', 'isbn') if field in data}
     
     # Update quantity - phải kiểm tra số sách đang được mượn
     if 'quantity' in data:
         new_quantity = data['quantity']
-        
-        if not isinstance(new_quantity, int) or new_quantity < 1:
-            return jsonify({
-                'error': 'Bad Request',
-                'message': 'Quantity must be a positive integer'
-            }), 400
-        
         borrowed_count = book.quantity - book.available
         new_available = new_quantity - borrowed_count
         
@@ -383,24 +527,39 @@ def update_book(current_user, book_id):
                 'message': f'Cannot reduce quantity. {borrowed_count} copies are currently borrowed'
             }), 400
         
-        book.quantity = new_quantity
-        book.available = new_available
+        changes['quantity'] = new_quantity
+        changes['available'] = new_available
     
     try:
+        if changes:
+            # UPDATE ... RETURNING: lấy luôn dòng mới (kể cả updated_at), không SELECT lại
+            row = db.session.execute(
+                update(Book).where(Book.id == book_id).values(**changes).returning(*Book.__table__.c)
+            ).one()
+        else:
+            row = book
         db.session.commit()
+        invalidate_book_body(book_id)
+        invalidate_statistics()
+        invalidate_borrow_records()
         
         # Non-cacheable response
         response = make_response(jsonify({
             'success': True,
             'message': 'Book updated successfully',
-            'data': book.to_dict()
+            'data': Book.to_dict(row)
         }), 200)
         
-        for key, value in invalidate_cache_headers().items():
-            response.headers[key] = value
+        response.headers.update(NO_CACHE_HEADERS)
         
         return response
         
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({
+            'error': 'Conflict',
+            'message': 'ISBN already used by another book'
+        }), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({
@@ -420,7 +579,7 @@ def delete_book(current_user, book_id):
     - Stateless: Chỉ cần ID và token
     - Idempotent: Có thể gọi nhiều lần (lần 2 trở đi trả 404)
     """
-    book = Book.query.get(book_id)
+    book = db.session.get(Book, book_id)
     
     if not book:
         return jsonify({
@@ -428,13 +587,12 @@ def delete_book(current_user, book_id):
             'message': f'Book with id {book_id} not found'
         }), 404
     
-    # Check if any copies are borrowed
-    borrowed_count = BorrowRecord.query.filter_by(
-        book_id=book_id, 
-        status='borrowed'
-    ).count()
+    # Check if any copies are borrowed - EXISTS dừng ở dòng khớp đầu tiên trên index (book_id, status),
+    # chỉ đếm khi thật sự có sách đang mượn (để báo số lượng trong message)
+    borrowed = BorrowRecord.query.filter_by(book_id=book_id, status='borrowed')
     
-    if borrowed_count > 0:
+    if db.session.query(borrowed.exists()).scalar():
+        borrowed_count = borrowed.count()
         return jsonify({
             'error': 'Conflict',
             'message': f'Cannot delete book. {borrowed_count} copies are currently borrowed'
@@ -443,6 +601,9 @@ def delete_book(current_user, book_id):
     try:
         db.session.delete(book)
         db.session.commit()
+        invalidate_book_body(book_id)
+        invalidate_statistics()
+        invalidate_borrow_records()
         
         return jsonify({
             'success': True,
@@ -479,62 +640,160 @@ def get_borrow_records(current_user):
     - book_id: Filter theo ID sách
     - sort_by: Sắp xếp theo trường (borrow_date, return_date, borrower_name) (default: borrow_date)
     - sort_order: Thứ tự sắp xếp (asc, desc) (default: desc)
+    - after: Cursor trang tiếp theo (pagination.next_cursor) - nên dùng thay cho page,
+      đọc tiếp theo index và không đếm tổng. Không hỗ trợ khi sort_by=return_date
     
     REST Principles:
     - Stateless: Filtering qua query parameters
     - Cacheable: Private cache 30s (shorter due to frequent changes)
     """
+    # Có Redis: ETag và key cache theo version của bảng - hit chỉ tốn hai lệnh GET,
+    # không đụng database. Ghi vào bảng thì version tăng nên không cần xóa từng key
+    cache = get_shared_cache()
+    version = get_cache_version(cache, BORROW_VERSION_KEY)
+    if version is not None:
+        etag = signature_etag(BORROW_LIST_CACHE_KEY, version, request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        
+        cache_key = f'{BORROW_LIST_CACHE_KEY}:v{version}:{signature_etag(request.query_string)}'
+        try:
+            body = cache.get(cache_key)
+        except Exception as e:
+            current_app.logger.warning(f'Borrow records cache unavailable: {e}')
+            body = None
+        if body is not None:
+            response = Response(body, status=200, mimetype='application/json')
+            response.set_etag(etag, weak=True)
+            return response
+    
     # Pagination
     page, per_page = get_pagination_params(request, default_per_page=10, max_per_page=100)
     
+    # Đọc request.args một lần; giá trị đã là str nên lấy thẳng, không qua type=... của Werkzeug
+    args = request.args
+    after = args.get('after')
+    
     # Filtering
-    status = request.args.get('status', type=str)
-    borrower_name = request.args.get('borrower_name', type=str)
-    borrower_email = request.args.get('borrower_email', type=str)
-    book_id = request.args.get('book_id', type=int)
+    status = args.get('status')
+    borrower_name = args.get('borrower_name')
+    borrower_email = args.get('borrower_email')
+    try:
+        book_id = int(args['book_id'])
+    except (KeyError, ValueError):
+        book_id = None
     
     # Sorting parameters
-    sort_by = request.args.get('sort_by', 'borrow_date', type=str)
-    sort_order = request.args.get('sort_order', 'desc', type=str)
+    sort_by = args.get('sort_by', 'borrow_date')
+    sort_order = args.get('sort_order', 'desc')
     
-    # Build query
-    query = BorrowRecord.query
+    # Điều kiện lọc - dùng chung cho câu chữ ký (ETag) và câu lấy trang
+    conditions = []
     
-    if status in ['borrowed', 'returned']:
-        query = query.filter_by(status=status)
+    if status in BORROW_STATUSES:
+        conditions.append(BorrowRecord.status == status)
     
     if borrower_name:
-        query = query.filter(BorrowRecord.borrower_name.ilike(f'%{borrower_name}%'))
+        conditions.append(BorrowRecord.borrower_name.ilike(f'%{borrower_name}%'))
     
     if borrower_email:
-        query = query.filter(BorrowRecord.borrower_email.ilike(f'%{borrower_email}%'))
+        conditions.append(BorrowRecord.borrower_email.ilike(f'%{borrower_email}%'))
     
     if book_id:
-        query = query.filter_by(book_id=book_id)
-    
-    # Apply sorting
-    valid_sort_fields = ['borrow_date', 'return_date', 'borrower_name', 'borrower_email', 'status']
-    if sort_by in valid_sort_fields:
-        sort_column = getattr(BorrowRecord, sort_by)
-        if sort_order.lower() == 'asc':
-            query = query.order_by(sort_column.asc())
-        else:
-            query = query.order_by(sort_column.desc())
+        conditions.append(BorrowRecord.book_id == book_id)
+    
+    # ETag từ chữ ký của tập kết quả (một dòng aggregate): mượn thêm làm đổi MAX(borrow_date)
+    # và COUNT, trả sách làm đổi MAX(return_date), sửa tên/tác giả sách (có trong response
+    # qua JOIN) làm đổi MAX(books.updated_at). Client có ETag khớp nhận 304 ngay,
+    # không phải paginate và serialize cả trang. COUNT cũng là total của chế độ page
+    signature = db.session.execute(
+        select(
+            func.max(BorrowRecord.borrow_date),
+            func.max(BorrowRecord.return_date),
+            func.count(),
+            func.max(Book.updated_at)
+        ).select_from(BorrowRecord).outerjoin(Book, Book.id == BorrowRecord.book_id).where(*conditions)
+    ).one()
+    total = signature[2]
+    
+    if version is None:
+        etag = signature_etag(tuple(signature), request.query_string)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+    
+    # Đọc bằng Core: chỉ các cột của to_dict() (tên/tác giả sách qua LEFT JOIN), mỗi dòng
+    # là Row - không dựng ORM object, không identity map cho danh sách chỉ đọc
+    stmt = BorrowRecord.select_dict_columns().where(*conditions)
+    
+    # Apply sorting (id làm tiebreak để thứ tự ổn định giữa các trang)
+    if sort_by in BORROW_SORT_FIELDS:
+        descending = sort_order.lower() != 'asc'
     else:
-        query = query.order_by(BorrowRecord.borrow_date.desc())
-    
-    # Execute with pagination
-    pagination = query.paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    
-    # Format response using helper function
-    response_data = format_pagination_response(pagination, items_key='records')
+        sort_by, descending = 'borrow_date', True
+    sort_column = getattr(BorrowRecord, sort_by)
+    if descending:
+        stmt = stmt.order_by(sort_column.desc(), BorrowRecord.id.desc())
+    else:
+        stmt = stmt.order_by(sort_column.asc(), BorrowRecord.id.asc())
+    
+    # return_date là NULL với sách chưa trả - so sánh keyset không áp dụng được
+    keyset_supported = sort_by != 'return_date'
+    
+    if after:
+        # Keyset pagination: đọc tiếp từ cursor trên index (status, borrow_date), không OFFSET/COUNT
+        try:
+            if not keyset_supported:
+                raise ValueError('Cursor pagination does not support sort_by=return_date')
+            sort_value, last_id = decode_cursor(after)
+            if sort_by == 'borrow_date':
+                sort_value = datetime.fromisoformat(sort_value)
+        except (ValueError, TypeError):
+            return jsonify({
+                'error': 'Bad Request',
+                'message': 'Invalid pagination cursor'
+            }), 400
+        
+        # Lấy dư 1 dòng để biết còn trang sau mà không cần query thêm
+        rows = db.session.execute(stmt.where(
+            keyset_condition(sort_column, BorrowRecord.id, descending, sort_value, last_id)
+        ).limit(per_page + 1)).all()
+        next_cursor = None
+        if len(rows) > per_page:
+            rows = rows[:per_page]
+            next_cursor = encode_cursor(getattr(rows[-1], sort_by), rows[-1].id)
+        
+        response_data = format_cursor_response(
+            [BorrowRecord.row_to_dict(row) for row in rows], per_page, next_cursor, items_key='records'
+        )
+    else:
+        rows = db.session.execute(stmt.limit(per_page).offset((page - 1) * per_page)).all()
+        
+        # Cursor của trang sau để client chuyển sang ?after=
+        next_cursor = None
+        if keyset_supported and rows and page * per_page < total:
+            next_cursor = encode_cursor(getattr(rows[-1], sort_by), rows[-1].id)
+        
+        # Format response using helper function
+        response_data = format_page_response(
+            [BorrowRecord.row_to_dict(row) for row in rows], page, per_page, total,
+            items_key='records', next_cursor=next_cursor
+        )
     
-    return jsonify({
+    body = orjson.dumps({
         'success': True,
         'data': response_data
-    }), 200
+    }, option=ORJSON_OPTION)
+    
+    if version is not None:
+        try:
+            cache.set(cache_key, body, ex=BORROW_LIST_CACHE_TTL)
+        except Exception as e:
+            current_app.logger.warning(f'Could not cache borrow records: {e}')
+    
+    response = Response(body, status=200, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    
+    return response
 
 
 @api.route('/borrow-records/<int:record_id>', methods=['GET'])
@@ -549,18 +808,40 @@ def get_borrow_record(current_user, record_id):
     REST Principles:
     - Cacheable: Private cache 60s
     """
-    record = BorrowRecord.query.get(record_id)
+    cached = _record_bodies.get(record_id)
     
-    if not record:
-        return jsonify({
-            'error': 'Not Found',
-            'message': f'Borrow record with id {record_id} not found'
-        }), 404
+    if cached is not None:
+        etag, body = cached
+    else:
+        # Record chỉ đổi khi trả sách (return_date): ETag tính từ một cột qua primary key,
+        # client có ETag khớp nhận 304 mà không phải đọc cả dòng + sách
+        version = db.session.execute(
+            select(BorrowRecord.return_date).where(BorrowRecord.id == record_id)
+        ).first()
+        
+        if version is None:
+            return jsonify({
+                'error': 'Not Found',
+                'message': f'Borrow record with id {record_id} not found'
+            }), 404
+        
+        etag = signature_etag(record_id, version.return_date)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        
+        record = db.session.get(BorrowRecord, record_id, options=[joinedload(BorrowRecord.book)])
+        body = orjson.dumps({
+            'success': True,
+            'data': record.to_dict()
+        }, option=ORJSON_OPTION)
+        _record_bodies.set(record_id, (etag, body))
     
-    return jsonify({
-        'success': True,
-        'data': record.to_dict()
-    }), 200
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    
+    response = Response(body, status=200, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    return response
 
 
 @api.route('/borrow-records', methods=['POST'])
@@ -592,46 +873,168 @@ def create_borrow_record(current_user):
         }), 400
     
     book_id = data['book_id']
-    book = Book.query.get(book_id)
+    borrower_name = data['borrower_name']
+    borrower_email = data['borrower_email']
     
-    if not book:
+    try:
+        # Decrease available count bằng UPDATE có điều kiện (kiểm tra và trừ nguyên tử - hai
+        # request mượn cuốn cuối cùng không thể cùng thành công) rồi tạo record; RETURNING
+        # trả luôn dữ liệu cho response, không SELECT sách trước hay đọc lại record sau commit
+        if db.engine.dialect.name == 'postgresql':
+            # Một round-trip: UPDATE và INSERT chung một câu (CTE)
+            row = db.session.execute(
+                borrow_book_statement(book_id, borrower_name, borrower_email)
+            ).first()
+            record_data = BorrowRecord.row_to_dict(row) if row is not None else None
+        else:
+            # SQLite không cho UPDATE/INSERT trong WITH: hai câu có RETURNING
+            book_row = db.session.execute(
+                update(Book)
+                .where(Book.id == book_id, Book.available > 0)
+                .values(available=Book.available - 1)
+                .returning(Book.id, Book.title, Book.author)
+            ).first()
+            record_data = None
+            if book_row is not None:
+                record_row = db.session.execute(
+                    insert(BorrowRecord).values(
+                        book_id=book_row.id,
+                        borrower_name=borrower_name,
+                        borrower_email=borrower_email,
+                        status='borrowed'
+                    ).returning(*BorrowRecord.__table__.c)
+                ).one()
+                record_data = dict(
+                    record_row._mapping, book_title=book_row.title, book_author=book_row.author
+                )
+        
+        if record_data is None:
+            # Không có dòng nào được cập nhật: sách không tồn tại hoặc đã hết
+            exists = db.session.get(Book, book_id) is not None
+            db.session.rollback()
+            if not exists:
+                return jsonify({
+                    'error': 'Not Found',
+                    'message': f'Book with id {book_id} not found'
+                }), 404
+            return jsonify({
+                'error': 'Conflict',
+                'message': 'Book is not available for borrowing'
+            }), 409
+        
+        db.session.commit()
+        invalidate_book_body(record_data['book_id'])
+        invalidate_statistics()
+        invalidate_borrow_records()
+        
         return jsonify({
-            'error': 'Not Found',
-            'message': f'Book with id {book_id} not found'
-        }), 404
+            'success': True,
+            'message': 'Book borrowed successfully',
+            'data': record_data
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({
+            'error': 'Internal Server Error',
+            'message': f'Failed to create borrow record: {str(e)}'
+        }), 500
+
+
+@api.route('/borrow-records/bulk', methods=['POST'])
+@token_required
+def create_borrow_records_bulk(current_user):
+    """
+    POST /api/borrow-records/bulk
+    Mượn nhiều sách trong một request (cho mượn theo lớp, thư viện lưu động...)
     
-    if book.available <= 0:
+    Request Body: mảng 1..BULK_BORROW_MAX phần tử
+    [
+        {"book_id": integer, "borrower_name": "string", "borrower_email": "string"},
+        ...
+    ]
+    
+    REST Principles:
+    - Stateless: Request chứa đầy đủ thông tin
+    - Atomic: Một transaction - tất cả được mượn, hoặc không bản ghi nào được tạo
+    """
+    body, error = parse_body(BorrowBulk, request.get_data())
+    if error:
         return jsonify({
-            'error': 'Conflict',
-            'message': 'Book is not available for borrowing'
-        }), 409
+            'error': 'Bad Request',
+            'message': error
+        }), 400
     
-    # Create borrow record
-    borrow_record = BorrowRecord(
-        book_id=book_id,
-        borrower_name=data['borrower_name'],
-        borrower_email=data['borrower_email'],
-        status='borrowed'
-    )
+    items = body.root
     
-    # Decrease available count
-    book.available -= 1
+    # Số bản mượn của mỗi sách: mỗi sách một câu UPDATE có điều kiện, trừ một lần đủ số bản
+    counts = Counter(item.book_id for item in items)
     
     try:
-        db.session.add(borrow_record)
+        books = {}
+        for book_id, count in counts.items():
+            book_row = db.session.execute(
+                update(Book)
+                .where(Book.id == book_id, Book.available >= count)
+                .values(available=Book.available - count)
+                .returning(Book.id, Book.title, Book.author)
+            ).first()
+            
+            if book_row is None:
+                # Sách không tồn tại hoặc không đủ bản - hủy cả request
+                exists = db.session.get(Book, book_id) is not None
+                db.session.rollback()
+                if not exists:
+                    return jsonify({
+                        'error': 'Not Found',
+                        'message': f'Book with id {book_id} not found'
+                    }), 404
+                return jsonify({
+                    'error': 'Conflict',
+                    'message': f'Book with id {book_id} does not have {count} copies available for borrowing'
+                }), 409
+            
+            books[book_id] = book_row
+        
+        # executemany: SQLAlchemy gom thành INSERT ... VALUES (...), (...) RETURNING theo lô,
+        # không phải một round-trip cho mỗi bản ghi
+        record_rows = db.session.execute(
+            insert(BorrowRecord).returning(*BorrowRecord.__table__.c, sort_by_parameter_order=True),
+            [
+                {
+                    'book_id': item.book_id,
+                    'borrower_name': item.borrower_name,
+                    'borrower_email': item.borrower_email,
+                    'status': 'borrowed'
+                }
+                for item in items
+            ]
+        ).all()
         db.session.commit()
         
+        for book_id in counts:
+            invalidate_book_body(book_id)
+        invalidate_statistics()
+        invalidate_borrow_records()
+        
+        records = []
+        for row in record_rows:
+            book_row = books[row.book_id]
+            records.append(dict(row._mapping, book_title=book_row.title, book_author=book_row.author))
+        
         return jsonify({
             'success': True,
-            'message': 'Book borrowed successfully',
-            'data': borrow_record.to_dict()
+            'message': f'{len(records)} books borrowed successfully',
+            'data': {
+                'records': records
+            }
         }), 201
         
     except Exception as e:
         db.session.rollback()
         return jsonify({
             'error': 'Internal Server Error',
-            'message': f'Failed to create borrow record: {str(e)}'
+            'message': f'Failed to create borrow records: {str(e)}'
         }), 500
 
 
@@ -646,36 +1049,54 @@ def return_book(current_user, record_id):
     - Stateless: Chỉ cần record_id
     - Idempotent: Có thể gọi nhiều lần (lần 2 trở đi trả 409)
     """
-    record = BorrowRecord.query.get(record_id)
-    
-    if not record:
-        return jsonify({
-            'error': 'Not Found',
-            'message': f'Borrow record with id {record_id} not found'
-        }), 404
-    
-    if record.status == 'returned':
-        return jsonify({
-            'error': 'Conflict',
-            'message': 'Book has already been returned'
-        }), 409
-    
-    # Update status
-    record.status = 'returned'
-    record.return_date = datetime.utcnow()
-    
-    # Increase available count
-    book = Book.query.get(record.book_id)
-    if book:
-        book.available += 1
-    
     try:
+        # Update status: UPDATE có điều kiện status='borrowed' - kiểm tra và ghi nguyên tử
+        # (hai request trả cùng record không thể cùng cộng available); RETURNING thay cho đọc record
+        record_row = db.session.execute(
+            update(BorrowRecord)
+            .where(BorrowRecord.id == record_id, BorrowRecord.status == 'borrowed')
+            .values(status='returned', return_date=datetime.utcnow())
+            .returning(*BorrowRecord.__table__.c)
+        ).first()
+        
+        if record_row is None:
+            # Không có dòng nào được cập nhật: record không tồn tại hoặc đã trả
+            exists = db.session.execute(
+                select(BorrowRecord.id).where(BorrowRecord.id == record_id)
+            ).first() is not None
+            db.session.rollback()
+            if not exists:
+                return jsonify({
+                    'error': 'Not Found',
+                    'message': f'Borrow record with id {record_id} not found'
+                }), 404
+            return jsonify({
+                'error': 'Conflict',
+                'message': 'Book has already been returned'
+            }), 409
+        
+        # Increase available count: UPDATE nguyên tử trên database, không cộng trên giá trị đã đọc
+        book_row = db.session.execute(
+            update(Book)
+            .where(Book.id == record_row.book_id)
+            .values(available=Book.available + 1)
+            .returning(Book.title, Book.author)
+        ).first()
         db.session.commit()
+        invalidate_book_body(record_row.book_id)
+        invalidate_statistics()
+        invalidate_borrow_records()
+        _record_bodies.pop(record_id)
+        
+        record_data = dict(record_row._mapping)
+        if book_row is not None:
+            record_data['book_title'] = book_row.title
+            record_data['book_author'] = book_row.author
         
         return jsonify({
             'success': True,
             'message': 'Book returned successfully',
-            'data': record.to_dict()
+            'data': record_data
         }), 200
         
     except Exception as e:
@@ -701,14 +1122,82 @@ def get_statistics():
     - Stateless: Tính toán real-time từ database
     - Cacheable: Public cache 30s (thống kê thay đổi thường xuyên)
     """
-    total_books = Book.query.count()
-    total_copies = db.session.query(db.func.sum(Book.quantity)).scalar() or 0
-    available_copies = db.session.query(db.func.sum(Book.available)).scalar() or 0
-    borrowed_copies = BorrowRecord.query.filter_by(status='borrowed').count()
-    total_borrow_records = BorrowRecord.query.count()
-    returned_records = BorrowRecord.query.filter_by(status='returned').count()
+    cached = _stats_bodies.get(STATS_CACHE_KEY)
+    if cached is not None:
+        etag, body = cached
+    else:
+        cache = get_shared_cache()
+        # Redis lỗi hoặc không cấu hình: vẫn trả thống kê từ database
+        version = get_cache_version(cache, STATS_VERSION_KEY)
+        
+        if version is None:
+            body = build_statistics_body()
+            etag = body_etag(body)
+        else:
+            # ETag theo version: trả 304 trước khi đọc body hay chạy aggregate
+            etag = signature_etag(STATS_CACHE_KEY, version)
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+            try:
+                body = get_cached_statistics_body(cache, version)
+            except Exception as e:
+                current_app.logger.warning(f'Statistics cache unavailable: {e}')
+                body = build_statistics_body()
+        
+        _stats_bodies.set(STATS_CACHE_KEY, (etag, body))
     
-    return jsonify({
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    
+    response = Response(body, status=200, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def get_cached_statistics_body(cache, version):
+    """
+    Body statistics của version từ Redis; miss thì tính lại và lưu
+    (chỉ một request giữ lock tính lại)
+    """
+    key = f'{STATS_CACHE_KEY}:v{version}'
+    body = cache.get(key)
+    if body is not None:
+        return body
+    
+    lock_key = key + ':lock'
+    if cache.set(lock_key, '1', nx=True, ex=STATS_LOCK_TTL):
+        try:
+            body = build_statistics_body()
+            cache.set(key, body, ex=STATS_CACHE_TTL)
+        finally:
+            cache.delete(lock_key)
+        return body
+    
+    # Request khác đang tính: chờ kết quả, quá lâu thì tự tính (không ghi vào cache)
+    for _ in range(STATS_LOCK_RETRIES):
+        time.sleep(STATS_LOCK_WAIT)
+        body = cache.get(key)
+        if body is not None:
+            return body
+    return build_statistics_body()
+
+
+def build_statistics_body():
+    """Tính thống kê từ database, trả về body JSON đã serialize (bytes)"""
+    # Một câu aggregate cho mỗi bảng thay vì 6 round-trip;
+    # COUNT(*) FILTER (WHERE ...) đếm cả hai status trong một lần quét
+    total_books, total_copies, available_copies = db.session.query(
+        db.func.count(Book.id),
+        db.func.coalesce(db.func.sum(Book.quantity), 0),
+        db.func.coalesce(db.func.sum(Book.available), 0)
+    ).one()
+    total_borrow_records, borrowed_copies, returned_records = db.session.query(
+        db.func.count(BorrowRecord.id),
+        db.func.count().filter(BorrowRecord.status == 'borrowed'),
+        db.func.count().filter(BorrowRecord.status == 'returned')
+    ).one()
+    
+    return orjson.dumps({
         'success': True,
         'data': {
             'books': {
@@ -723,7 +1212,7 @@ def get_statistics():
                 'returned': returned_records
             }
         }
-    }), 200
+    }, option=ORJSON_OPTION)
 
 
 # ============================================================
@@ -731,19 +1220,17 @@ def get_statistics():
 # ============================================================
 
 @api.route('/health', methods=['GET'])
-@cacheable(cache_type='public', max_age=300, etag_enabled=False)
+@cacheable(cache_type='public', max_age=HEALTH_MAX_AGE, etag_enabled=False)
 def health_check():
     """
     GET /api/health
     Kiểm tra health của API
     
+    Request không có Origin (load balancer) được HealthCheckMiddleware trả trước khi
+    vào Flask; route này phục vụ request từ browser (cần CORS headers)
+    
     REST Principles:
     - Stateless: Không phụ thuộc session hay state
     - Cacheable: Public cache 300s (health status ổn định)
     """
-    return jsonify({
-        'success': True,
-        'status': 'healthy',
-        'service': 'Library Management REST API',
-        'version': '3.0.0'
-    }), 200
+    return Response(HEALTH_BODY, status=200, mimetype='application/json')
@@ -10,9 +10,11 @@ Triển khai kiến trúc Client-Server theo nguyên tắc REST
 """
 from flask import Flask, jsonify
 from flask_cors import CORS
-from models import db
+from models import db, init_search_index
 from api_routes import api
 from config import Config
+from json_provider import OrjsonProvider
+from health import HealthCheckMiddleware
 import os
 
 
@@ -26,6 +28,9 @@ def create_app(config_class=Config):
     # Load configuration
     app.config.from_object(config_class)
     
+    # Dùng orjson cho jsonify (nhanh hơn, serialize datetime trực tiếp)
+    app.json = OrjsonProvider(app)
+    
     # Enable CORS - Quan trọng cho kiến trúc Client-Server
     # Cho phép client từ domain khác gọi API
     # supports_credentials=True: Cho phép gửi cookies qua CORS
@@ -45,9 +50,18 @@ def create_app(config_class=Config):
     # Register API blueprint
     app.register_blueprint(api, url_prefix=config_class.API_PREFIX)
     
+    # Health check của load balancer trả thẳng response dựng sẵn, không vào Flask
+    app.wsgi_app = HealthCheckMiddleware(app.wsgi_app, f'{config_class.API_PREFIX}/health')
+    
     # Create tables
     with app.app_context():
         db.create_all()
+        
+        # Index tìm kiếm chuỗi con cho title/author (FTS5 trên SQLite, pg_trgm trên PostgreSQL)
+        try:
+            app.config['BOOK_SEARCH_FTS'] = init_search_index(db.engine)
+        except Exception as e:
+            print(f"⚠️  Warning: Could not create book search index: {e}")
     
     # Root endpoint
     @app.route('/')
@@ -2,13 +2,66 @@
 JWT Authentication Module
 Triển khai Stateless Authentication theo nguyên tắc REST
 """
+import base64
+import hashlib
+import hmac
+import json
 import jwt
-from datetime import datetime, timedelta
+import threading
+import time
+from collections import OrderedDict
 from functools import wraps
 from flask import request, jsonify
 from config import Config
 
 
+def _b64encode(data):
+    """base64url không padding (theo chuẩn JWT)"""
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def _b64decode(data):
+    """base64url không padding (theo chuẩn JWT)"""
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+# HS256 verify bằng hmac/hashlib của stdlib (C/OpenSSL), không qua các lớp Python của PyJWT
+# Thuật toán khác thì dùng PyJWT như cũ
+_USE_HS256 = Config.JWT_ALGORITHM == 'HS256'
+_SECRET = Config.SECRET_KEY.encode('utf-8')
+
+# HMAC đã nạp key một lần lúc import, mỗi lần ký chỉ copy() trạng thái rồi update
+_HMAC_SHA256 = hmac.new(_SECRET, digestmod=hashlib.sha256)
+
+
+def _sign(signing_input):
+    """Chữ ký HMAC-SHA256 (raw bytes) của signing_input"""
+    mac = _HMAC_SHA256.copy()
+    mac.update(signing_input)
+    return mac.digest()
+
+
+# Header cố định nên base64 một lần lúc import (cùng chuỗi JSON mà PyJWT tạo ra)
+_HEADER_B64 = _b64encode(b'{"alg":"HS256","typ":"JWT"}')
+
+
+def _encode_hs256(payload):
+    """
+    Ký token HS256 từ payload, kết quả giống jwt.encode
+    
+    Chỉ phải serialize + base64 phần payload, header đã có sẵn
+    """
+    payload_b64 = _b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+    signing_input = _HEADER_B64 + b'.' + payload_b64
+    return (signing_input + b'.' + _b64encode(_sign(signing_input))).decode('ascii')
+
+# Cache kết quả verify: token -> (exp, payload), LRU tối đa _VERIFY_CACHE_SIZE token
+# Client đã đăng nhập gửi lại cùng token ở mọi request, chỉ lần đầu phải tính HMAC
+_VERIFY_CACHE_SIZE = 10000
+_verified_tokens = OrderedDict()
+_verified_lock = threading.Lock()
+
+
 def generate_token(username, expires_in=None):
     """
     Tạo JWT token cho user
@@ -28,12 +81,17 @@ def generate_token(username, expires_in=None):
     if expires_in is None:
         expires_in = Config.JWT_EXPIRATION_HOURS * 3600
     
+    # NumericDate dạng số nguyên - PyJWT cũng đổi datetime về đúng giá trị này
+    now = int(time.time())
     payload = {
         'username': username,
-        'exp': datetime.utcnow() + timedelta(seconds=expires_in),
-        'iat': datetime.utcnow()
+        'exp': now + expires_in,
+        'iat': now
     }
     
+    if _USE_HS256:
+        return _encode_hs256(payload)
+    
     token = jwt.encode(
         payload,
         Config.SECRET_KEY,
@@ -58,17 +116,94 @@ def verify_token(token):
     - Chỉ verify signature và expiration từ chính token
     - Mỗi request verify token độc lập
     """
-    try:
-        payload = jwt.decode(
-            token,
-            Config.SECRET_KEY,
-            algorithms=[Config.JWT_ALGORITHM]
-        )
-        return payload
-    except jwt.ExpiredSignatureError:
+    now = time.time()
+    
+    with _verified_lock:
+        entry = _verified_tokens.get(token)
+        if entry is not None:
+            if entry[0] > now:
+                _verified_tokens.move_to_end(token)
+                return entry[1]
+            del _verified_tokens[token]  # Token trong cache đã hết hạn
+    
+    payload = _decode_token(token)
+    if payload is None:
+        return None
+    
+    exp = payload.get('exp')
+    if not isinstance(exp, (int, float)) or exp <= now:
         return None  # Token đã hết hạn
-    except jwt.InvalidTokenError:
-        return None  # Token không hợp lệ
+    
+    with _verified_lock:
+        _verified_tokens[token] = (exp, payload)
+        if len(_verified_tokens) > _VERIFY_CACHE_SIZE:
+            _verified_tokens.popitem(last=False)
+    
+    return payload
+
+
+def forget_token(token):
+    """
+    Bỏ token khỏi cache verify (gọi khi logout)
+    
+    Token vẫn hợp lệ đến khi hết hạn nếu client gửi lại - server stateless không thu hồi token
+    """
+    with _verified_lock:
+        _verified_tokens.pop(token, None)
+
+
+def _decode_token(token):
+    """Verify chữ ký + decode token (chưa kiểm tra exp), None nếu không hợp lệ"""
+    if not _USE_HS256:
+        try:
+            return jwt.decode(
+                token,
+                Config.SECRET_KEY,
+                algorithms=[Config.JWT_ALGORITHM]
+            )
+        except jwt.ExpiredSignatureError:
+            return None  # Token đã hết hạn
+        except jwt.InvalidTokenError:
+            return None  # Token không hợp lệ
+    
+    return _decode_hs256(token)
+
+
+def _decode_hs256(token):
+    """
+    Verify chữ ký HS256 và decode payload, None nếu token không hợp lệ
+    
+    Cùng kết quả với jwt.decode cho token HS256 (trừ bước kiểm tra exp ở verify_token)
+    
+    Tìm hai dấu chấm một lần rồi cắt, chữ ký so sánh ở dạng base64 (không decode phần
+    signature), header trùng _HEADER_B64 (token do server ký) thì không phải parse JSON
+    """
+    try:
+        data = token.encode('ascii')
+    except UnicodeEncodeError:
+        return None  # Ký tự lạ
+    
+    i = data.find(b'.')
+    j = data.find(b'.', i + 1)
+    if i < 0 or j < 0:
+        return None
+    
+    signing_input = data[:j]
+    if not hmac.compare_digest(_b64encode(_sign(signing_input)), data[j + 1:]):
+        return None  # Sai chữ ký
+    
+    try:
+        header_b64 = data[:i]
+        if header_b64 != _HEADER_B64:
+            header = json.loads(_b64decode(header_b64))
+            if not isinstance(header, dict) or header.get('alg') != 'HS256':
+                return None  # Không chấp nhận thuật toán khác (vd: alg=none)
+        
+        payload = json.loads(_b64decode(data[i + 1:j]))
+    except ValueError:
+        return None  # Token không đúng định dạng (base64 / JSON)
+    
+    return payload if isinstance(payload, dict) else None
 
 
 def token_required(f):
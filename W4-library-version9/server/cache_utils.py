@@ -9,10 +9,58 @@ Nguyên tắc Cacheable:
 """
 import hashlib
 import json
+import threading
+import time
+from collections import OrderedDict
 from flask import request, make_response
 from functools import wraps
 from datetime import datetime, timedelta
 
+try:
+    import xxhash
+except ImportError:  # xxhash là tùy chọn - không có thì ETag dùng blake2b của hashlib
+    xxhash = None
+
+
+class LocalTTLCache:
+    """
+    Cache trong process: LRU giới hạn maxsize, mỗi entry hết hạn sau ttl giây
+    
+    Thread-safe (một lock cho mỗi cache). Mỗi worker process có cache riêng và không
+    nhận được lệnh xóa của worker khác - ttl là độ lệch tối đa giữa các worker
+    """
+    
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Giá trị đã cache, None nếu chưa có hoặc đã hết hạn"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def set(self, key, value):
+        """Lưu giá trị, bỏ entry ít dùng nhất khi vượt maxsize"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def pop(self, key):
+        """Xóa entry (gọi sau khi commit thay đổi)"""
+        with self._lock:
+            self._entries.pop(key, None)
+
 
 def generate_etag(data):
     """
@@ -36,6 +84,31 @@ def generate_etag(data):
     return hashlib.md5(content.encode('utf-8')).hexdigest()
 
 
+def body_etag(body):
+    """
+    Tạo ETag (weak) từ body response đã serialize (bytes)
+    
+    Hash thẳng body thay vì parse lại JSON rồi dump có sort_keys; dùng XXH3-128
+    (nhanh hơn MD5 nhiều lần trên body lớn), không có xxhash thì dùng blake2b
+    """
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(body)
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def signature_etag(*parts):
+    """
+    Tạo ETag (weak) từ chữ ký của dữ liệu thay vì từ body đã serialize
+    
+    Chữ ký là vài giá trị rẻ đổi khi dữ liệu đổi (MAX(updated), COUNT(*), query string...)
+    nên endpoint có thể trả 304 trước khi query và serialize cả trang
+    
+    Returns:
+        str: Giá trị ETag (không có dấu ngoặc kép), dùng với response.set_etag(etag, weak=True)
+    """
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=12).hexdigest()
+
+
 def add_cache_headers(response, cache_type='public', max_age=300):
     """
     Thêm cache headers vào response
@@ -111,6 +184,10 @@ def cacheable(cache_type='public', max_age=300, etag_enabled=True):
             else:
                 response = make_response(result)
             
+            # Endpoint tự trả 304 (ETag tính trước khi serialize) - vẫn gắn cache headers
+            if request.method == 'GET' and response.status_code == 304:
+                return add_cache_headers(response, cache_type, max_age)
+            
             # Chỉ cache cho GET requests và success responses (2xx)
             if request.method != 'GET' or response.status_code >= 300:
                 # Non-cacheable responses
@@ -119,28 +196,21 @@ def cacheable(cache_type='public', max_age=300, etag_enabled=True):
             # Thêm Last-Modified header
             response.headers['Last-Modified'] = datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
             
-            # ETag support
-            if etag_enabled:
-                try:
-                    # Lấy response data để tạo ETag
-                    response_json = response.get_json()
-                    if response_json:
-                        etag = generate_etag(response_json)
-                        response.headers['ETag'] = f'"{etag}"'
-                        
-                        # Kiểm tra If-None-Match header (conditional request)
-                        if_none_match = request.headers.get('If-None-Match')
-                        if if_none_match:
-                            # Remove quotes nếu có
-                            client_etag = if_none_match.strip('"')
-                            if client_etag == etag:
-                                # Resource không thay đổi - trả 304 Not Modified
-                                response = make_response('', 304)
-                                response.headers['ETag'] = f'"{etag}"'
-                                return add_cache_headers(response, cache_type, max_age)
-                except:
-                    # Nếu không parse được JSON, bỏ qua ETag
-                    pass
+            # ETag support (bỏ qua nếu endpoint đã tự gắn ETag)
+            if etag_enabled and 'ETag' not in response.headers:
+                body = response.get_data()
+                if body:
+                    etag = body_etag(body)
+                    response.set_etag(etag, weak=True)
+                    
+                    # Kiểm tra If-None-Match header (conditional request, so sánh weak)
+                    if request.if_none_match.contains_weak(etag):
+                        # Resource không thay đổi - trả 304 Not Modified
+                        not_modified = make_response('', 304)
+                        not_modified.set_etag(etag, weak=True)
+                        if 'Vary' in response.headers:
+                            not_modified.headers['Vary'] = response.headers['Vary']
+                        return add_cache_headers(not_modified, cache_type, max_age)
             
             # Thêm cache headers
             return add_cache_headers(response, cache_type, max_age)
@@ -5,6 +5,58 @@ Quản lý cấu hình theo nguyên tắc Stateless
 import os
 from datetime import timedelta
 
+try:
+    import redis
+except ImportError:  # Redis là tùy chọn - không có thì không cache statistics ngoài HTTP cache
+    redis = None
+
+
+def _cache_redis(redis_url):
+    """
+    Redis client cho cache dữ liệu (statistics), None nếu không cấu hình REDIS_URL
+    
+    Connection pool tạo một lần lúc import, các request (và các worker thread)
+    dùng chung, tối đa 32 kết nối - hết chỗ thì chờ thay vì mở thêm
+    """
+    if not redis_url or redis is None:
+        return None
+    pool = redis.BlockingConnectionPool.from_url(
+        redis_url,
+        max_connections=32,
+        socket_keepalive=True
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+def _database_uri(database_url):
+    """
+    URL PostgreSQL không chỉ định driver (postgres:// hoặc postgresql://) dùng psycopg 3
+    thay vì psycopg2 mặc định của SQLAlchemy - xem _engine_options
+    """
+    for prefix in ('postgres://', 'postgresql://'):
+        if database_url.startswith(prefix):
+            return 'postgresql+psycopg://' + database_url[len(prefix):]
+    return database_url
+
+
+def _engine_options(database_uri):
+    """
+    Cấu hình SQLAlchemy engine
+    
+    - query_cache_size: cache câu SQL đã compile (mặc định 500 dạng câu) - đủ chỗ cho mọi tổ hợp
+      filter/sort của các endpoint danh sách; giá trị filter luôn là bound parameter nên
+      không sinh thêm dạng câu mới
+    - psycopg 3: câu nào chạy từ DB_PREPARE_THRESHOLD lần (mặc định 2, psycopg mặc định 5)
+      trên một kết nối thì được PREPARE trên server - PostgreSQL bỏ qua parse/plan ở các lần
+      sau (aggregate của statistics, câu danh sách...). Đặt 0 để tắt khi đi qua PgBouncer
+      ở chế độ transaction pooling
+    """
+    options = {'query_cache_size': 1200}
+    if database_uri.startswith('postgresql+psycopg://'):
+        threshold = int(os.environ.get('DB_PREPARE_THRESHOLD', 2))
+        options['connect_args'] = {'prepare_threshold': threshold or None}
+    return options
+
 
 class Config:
     """
@@ -20,8 +72,9 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
     
     # Database configuration
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///library.db'
+    SQLALCHEMY_DATABASE_URI = _database_uri(os.environ.get('DATABASE_URL') or 'sqlite:///library.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(SQLALCHEMY_DATABASE_URI)
     
     # JWT Configuration
     JWT_EXPIRATION_HOURS = 24  # Token hết hạn sau 24 giờ
@@ -39,6 +92,10 @@ class Config:
     # Pagination defaults
     DEFAULT_PAGE_SIZE = 10
     MAX_PAGE_SIZE = 100
+    
+    # Redis cache (cache-aside) cho GET /statistics - bỏ trống REDIS_URL thì query trực tiếp
+    REDIS_URL = os.environ.get('REDIS_URL')
+    CACHE_REDIS = _cache_redis(REDIS_URL)
 
 
 class DevelopmentConfig(Config):
@@ -52,12 +109,9 @@ class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
     
-    @property
-    def SECRET_KEY(self):
-        secret_key = os.environ.get('SECRET_KEY')
-        if not secret_key:
-            raise ValueError("SECRET_KEY must be set in production")
-        return secret_key
+    # Đọc một lần khi định nghĩa class - from_object lấy trực tiếp giá trị (property trên
+    # class chỉ trả về chính object property). Không fallback về dev key: thiếu thì là None
+    SECRET_KEY = os.environ.get('SECRET_KEY')
 
 
 class TestingConfig(Config):
@@ -65,6 +119,7 @@ class TestingConfig(Config):
     DEBUG = True
     TESTING = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///test_library.db'
+    SQLALCHEMY_ENGINE_OPTIONS = _engine_options(SQLALCHEMY_DATABASE_URI)
 
 
 # Config dictionary
@@ -0,0 +1,45 @@
+"""
+Health Check
+Response health là hằng số - encode một lần khi import, trả thẳng ở tầng WSGI
+(trước routing, request context, CORS và @cacheable của Flask) cho load balancer
+gọi mỗi vài giây trên mọi replica
+"""
+import orjson
+from config import Config
+from json_provider import ORJSON_OPTION
+
+# Public cache 300s (health status ổn định)
+HEALTH_MAX_AGE = 300
+
+HEALTH_BODY = orjson.dumps({
+    'success': True,
+    'status': 'healthy',
+    'service': Config.API_TITLE,
+    'version': Config.API_VERSION
+}, option=ORJSON_OPTION)
+
+
+class HealthCheckMiddleware:
+    """
+    WSGI middleware trả HEALTH_BODY cho GET/HEAD tới path health
+
+    Request có header Origin (gọi từ browser) vẫn đi qua Flask để nhận CORS headers
+    """
+
+    def __init__(self, wsgi_app, path, body=HEALTH_BODY, max_age=HEALTH_MAX_AGE):
+        self.wsgi_app = wsgi_app
+        self.path = path
+        self.body = body
+        self.headers = [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Cache-Control', f'public, max-age={max_age}')
+        ]
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD')
+        if (environ.get('PATH_INFO') == self.path and method in ('GET', 'HEAD')
+                and 'HTTP_ORIGIN' not in environ):
+            start_response('200 OK', list(self.headers))
+            return [] if method == 'HEAD' else [self.body]
+        return self.wsgi_app(environ, start_response)
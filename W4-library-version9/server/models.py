@@ -3,7 +3,10 @@ Database Models
 Định nghĩa cấu trúc dữ liệu cho REST API
 """
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import and_, or_, column, insert, literal, select, table, update
 from datetime import datetime
+import base64
+import json
 
 db = SQLAlchemy()
 
@@ -30,28 +33,109 @@ def get_pagination_params(request, default_per_page=10, max_per_page=100):
     return page, per_page
 
 
-def format_pagination_response(pagination, items_key='items'):
+def encode_cursor(sort_value, last_id):
+    """
+    Tạo cursor (opaque string) từ dòng cuối trang cho keyset pagination
+    
+    Args:
+        sort_value: Giá trị cột đang sort của dòng cuối (datetime ghi dạng ISO)
+        last_id: id của dòng cuối
+    
+    Returns:
+        str: base64url của [sort_value, id]
+    """
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, last_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Giải mã cursor do encode_cursor tạo ra
+    
+    Returns:
+        tuple: (sort_value, last_id) - sort_value là string, datetime cần fromisoformat
+    
+    Raises:
+        ValueError / TypeError nếu cursor không hợp lệ
+    """
+    padded = cursor + '=' * (-len(cursor) % 4)
+    sort_value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+    if not isinstance(sort_value, str) or not isinstance(last_id, int):
+        raise ValueError('Invalid cursor')
+    return sort_value, last_id
+
+
+def keyset_condition(sort_column, id_column, descending, sort_value, last_id):
+    """
+    Điều kiện lấy các dòng đứng sau cursor theo thứ tự (sort_column, id)
+    
+    Thay cho OFFSET: database đọc thẳng từ vị trí cursor trên index
+    thay vì duyệt rồi bỏ qua (page - 1) * per_page dòng
+    """
+    if descending:
+        return or_(sort_column < sort_value, and_(sort_column == sort_value, id_column < last_id))
+    return or_(sort_column > sort_value, and_(sort_column == sort_value, id_column > last_id))
+
+
+def format_pagination_response(pagination, items_key='items', next_cursor=None):
     """
     Helper function để format pagination response
     
     Args:
         pagination: SQLAlchemy pagination object
         items_key: Key name cho items trong response
+        next_cursor: Cursor cho trang tiếp theo (?after=), None nếu hết hoặc không hỗ trợ
     
     Returns:
         dict: Formatted response with pagination metadata
     """
+    return format_page_response(
+        [item.to_dict() for item in pagination.items],
+        pagination.page, pagination.per_page, pagination.total,
+        items_key=items_key, next_cursor=next_cursor
+    )
+
+
+def format_page_response(items, page, per_page, total, items_key='items', next_cursor=None):
+    """
+    Format response phân trang theo page từ dữ liệu đã có sẵn
+    
+    Dùng khi không qua query.paginate() (items đã là dict, total đã đếm ở câu khác).
+    Metadata giống hệt format_pagination_response
+    """
+    pages = (total + per_page - 1) // per_page if total else 0
+    has_next = page < pages
+    has_prev = page > 1
     return {
-        items_key: [item.to_dict() for item in pagination.items],
+        items_key: items,
         'pagination': {
-            'total': pagination.total,
-            'page': pagination.page,
-            'per_page': pagination.per_page,
-            'pages': pagination.pages,
-            'has_next': pagination.has_next,
-            'has_prev': pagination.has_prev,
-            'next_page': pagination.page + 1 if pagination.has_next else None,
-            'prev_page': pagination.page - 1 if pagination.has_prev else None
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'pages': pages,
+            'has_next': has_next,
+            'has_prev': has_prev,
+            'next_page': page + 1 if has_next else None,
+            'prev_page': page - 1 if has_prev else None,
+            'next_cursor': next_cursor
+        }
+    }
+
+
+def format_cursor_response(items, per_page, next_cursor, items_key='items'):
+    """
+    Format response cho keyset pagination (?after=<cursor>)
+    
+    items: danh sách đã serialize (dict). Không có total/pages: chế độ cursor bỏ qua câu COUNT(*)
+    """
+    return {
+        items_key: items,
+        'pagination': {
+            'per_page': per_page,
+            'has_next': next_cursor is not None,
+            'next_cursor': next_cursor
         }
     }
 
@@ -80,6 +164,9 @@ class Book(db.Model):
         """
         Chuyển đổi object thành dictionary (JSON-serializable)
         
+        Gọi được dạng Book.to_dict(row) với Row của INSERT/UPDATE ... RETURNING
+        (Row có cùng tên attribute với các cột)
+        
         REST principle: Resource representation
         """
         return {
@@ -89,14 +176,96 @@ class Book(db.Model):
             'isbn': self.isbn,
             'quantity': self.quantity,
             'available': self.available,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
+            'created_at': self.created_at,
+            'updated_at': self.updated_at
         }
     
     def __repr__(self):
         return f'<Book {self.title}>'
 
 
+# ============================================================
+# Tìm kiếm chuỗi con theo title / author
+# ILIKE '%x%' không dùng được B-tree index nên phải quét cả bảng books:
+# - SQLite: bảng FTS5 tokenizer trigram (external content, đồng bộ bằng trigger),
+#   LIKE trên bảng FTS dùng index trigram
+# - PostgreSQL: GIN index pg_trgm, planner tự dùng cho ILIKE - không đổi query
+# ============================================================
+
+# Bảng FTS5 không khai báo trong metadata (create_all không tạo), chỉ dùng để query
+books_fts = table('books_fts', column('rowid'), column('title'), column('author'))
+
+# Trigram index chỉ giúp được khi chuỗi tìm có từ 3 ký tự
+SEARCH_MIN_LENGTH = 3
+
+_SQLITE_SEARCH_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+    "title, author, content='books', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_ai AFTER INSERT ON books BEGIN "
+    "INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_ad AFTER DELETE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_au AFTER UPDATE OF title, author ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author) VALUES ('delete', old.id, old.title, old.author); "
+    "INSERT INTO books_fts(rowid, title, author) VALUES (new.id, new.title, new.author); END",
+)
+
+_POSTGRES_SEARCH_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_books_title_trgm ON books USING gin (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_books_author_trgm ON books USING gin (author gin_trgm_ops)",
+    # Filter borrower_name / borrower_email (ILIKE '%x%') của GET /borrow-records
+    "CREATE INDEX IF NOT EXISTS ix_br_borrower_name_trgm ON borrow_records USING gin (borrower_name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_br_borrower_email_trgm ON borrow_records USING gin (borrower_email gin_trgm_ops)",
+)
+
+
+def init_search_index(engine):
+    """
+    Tạo index tìm kiếm chuỗi con cho books (chạy lại nhiều lần không sao)
+    PostgreSQL: thêm index trigram cho borrower_name / borrower_email của borrow_records
+    
+    Args:
+        engine: SQLAlchemy engine (db.engine), bảng books và borrow_records đã được tạo
+    
+    Returns:
+        bool: True nếu dùng bảng books_fts (SQLite) - book_contains lọc qua FTS
+    """
+    dialect = engine.dialect.name
+    
+    if dialect == 'postgresql':
+        with engine.begin() as conn:
+            for statement in _POSTGRES_SEARCH_DDL:
+                conn.exec_driver_sql(statement)
+        return False
+    
+    if dialect != 'sqlite':
+        return False
+    
+    with engine.begin() as conn:
+        existed = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'books_fts'"
+        ).first() is not None
+        for statement in _SQLITE_SEARCH_DDL:
+            conn.exec_driver_sql(statement)
+        if not existed:
+            # Database cũ đã có sách: nạp index từ bảng books
+            conn.exec_driver_sql("INSERT INTO books_fts(books_fts) VALUES ('rebuild')")
+    return True
+
+
+def book_contains(field, term, use_fts=False):
+    """
+    Điều kiện "field chứa term" (không phân biệt hoa thường), field là 'title' hoặc 'author'
+    
+    use_fts: bảng books_fts đã sẵn sàng (kết quả init_search_index)
+    """
+    pattern = f'%{term}%'
+    if use_fts and len(term) >= SEARCH_MIN_LENGTH:
+        return Book.id.in_(select(books_fts.c.rowid).where(books_fts.c[field].like(pattern)))
+    return getattr(Book, field).ilike(pattern)
+
+
 class BorrowRecord(db.Model):
     """
     Model cho bản ghi mượn sách
@@ -104,14 +273,31 @@ class BorrowRecord(db.Model):
     Resource representation theo REST principles
     """
     __tablename__ = 'borrow_records'
+    __table_args__ = (
+        # Kiểm tra sách đang mượn khi xóa sách (book_id + status), cũng phục vụ lookup theo book_id
+        db.Index('ix_br_book_status', 'book_id', 'status'),
+        # List lọc status + ORDER BY borrow_date DESC, id DESC: partial index cho từng status, mỗi index
+        # chỉ chứa các dòng khớp điều kiện (status chỉ có 2 giá trị - index toàn bảng kém chọn lọc).
+        # Index 'borrowed' (sách đang mượn) nhỏ và luôn nằm trong cache
+        db.Index(
+            'ix_br_borrowed_borrow_date', db.desc('borrow_date'), db.desc('id'),
+            postgresql_where=db.text("status = 'borrowed'"),
+            sqlite_where=db.text("status = 'borrowed'")
+        ),
+        db.Index(
+            'ix_br_returned_borrow_date', db.desc('borrow_date'), db.desc('id'),
+            postgresql_where=db.text("status = 'returned'"),
+            sqlite_where=db.text("status = 'returned'")
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
-    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False, index=True)
+    book_id = db.Column(db.Integer, db.ForeignKey('books.id'), nullable=False)
     borrower_name = db.Column(db.String(100), nullable=False, index=True)
     borrower_email = db.Column(db.String(100), nullable=False, index=True)
     borrow_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     return_date = db.Column(db.DateTime, nullable=True)
-    status = db.Column(db.String(20), default='borrowed', index=True)  # 'borrowed' hoặc 'returned'
+    status = db.Column(db.String(20), default='borrowed')  # 'borrowed' hoặc 'returned'
     
     def to_dict(self, include_book=True):
         """
@@ -127,16 +313,77 @@ class BorrowRecord(db.Model):
             'book_id': self.book_id,
             'borrower_name': self.borrower_name,
             'borrower_email': self.borrower_email,
-            'borrow_date': self.borrow_date.isoformat(),
-            'return_date': self.return_date.isoformat() if self.return_date else None,
+            'borrow_date': self.borrow_date,
+            'return_date': self.return_date,
             'status': self.status
         }
         
-        if include_book and self.book:
-            result['book_title'] = self.book.title
-            result['book_author'] = self.book.author
+        if include_book:
+            book = self.book
+            if book:
+                result['book_title'] = book.title
+                result['book_author'] = book.author
         
         return result
     
+    @classmethod
+    def select_dict_columns(cls):
+        """
+        SELECT đúng các cột của to_dict(), kèm tên/tác giả sách qua LEFT JOIN
+        
+        Endpoint danh sách đọc Row bằng Core, không dựng ORM object cho từng record;
+        row_to_dict(row) cho cùng key với to_dict()
+        """
+        return select(
+            cls.id, cls.book_id, cls.borrower_name, cls.borrower_email,
+            cls.borrow_date, cls.return_date, cls.status,
+            Book.title.label('book_title'), Book.author.label('book_author')
+        ).outerjoin(Book, Book.id == cls.book_id)
+    
+    @staticmethod
+    def row_to_dict(row):
+        """Dict từ một Row của select_dict_columns() - giống to_dict()"""
+        result = dict(row._mapping)
+        if result['book_title'] is None:
+            # Sách không còn - to_dict() cũng không có book_title / book_author
+            del result['book_title'], result['book_author']
+        return result
+    
     def __repr__(self):
         return f'<BorrowRecord {self.borrower_name} - {self.book.title if self.book else "Unknown"}>'
+
+
+def borrow_book_statement(book_id, borrower_name, borrower_email):
+    """
+    Một câu SQL cho thao tác mượn sách (PostgreSQL - data-modifying CTE):
+    
+        WITH upd AS (UPDATE books SET available = available - 1
+                     WHERE id = :book_id AND available > 0 RETURNING id, title, author),
+             ins AS (INSERT INTO borrow_records (...) SELECT ... FROM upd RETURNING ...)
+        SELECT ins.*, upd.title AS book_title, upd.author AS book_author FROM ins JOIN upd
+    
+    Không còn bản nào (hoặc không có sách) thì UPDATE không trả dòng nào, INSERT cũng không
+    chạy - kết quả rỗng. Mỗi dòng trả về dùng với BorrowRecord.row_to_dict()
+    """
+    upd = (
+        update(Book)
+        .where(Book.id == book_id, Book.available > 0)
+        .values(available=Book.available - 1)
+        .returning(Book.id, Book.title, Book.author)
+        .cte('upd')
+    )
+    ins = (
+        insert(BorrowRecord)
+        .from_select(
+            ['book_id', 'borrower_name', 'borrower_email', 'borrow_date', 'status'],
+            select(
+                upd.c.id, literal(borrower_name), literal(borrower_email),
+                literal(datetime.utcnow()), literal('borrowed')
+            )
+        )
+        .returning(*BorrowRecord.__table__.c)
+        .cte('ins')
+    )
+    return select(
+        ins, upd.c.title.label('book_title'), upd.c.author.label('book_author')
+    ).join(upd, upd.c.id == ins.c.book_id)
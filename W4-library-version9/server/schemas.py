@@ -0,0 +1,90 @@
+"""
+Request Schemas
+Validate body JSON bằng pydantic v2 - parse và validate trong một lần gọi
+(pydantic-core viết bằng Rust), thay cho request.get_json() + chuỗi if/isinstance
+"""
+from typing import ClassVar, List, Optional
+from pydantic import BaseModel, Field, RootModel, StrictInt, ValidationError
+
+# Số bản ghi tối đa trong một request POST /api/borrow-records/bulk
+BULK_BORROW_MAX = 500
+
+
+class LoginBody(BaseModel):
+    """Body của POST /api/auth/login"""
+    ERROR_MESSAGE: ClassVar[str] = 'Username and password are required'
+
+    username: str = Field(min_length=1)
+    password: str = Field(min_length=1)
+
+
+class BookCreate(BaseModel):
+    """Body của POST /api/books"""
+    ERROR_MESSAGE: ClassVar[str] = 'Missing required fields: title, author, isbn, quantity'
+
+    title: str = Field(min_length=1, max_length=200)
+    author: str = Field(min_length=1, max_length=100)
+    isbn: str = Field(min_length=1, max_length=13)
+    quantity: StrictInt = Field(ge=1)
+
+
+class BookUpdate(BaseModel):
+    """Body của PUT /api/books/{id} - mọi field đều optional"""
+    ERROR_MESSAGE: ClassVar[str] = 'No data provided'
+
+    title: Optional[str] = Field(None, min_length=1, max_length=200)
+    author: Optional[str] = Field(None, min_length=1, max_length=100)
+    isbn: Optional[str] = Field(None, min_length=1, max_length=13)
+    quantity: Optional[StrictInt] = Field(None, ge=1)
+
+
+class BorrowCreate(BaseModel):
+    """Một bản ghi mượn sách (phần tử của body POST /api/borrow-records/bulk)"""
+    ERROR_MESSAGE: ClassVar[str] = 'Missing required fields: book_id, borrower_name, borrower_email'
+
+    book_id: StrictInt = Field(ge=1)
+    borrower_name: str = Field(min_length=1, max_length=100)
+    borrower_email: str = Field(min_length=1, max_length=100)
+
+
+class BorrowBulk(RootModel[List[BorrowCreate]]):
+    """Body của POST /api/borrow-records/bulk - mảng 1..BULK_BORROW_MAX bản ghi"""
+    ERROR_MESSAGE: ClassVar[str] = (
+        f'Request body must be an array of 1-{BULK_BORROW_MAX} borrow records '
+        'with book_id, borrower_name, borrower_email'
+    )
+
+    root: List[BorrowCreate] = Field(min_length=1, max_length=BULK_BORROW_MAX)
+
+
+def parse_body(model, raw):
+    """
+    Parse body (bytes) thành model
+
+    Returns:
+        tuple: (instance, None) nếu hợp lệ, (None, message) nếu không
+    """
+    try:
+        return model.model_validate_json(raw), None
+    except ValidationError as e:
+        return None, error_message(model, e)
+
+
+def error_message(model, error):
+    """
+    Chuyển ValidationError thành message giống các message validate cũ
+
+    - JSON lỗi / thiếu field: message mặc định của model
+    - quantity sai: 'Quantity must be a positive integer'
+    - field khác sai kiểu/độ dài: tên field + message của pydantic
+      (phần tử của mảng ghi kèm vị trí, ví dụ '2.book_id')
+    """
+    for err in error.errors():
+        loc = err['loc']
+        if not loc or err['type'] == 'missing' or not isinstance(loc[-1], str):
+            continue
+        if loc[-1] == 'quantity':
+            return 'Quantity must be a positive integer'
+        field = '.'.join(str(part) for part in loc)
+        return f"Invalid field '{field}': {err['msg']}"
+    return model.ERROR_MESSAGE